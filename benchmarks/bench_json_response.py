@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark: JSON response encoding throughput and peak memory.
+
+Compares building the whole response with json.dumps(...).encode() against
+the streamed writer (iter_json_chunks), each with the stdlib encoder and with
+orjson when it is installed. Peak memory is the tracemalloc high-water mark
+above the page itself, i.e. what encoding adds on top of the results.
+Then times /api/search round trips against a temporary server.
+
+    python benchmarks/bench_json_response.py [--items 500] [--body-kb 32]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from http.server import HTTPServer
+
+from common import make_text, median_ms  # Puts the repository root on the import path
+
+import chatCAT_server
+from chatCAT_server import ChatCATHandler, ChatDatabase, dump_json, iter_json_chunks
+
+
+def make_page(items, body_bytes, seed):
+    rng = random.Random(seed)
+    return [{
+        'id': i,
+        'platform': 'claude',
+        'conversation_id': f'conv-{i}',
+        'timestamp': '2025-01-28 12:00:00',
+        'user_message': make_text(rng, body_bytes // 8),
+        'ai_response': make_text(rng, body_bytes),
+        'user_length': body_bytes // 8,
+        'ai_length': body_bytes,
+        'notes': '',
+        'tags': ['work'],
+        'relevance': 1.5,
+        'highlights': {'user_message': [[0, 4]], 'ai_response': [[10, 14]], 'notes': []}
+    } for i in range(items)]
+
+
+def whole(fields, key, items):
+    data = dict(fields)
+    data[key] = list(items)
+    yield dump_json(data)
+
+
+def measure(writer, page, repeat):
+    """Return (MB/s, peak extra bytes) of writing page to a discarding sink"""
+    fields = {'query': 'backoff', 'total': len(page), 'offset': 0, 'limit': len(page)}
+    
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    written = sum(len(chunk) for chunk in writer(fields, 'results', iter(page)))
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for chunk in writer(fields, 'results', iter(page)):
+            pass
+    elapsed = (time.perf_counter() - start) / repeat
+    return written / elapsed / 1e6, peak
+
+
+def bench_http(db, limit, repeat):
+    """Median /api/search round trip for one page, in ms"""
+    ChatCATHandler.db = db
+    httpd = HTTPServer(('127.0.0.1', 0), ChatCATHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{httpd.server_port}/api/search?q=backoff&limit={limit}'
+    
+    def fetch():
+        with urllib.request.urlopen(url) as response:
+            response.read()
+    
+    try:
+        return median_ms(fetch, repeat)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--body-kb', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    
+    page = make_page(args.items, args.body_kb * 1024, args.seed)
+    encoders = [('stdlib', None)]
+    if chatCAT_server.orjson is not None:
+        encoders.append(('orjson', chatCAT_server.orjson))
+    
+    print(f"\nPage of {args.items} results with {args.body_kb} KB bodies")
+    print(f"{'encoder':<8} {'writer':<8} {'throughput':>12} {'peak memory':>12}")
+    installed = chatCAT_server.orjson
+    try:
+        for name, module in encoders:
+            chatCAT_server.orjson = module
+            for writer_name, writer in (('whole', whole), ('stream', iter_json_chunks)):
+                rate, peak = measure(writer, page, args.repeat)
+                print(f"{name:<8} {writer_name:<8} {rate:>9.0f}MB/s {peak / 1e6:>10.2f}MB")
+    finally:
+        chatCAT_server.orjson = installed
+    
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='chatcat-bench-')
+    try:
+        db = ChatDatabase(os.path.join(workdir, 'bench.db'))
+        db.add_records([('claude', f'conv-{i}', make_text(rng, 200), make_text(rng, args.body_kb * 1024),
+                         None, 0) for i in range(args.chats)])
+        
+        print(f"\n/api/search round trip, {args.chats} chats with {args.body_kb} KB bodies")
+        for name, module in encoders:
+            chatCAT_server.orjson = module
+            for limit in (50, 500):
+                print(f"{name:<8} limit={limit:<4} {bench_http(db, limit, 20):>8.2f}ms")
+    finally:
+        chatCAT_server.orjson = installed
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""
+Helpers shared by the benchmark scripts: puts the repository root on the
+import path and generates chat-like text.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+WORDS = ('the function returns a list of values when the request succeeds and raises an error '
+         'otherwise you can retry with exponential backoff to avoid overloading the server '
+         'database index query cache thread async await import config parse token').split()
+
+
+def make_text(rng, size):
+    """Roughly size characters of words drawn from WORDS"""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def median_ms(run, repeats):
+    """Median time of calling run(), in ms"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)[len(times) // 2]
@@ -7,39 +7,1043 @@ VISUAL UPDATE: Compressed layout, Solid UI, Segmented Controls
 import sqlite3
 import json
 import re
+import zlib
+import hashlib
+import argparse
+import calendar
+import csv
+import gzip
+import io
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+import unicodedata
+from collections import Counter, deque
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs, urlparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import chain
+from urllib.parse import parse_qs, quote, urlparse
+from urllib.request import urlopen
 import traceback
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 DB_FILE = 'ai_chats.db'
+COMPRESSION = None          # None, 'zlib' or 'zstd' for newly stored bodies
+PREVIEW_CHARS = 300         # Body prefix returned with search results
+SNIPPET_TOKENS = 32         # Size of the matched window shown for query results
+EXPORT_BATCH = 500          # Rows whose bodies are read per query when exporting
+STREAM_CHUNK_BYTES = 65536  # Streamed response output buffered per chunk written
+SYNC_BATCH = 500            # Changes pulled per /api/changes page and applied per transaction
+SYNC_MAX_BATCH = 5000       # Largest page /api/changes serves
+
+# Last path segments older userscripts sent as the conversation id of pages
+# that have none (a new chat, an app's start page). Unrelated chats share
+# them, so turns sent under them are stored like captures without an ordinal.
+PLACEHOLDER_CONVERSATION_IDS = frozenset({'', 'unknown', 'app', 'new', 'chat'})
+
+# Request body limits, in decoded bytes. /api/add takes a whole conversation,
+# notes and tag edits are small; NDJSON batches are parsed line by line and
+# each line is held to MAX_BODY_BYTES.
+MAX_BODY_BYTES = 16 * 1024 * 1024
+MAX_FORM_BYTES = 1024 * 1024
+MAX_BATCH_BYTES = 256 * 1024 * 1024
+INGEST_BATCH = 200          # NDJSON records, or queued exchanges, stored per transaction
+INGEST_QUEUE_DEPTH = 1024   # Captures waiting for the writer before /api/add answers 503
+INGEST_RETRIES = 3          # Attempts at a group commit before storing its exchanges one by one
+INGEST_RETRY_DELAY = 0.5    # Seconds before the first retry, doubled for each one after
+BOOTSTRAP_PAGE = 50         # Recent chats included in /api/bootstrap (the dashboard's page size)
+EVENT_HISTORY = 256         # Live events kept for listeners that reconnect
+EVENT_MAX_CHATS = 50        # Larger writes are announced as a reload instead of rows
+SSE_HEARTBEAT = 15          # Seconds between keep-alive comments on /api/events
+
+# Persistent HTTP/1.1 connections: seconds an idle connection stays open,
+# and how many connections are served at once (more get a 503)
+KEEPALIVE_TIMEOUT = 15
+MAX_CONNECTIONS = 64
+
+# Expected JSON types of request fields; absent or null fields are not checked
+ADD_CHAT_FIELDS = {'platform': str, 'conversation_id': (str, int), 'user_message': str,
+                   'ai_response': str, 'turn_index': int, 'turns': list, 'metadata': dict}
+TURN_FIELDS = {'index': int, 'user_message': str, 'ai_response': str}
+NOTES_FIELDS = {'chat_id': int, 'notes': str}
+TAGS_FIELDS = {'chat_id': int, 'tags': (list, str)}
+NEW_TAG_FIELDS = {'name': str, 'color': str}
+
+# Full-text index layout. Prefix indexes on 2 and 3 characters keep the
+# dashboard's search-as-you-type prefix queries fast; set FTS_TOKENIZE to
+# 'trigram' for substring matching instead (SQLite 3.34+). Changing either
+# rebuilds the index on the next start.
+FTS_PREFIX_INDEXES = '2 3'
+FTS_TOKENIZE = 'unicode61'
+FTS_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE chats_fts USING fts5("
+    "user_message, ai_response, notes, tags, "
+    "content=chats_fts_source, content_rowid=id, "
+    f"prefix='{FTS_PREFIX_INDEXES}', tokenize='{FTS_TOKENIZE}')"
+)
+
+# Semantic search (serve --semantic, needs numpy). Exchanges are embedded by
+# feature hashing, so no model or network is needed, and kept int8-quantised
+# in '<db>.vectors'. Changing the embedding layout rebuilds the vectors.
+EMBED_DIM = 256             # Hashed feature buckets per vector
+EMBED_SCALE = 254           # int8 steps per unit; components of a unit vector stay under 0.5
+EMBED_CHARS = 4000          # Prefix of each body that is embedded
+EMBED_BATCH = 256           # Exchanges embedded per transaction
+EMBED_POLL = 30             # Seconds between checks for chats written by other processes
+SEARCH_BLOCK_ROWS = 16384   # Vectors scored per block, bounding the float32 working set
+SEMANTIC_CANDIDATES = 500   # Nearest chats returned by a semantic search
+RRF_K = 60                  # Reciprocal rank fusion constant for hybrid ranking
+EMBED_STOPWORDS = frozenset(
+    'a about an and any are as at be been but by can could chat conversation did do does for '
+    'from had has have how i if in into is it its me my no not of on or our so some that the '
+    'their them then there these this those to was we were what when where which who why will '
+    'with would you your'.split()
+)
+
+# Near-duplicate detection. Every exchange gets a MinHash signature of its
+# prompt's character shingles, split into LSH bands so similar chats share
+# a bucket and are found without comparing against every row. Changing the
+# layout recomputes the signatures on the next start.
+MINHASH_SLOTS = 64          # One-byte signature slots (one-permutation MinHash)
+LSH_BANDS = 16              # Bands of 4 slots: chats near 0.5 Jaccard start to collide
+SHINGLE_CHARS = 5           # Characters per shingle
+MINHASH_SHORT_PROMPT = 24   # Shorter prompts are signed together with their answer's start
+MINHASH_ANSWER_CHARS = 1000
+DUPLICATE_SIMILARITY = 0.8  # Estimated Jaccard at which a chat joins another's duplicate group
+RELATED_SIMILARITY = 0.3    # Lowest estimated Jaccard listed as related
+RELATED_CANDIDATES = 200    # Bucket-mates compared per lookup, those sharing most bands first
+DUPLICATE_CANDIDATES = 10   # Bucket-mates compared on ingest to find a chat's duplicate group
+MINHASH_TABLE_SQL = (
+    "CREATE TABLE chat_minhash ("
+    "chat_id INTEGER PRIMARY KEY, signature BLOB NOT NULL, dup_group INTEGER "
+    f"/* slots={MINHASH_SLOTS} bands={LSH_BANDS} shingle={SHINGLE_CHARS} "
+    f"short={MINHASH_SHORT_PROMPT}+{MINHASH_ANSWER_CHARS} */)"
+)
+
+# Fuzzy search (mode=fuzzy). Every indexed word is kept with its character
+# trigrams, so a misspelt query word can be expanded to the stored words
+# within a small edit distance before matching.
+FUZZY_ONE_EDIT_CHARS = 4    # Query words this long tolerate one typo...
+FUZZY_TWO_EDITS_CHARS = 8   # ...and this long, two
+FUZZY_MAX_CHARS = 32        # Longer words (hashes, encoded data) aren't indexed
+FUZZY_EXPANSIONS = 8        # Closest spellings each query word is expanded to
+FUZZY_CANDIDATES = 100      # Terms sharing most trigrams with a word whose distance is checked
+
+# Code search (mode=code). Fenced code blocks are copied out of answers into
+# code_blocks and indexed with identifiers split into their words, so
+# 'asyncio.gather', 'getUserName' and 'user_name' are found by their parts.
+CODE_PREVIEW_CHARS = 2000   # Code returned per matching block
+CODE_FENCE_RE = re.compile(r'^[ \t]*(`{3,}|~{3,})[ \t]*([\w+#.-]*)[^\n]*\n(.*?)^[ \t]*\1[ \t]*$',
+                           re.MULTILINE | re.DOTALL)
+CODE_IDENTIFIER_RE = re.compile(r'[^\W\d]\w*(?:\.[^\W\d]\w*)*|\d+')
+CODE_WORD_RE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+|[^\W\d_A-Za-z]+')
+
+# Time partitions (partition command). Chats of closed months or quarters
+# are moved out of the main database into one file per period beside it,
+# '<db>.2025-03.db' or '<db>.2025-Q1.db'; searches attach only the
+# partitions whose chats fall in their date range.
+PARTITION_PERIODS = {
+    # Period -> SQL naming the partition of a timestamp column
+    'month': "strftime('%Y-%m', {column})",
+    'quarter': "strftime('%Y', {column}) || '-Q' || ((CAST(strftime('%m', {column}) AS INTEGER) + 2) / 3)",
+}
+
+# Cold archive (archive command). Chats older than ARCHIVE_AGE_DAYS are moved
+# into one read-only '<db>.archive.db' with bodies recompressed and its
+# indexes merged, registered as a partition of period 'archive'.
+ARCHIVE_PERIOD = 'archive'
+ARCHIVE_AGE_DAYS = 365
+ARCHIVE_BATCH = 50
+ARCHIVE_PAUSE = 0.05        # Seconds between batches, so captures get the write lock
+ARCHIVE_MERGE_PAGES = 64    # Pages per step of the main index's incremental merge
+
+# Online backups (backup command, POST /api/backup, serve --backup-every).
+# Each snapshot is a directory '<db>-YYYYMMDD-HHMMSS' under BACKUP_DIR holding
+# the database and its partitions as they were when the backup started.
+BACKUP_DIR = 'backups'      # Relative to the database's directory
+BACKUP_KEEP = 7             # Newest snapshots kept; older ones are deleted
+BACKUP_STEP_PAGES = 256     # Pages copied per backup step (1 MiB at the default page size)
+BACKUP_PAUSE = 0.005        # Seconds between steps, leaving the disk to captures
+BACKUP_RETRY = 300          # Seconds before a failed scheduled backup is tried again
+
+# Index maintenance (maintain command, and serve unless --no-maintenance).
+# Every capture's commit adds a small segment to the full-text indexes, and
+# a search reads every segment. FTS5 merges them on write once automerge
+# segments pile up on one level; the server merges the rest when it has
+# been idle, refreshes the query planner's statistics and checks the
+# indexes. GET /api/health reports the result.
+FTS_AUTOMERGE = 8           # Segments per level merged during a commit (FTS5 default 4)...
+FTS_CRISISMERGE = 32        # ...and the most allowed before one blocks for it (default 16)
+MAINTAIN_IDLE = 60          # Seconds without writes before maintenance starts
+MAINTAIN_POLL = 15          # Seconds between checks for idleness
+MAINTAIN_ANALYZE_HOURS = 24
+MAINTAIN_CHECK_HOURS = 24 * 7
+MAINTAIN_ANALYZE_ROWS = 1000  # PRAGMA analysis_limit: index entries sampled by ANALYZE
+
+# Markers passed to FTS5 highlight()/snippet() and turned into offsets
+HIGHLIGHT_OPEN = '\x02'
+HIGHLIGHT_CLOSE = '\x03'
+
+# Hot row: only the small, frequently scanned fields. Message bodies live in
+# chat_content so listings, stats and tag queries never walk overflow pages
+# full of long AI responses.
+CHATS_TABLE_SQL = '''
+    CREATE TABLE {if_not_exists} {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        platform TEXT NOT NULL,
+        conversation_id TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        notes TEXT DEFAULT '',
+        tags TEXT DEFAULT '',
+        user_length INTEGER DEFAULT 0,
+        ai_length INTEGER DEFAULT 0,
+        turn_index INTEGER,
+        user_hash TEXT
+    )
+'''
+
+
+class BodyCodec:
+    """
+    Transparent compression for stored message bodies.
+    
+    Plain bodies stay TEXT, so databases written without compression keep
+    working unchanged. Compressed bodies are BLOBs with a 5 byte header:
+    one codec byte followed by the big-endian id of the shared dictionary
+    used (0 for none).
+    """
+    
+    CODEC_IDS = {'zlib': 1, 'zstd': 2}
+    MIN_SIZE = 128
+    
+    def __init__(self, codec=None):
+        if codec == 'zstd' and zstandard is None:
+            print("✗ zstandard is not installed, falling back to zlib")
+            codec = 'zlib'
+        if codec not in (None, 'zlib', 'zstd'):
+            raise ValueError(f"Unknown compression codec: {codec}")
+        self.codec = codec
+        self.dictionaries = {}      # dict id -> bytes
+        self.active = {}            # (platform, codec) -> dict id
+    
+    def load_dictionaries(self, cursor):
+        """Cache all trained dictionaries; the newest per platform is active"""
+        cursor.execute('SELECT id, platform, codec, data FROM compression_dicts ORDER BY id')
+        self.dictionaries = {}
+        self.active = {}
+        for dict_id, platform, codec, data in cursor.fetchall():
+            self.dictionaries[dict_id] = bytes(data)
+            self.active[(platform, codec)] = dict_id
+    
+    def encode(self, text, platform=None):
+        """Compress text with the configured codec for storage"""
+        return self.encode_with(self.codec, text, platform)
+    
+    def encode_with(self, codec, text, platform=None):
+        """Compress text for storage, returning it unchanged when not worth it"""
+        if codec is None or text is None:
+            return text
+        
+        raw = text.encode('utf-8')
+        if len(raw) < self.MIN_SIZE:
+            return text
+        
+        dict_id = self.active.get((platform, codec), 0)
+        zdict = self.dictionaries.get(dict_id)
+        
+        if codec == 'zstd':
+            dictionary = zstandard.ZstdCompressionDict(zdict) if zdict else None
+            payload = zstandard.ZstdCompressor(level=9, dict_data=dictionary).compress(raw)
+        elif zdict:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+            payload = compressor.compress(raw) + compressor.flush()
+        else:
+            payload = zlib.compress(raw, 9)
+        
+        if len(payload) + 5 >= len(raw):
+            return text
+        return bytes([self.CODEC_IDS[codec]]) + dict_id.to_bytes(4, 'big') + payload
+    
+    def decode(self, value):
+        """Return the plain text for a stored body (TEXT or compressed BLOB)"""
+        if value is None or isinstance(value, str):
+            return value
+        
+        value = bytes(value)
+        codec_id = value[0]
+        dict_id = int.from_bytes(value[1:5], 'big')
+        payload = value[5:]
+        zdict = self.dictionaries.get(dict_id) if dict_id else None
+        
+        if dict_id and zdict is None:
+            raise ValueError(f"Compression dictionary {dict_id} is not loaded")
+        
+        if codec_id == self.CODEC_IDS['zstd']:
+            if zstandard is None:
+                raise ValueError("Body is zstd-compressed but zstandard is not installed")
+            dictionary = zstandard.ZstdCompressionDict(zdict) if zdict else None
+            raw = zstandard.ZstdDecompressor(dict_data=dictionary).decompress(payload)
+        elif zdict:
+            decompressor = zlib.decompressobj(zdict=zdict)
+            raw = decompressor.decompress(payload) + decompressor.flush()
+        else:
+            raw = zlib.decompress(payload)
+        return raw.decode('utf-8')
+    
+    @staticmethod
+    def train_dictionary(codec, samples, size=32 * 1024):
+        """Build a shared dictionary from sample bodies of one platform"""
+        samples = [s.encode('utf-8') for s in samples if s]
+        if not samples:
+            return None
+        
+        if codec == 'zstd':
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        
+        # zlib has no trainer: keep the lines shared by the most samples,
+        # with the most common last since deflate favours nearby matches
+        line_counts = Counter()
+        for sample in samples:
+            line_counts.update(set(line.strip() for line in sample.splitlines() if len(line.strip()) > 3))
+        
+        common = [line for line, count in line_counts.most_common() if count > 1]
+        chunks = []
+        total = 0
+        for line in common:
+            if total + len(line) + 1 > size:
+                break
+            chunks.append(line)
+            total += len(line) + 1
+        
+        return b'\n'.join(reversed(chunks)) if chunks else None
+
+
+class EventBroker:
+    """
+    Fan out change events to live listeners (the dashboard's SSE feed).
+    
+    Events get increasing ids and the most recent ones are kept, so a
+    listener that reconnects with Last-Event-ID picks up where it left off.
+    """
+    
+    def __init__(self, history=EVENT_HISTORY):
+        self.events = deque(maxlen=history)
+        self.last_id = 0
+        self.listeners = 0
+        self.condition = threading.Condition()
+    
+    def publish(self, kind, data):
+        with self.condition:
+            self.last_id += 1
+            self.events.append((self.last_id, kind, data))
+            self.condition.notify_all()
+    
+    def wait(self, after, timeout):
+        """
+        Block until there are events newer than after, or timeout.
+        
+        Returns:
+            List of (id, kind, data), or None when events after that id
+            have already been dropped from the history (or the id comes
+            from before a server restart)
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id != after, timeout)
+            if after > self.last_id or (self.events and self.events[0][0] > after + 1):
+                return None
+            return [event for event in self.events if event[0] > after]
+
+
+class IngestQueue:
+    """
+    Write-behind storage for /api/add captures.
+    
+    Handlers validate a capture, queue its exchanges and answer 202; one
+    writer thread stores whatever has queued up meanwhile in a single
+    transaction (group commit), so a capture never waits on fsync or on a
+    long read holding the database. With a journal, each capture is
+    appended and fsynced before it is acknowledged, and replayed on the
+    next start if the server stopped before storing it.
+    
+    A failed group commit is retried with backoff, then its exchanges are
+    stored one by one; those that still fail stay in the journal for the
+    next start, and the journal is otherwise emptied as usual.
+    """
+    
+    def __init__(self, db, depth=INGEST_QUEUE_DEPTH, journal=None):
+        self.db = db
+        self.queue = queue.Queue(depth)
+        self.journal_path = journal
+        self.journal = None
+        self.lock = threading.Lock()    # Orders journal appends with queueing
+        self.last_seq = 0               # Sequence number of the last capture queued
+        self.unstored = []              # Journaled exchanges whose commits failed
+        self.stats = {
+            'accepted': 0,              # Captures queued
+            'rejected': 0,              # Captures refused with 503, queue full
+            'exchanges': 0,             # Exchanges in the accepted captures
+            'stored': 0,
+            'changed': 0,
+            'failed': 0,                # Exchanges not stored, even one by one
+            'retries': 0,               # Group commits attempted again
+            'commits': 0,
+            'last_batch': 0,            # Exchanges per commit
+            'max_batch': 0
+        }
+        
+        if journal:
+            self.replay()
+            self.journal = open(journal, 'ab')
+        self.writer = threading.Thread(target=self.run, name='chatcat-ingest', daemon=True)
+        self.writer.start()
+    
+    def replay(self):
+        """
+        Store captures journaled but not stored before the last stop.
+        
+        Lines that don't parse (a torn last line was never acknowledged)
+        are logged and skipped, and exchanges that can't be stored are kept
+        in the journal, so a damaged journal never stops the server starting.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        
+        exchanges = []
+        with open(self.journal_path, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    exchanges.extend(tuple(exchange) for exchange in json.loads(line)
+                                     if isinstance(exchange, list) and len(exchange) == 6)
+                except (ValueError, TypeError) as e:
+                    print(f"✗ Skipped unreadable journal line {number}: {e}")
+        if exchanges:
+            print(f"▶ Replaying {len(exchanges)} journaled exchange(s)...")
+            for start in range(0, len(exchanges), INGEST_BATCH):
+                _, failed = self.commit(exchanges[start:start + INGEST_BATCH])
+                self.unstored.extend(failed)
+        with open(self.journal_path, 'wb') as f:
+            if self.unstored:
+                f.write(dump_json(self.unstored) + b'\n')
+    
+    def submit(self, exchanges):
+        """
+        Queue one capture's exchanges for the writer.
+        
+        Returns:
+            False when the queue is full
+        """
+        with self.lock:
+            try:
+                self.queue.put_nowait((self.last_seq + 1, exchanges))
+            except queue.Full:
+                self.stats['rejected'] += 1
+                return False
+            self.last_seq += 1
+            self.stats['accepted'] += 1
+            self.stats['exchanges'] += len(exchanges)
+            if self.journal:
+                self.journal.write(dump_json(exchanges) + b'\n')
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+        return True
+    
+    def run(self):
+        """Writer thread: store queued captures, up to INGEST_BATCH exchanges per commit"""
+        while True:
+            captures = [self.queue.get()]
+            size = len(captures[0][1]) if captures[0] else 0
+            while captures[-1] is not None and size < INGEST_BATCH:
+                try:
+                    captures.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+                if captures[-1] is not None:
+                    size += len(captures[-1][1])
+            
+            stopping = captures[-1] is None
+            if stopping:
+                captures.pop()
+            if captures:
+                self.store(captures)
+            if stopping:
+                return
+    
+    def commit(self, exchanges):
+        """
+        Store exchanges in one transaction, retrying with backoff; when
+        that keeps failing (a lock held too long, one exchange that cannot
+        be stored), store them one at a time.
+        
+        Returns:
+            (add_records results, exchanges not stored)
+        """
+        delay = INGEST_RETRY_DELAY
+        for attempt in range(INGEST_RETRIES):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+                with self.lock:
+                    self.stats['retries'] += 1
+            try:
+                return self.db.add_records(exchanges), []
+            except Exception as e:
+                print(f"✗ Ingest commit of {len(exchanges)} exchange(s) failed "
+                      f"(attempt {attempt + 1} of {INGEST_RETRIES}): {e}")
+        
+        print(f"▶ Storing {len(exchanges)} exchange(s) one by one...")
+        results = []
+        failed = []
+        for exchange in exchanges:
+            try:
+                results.extend(self.db.add_records([exchange]))
+            except Exception:
+                traceback.print_exc()
+                failed.append(exchange)
+        if failed:
+            print(f"✗ {len(failed)} exchange(s) not stored"
+                  f"{', kept in the journal' if self.journal_path else ''}")
+        return results, failed
+    
+    def store(self, captures):
+        exchanges = [exchange for _, capture in captures for exchange in capture]
+        results, failed = self.commit(exchanges)
+        
+        changed = sum(1 for _, was_changed, _ in results if was_changed)
+        with self.lock:
+            self.stats['stored'] += len(results)
+            self.stats['changed'] += changed
+            self.stats['failed'] += len(failed)
+            self.stats['commits'] += 1
+            self.stats['last_batch'] = len(results)
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(results))
+            
+            # Captures are stored in order, so when the last one queued is
+            # stored the journal can start afresh, holding only exchanges
+            # that failed, to be replayed on the next start.
+            if self.journal:
+                self.unstored.extend(failed)
+                if captures[-1][0] == self.last_seq:
+                    self.journal.truncate(0)
+                    if self.unstored:
+                        self.journal.write(dump_json(self.unstored) + b'\n')
+                        self.journal.flush()
+                        os.fsync(self.journal.fileno())
+        
+        if changed:
+            print(f"✓ Stored {len(captures)} capture(s) in one commit: "
+                  f"{changed} exchange(s) new or changed")
+    
+    def get_stats(self):
+        """Counters plus the current queue depth, for /api/ingest"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats['queued'] = self.queue.qsize()
+        stats['capacity'] = self.queue.maxsize
+        stats['mean_batch'] = round(stats['stored'] / stats['commits'], 1) if stats['commits'] else 0
+        stats['journal'] = self.journal_path
+        return stats
+    
+    def close(self):
+        """Store everything still queued, then stop the writer"""
+        self.queue.put(None)
+        self.writer.join()
+        if self.journal:
+            self.journal.close()
+
+
+class HashingEmbedder:
+    """
+    Embed text as unit vectors of EMBED_DIM float32s without a model.
+    
+    Words with their character trigrams, and adjacent word pairs, are
+    hashed into signed buckets with sublinear counts. Trigrams let related
+    forms meet ('retry', 'retries', 'retrying'), pairs keep some phrasing.
+    The features of each word are hashed once and cached.
+    """
+    
+    CACHE_WORDS = 200000
+    
+    def __init__(self):
+        self.words = {}             # word -> (buckets, signed weights)
+    
+    @staticmethod
+    def hash_features(features, weight):
+        hashes = numpy.fromiter((zlib.crc32(f.encode('utf-8')) for f in features),
+                                dtype=numpy.uint32, count=len(features))
+        signs = numpy.where(hashes & 0x80000000, -weight, weight).astype(numpy.float32)
+        return (hashes % EMBED_DIM).astype(numpy.intp), signs
+    
+    def word_features(self, word):
+        cached = self.words.get(word)
+        if cached is None:
+            padded = f'<{word}>'
+            whole = self.hash_features([word], 1.0)
+            trigrams = self.hash_features([padded[i:i + 3] for i in range(len(padded) - 2)], 0.25)
+            cached = (numpy.concatenate((whole[0], trigrams[0])), numpy.concatenate((whole[1], trigrams[1])))
+            if len(self.words) >= self.CACHE_WORDS:
+                self.words.clear()
+            self.words[word] = cached
+        return cached
+    
+    def embed(self, text):
+        """Return the unit vector for text, or None when it has no words"""
+        words = [w for w in re.findall(r'\w+', (text or '').lower()) if w not in EMBED_STOPWORDS]
+        if not words:
+            return None
+        
+        counts = Counter(words)
+        weights = 1 + numpy.log(numpy.fromiter(counts.values(), dtype=numpy.float32, count=len(counts)))
+        buckets = []
+        values = []
+        for word, weight in zip(counts, weights):
+            word_buckets, word_signs = self.word_features(word)
+            buckets.append(word_buckets)
+            values.append(word_signs * weight)
+        
+        pairs = Counter(zip(words, words[1:]))
+        if pairs:
+            pair_buckets, pair_signs = self.hash_features([' '.join(pair) for pair in pairs], 0.5)
+            buckets.append(pair_buckets)
+            values.append(pair_signs * (1 + numpy.log(numpy.fromiter(pairs.values(), dtype=numpy.float32,
+                                                                     count=len(pairs)))))
+        
+        vector = numpy.bincount(numpy.concatenate(buckets), weights=numpy.concatenate(values),
+                                minlength=EMBED_DIM).astype(numpy.float32)
+        norm = numpy.linalg.norm(vector)
+        return vector / norm if norm else None
+
+
+class VectorIndex:
+    """
+    Semantic search over hashed embeddings of every stored exchange.
+    
+    Vectors are int8 rows of a memmap next to the database, row i holding
+    chat id i, so updates need no id mapping and a search is one pass of
+    dot products. Triggers queue new and changed chats in vector_queue and
+    a background thread embeds them, so captures never wait for it.
+    """
+    
+    LAYOUT = f'hash-v1 dim={EMBED_DIM} int8'
+    
+    def __init__(self, db):
+        self.db = db
+        self.path = db.db_file + '.vectors'
+        self.matrix = None
+        self.size = 0                   # Rows that can hold a vector (max chat id + 1)
+        self.lock = threading.Lock()    # Serialises growing the matrix
+        self.wake = threading.Event()
+        self.embedder = HashingEmbedder()
+        self.prepare()
+    
+    def prepare(self):
+        """Create the queue and its triggers, queueing everything for a new index"""
+        conn = self.db._connect()
+        cursor = conn.cursor()
+        
+        # seq changes whenever a chat is queued again, so the worker only
+        # dequeues the entries it actually embedded
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS vector_queue (
+                seq INTEGER PRIMARY KEY,
+                chat_id INTEGER UNIQUE NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE TABLE IF NOT EXISTS vector_state (id INTEGER PRIMARY KEY, layout TEXT)')
+        
+        for name, event in (('vector_queue_ai', 'AFTER INSERT ON chat_content'),
+                            ('vector_queue_au', 'AFTER UPDATE OF user_message, ai_response ON chat_content')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN
+                    DELETE FROM vector_queue WHERE chat_id = new.chat_id;
+                    INSERT INTO vector_queue (chat_id) VALUES (new.chat_id);
+                END
+            ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS vector_queue_ad AFTER DELETE ON chats BEGIN
+                DELETE FROM vector_queue WHERE chat_id = old.id;
+                INSERT INTO vector_queue (chat_id) VALUES (old.id);
+            END
+        ''')
+        
+        cursor.execute('SELECT layout FROM vector_state WHERE id = 1')
+        row = cursor.fetchone()
+        if row is None or row[0] != self.LAYOUT or not os.path.exists(self.path):
+            print("▶ Semantic index is new or its layout changed, queueing every chat...")
+            open(self.path, 'wb').close()
+            cursor.execute('DELETE FROM vector_queue')
+            cursor.execute('INSERT INTO vector_queue (chat_id) SELECT chat_id FROM chat_content ORDER BY chat_id')
+            cursor.execute('INSERT OR REPLACE INTO vector_state (id, layout) VALUES (1, ?)', (self.LAYOUT,))
+        
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM chats')
+        max_id = cursor.fetchone()[0]
+        conn.commit()
+        conn.close()
+        
+        rows = os.path.getsize(self.path) // EMBED_DIM
+        if rows:
+            self.matrix = numpy.memmap(self.path, dtype=numpy.int8, mode='r+', shape=(rows, EMBED_DIM))
+        self.size = min(rows, max_id + 1)
+    
+    def reserve(self, max_id):
+        """Return the matrix, grown to hold chat id max_id"""
+        with self.lock:
+            rows = self.matrix.shape[0] if self.matrix is not None else 0
+            if max_id >= rows:
+                rows = max(max_id + 1, rows * 2, 1024)
+                with open(self.path, 'r+b') as f:
+                    f.truncate(rows * EMBED_DIM)
+                self.matrix = numpy.memmap(self.path, dtype=numpy.int8, mode='r+', shape=(rows, EMBED_DIM))
+            return self.matrix
+    
+    def pending(self):
+        """Number of chats waiting to be embedded"""
+        conn = sqlite3.connect(self.db.db_file)
+        count = conn.execute('SELECT COUNT(*) FROM vector_queue').fetchone()[0]
+        conn.close()
+        return count
+    
+    def embed_pending(self, batch=EMBED_BATCH):
+        """
+        Embed up to batch queued chats.
+        
+        Returns:
+            Number of queue entries handled
+        """
+        conn = self.db._connect()
+        conn.on_commit = None           # Vectors aren't chat data; keep snapshots valid
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT q.seq, q.chat_id, substr(chatcat_decompress(cc.user_message), 1, ?),
+                   substr(chatcat_decompress(cc.ai_response), 1, ?)
+            FROM vector_queue q LEFT JOIN chat_content cc ON cc.chat_id = q.chat_id
+            ORDER BY q.seq LIMIT ?
+        ''', (EMBED_CHARS, EMBED_CHARS, batch))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.close()
+            return 0
+        
+        max_id = max(row[1] for row in rows)
+        matrix = self.reserve(max_id)
+        for _, chat_id, user_message, ai_response in rows:
+            # The prompt names the topic, so it counts double
+            vector = numpy.zeros(EMBED_DIM, dtype=numpy.float32)
+            for text, weight in ((user_message, 2.0), (ai_response, 1.0)):
+                embedded = self.embedder.embed(text)
+                if embedded is not None:
+                    vector += weight * embedded
+            norm = numpy.linalg.norm(vector)
+            # Deleted chats and empty bodies get a zero row, which never matches
+            matrix[chat_id] = numpy.clip(numpy.rint(vector * (EMBED_SCALE / norm)), -127, 127) if norm else 0
+        matrix.flush()
+        self.size = max(self.size, max_id + 1)
+        
+        cursor.executemany('DELETE FROM vector_queue WHERE seq = ?', [(row[0],) for row in rows])
+        conn.commit()
+        conn.close()
+        return len(rows)
+    
+    def embed_all(self):
+        """Embed everything queued, reporting progress (the embed command)"""
+        total = self.pending()
+        done = 0
+        print(f"▶ Embedding {total} chat(s)...")
+        while True:
+            count = self.embed_pending()
+            if not count:
+                break
+            done += count
+            print(f"  {done}/{total}", end='\r', flush=True)
+        print(f"✓ Semantic index up to date: {self.path}")
+    
+    def start(self):
+        """Embed queued chats in a background thread, woken by commits"""
+        threading.Thread(target=self.run, name='chatcat-embed', daemon=True).start()
+    
+    def run(self):
+        while True:
+            self.wake.clear()
+            try:
+                if self.embed_pending():
+                    continue
+            except Exception as e:
+                print(f"✗ Embedding failed: {e}")
+            self.wake.wait(EMBED_POLL)
+    
+    def search(self, text, k=SEMANTIC_CANDIDATES, ids=None):
+        """
+        Find the chats closest in meaning to text.
+        
+        Args:
+            ids: Only consider these chat ids (the rows passing the filters)
+        
+        Returns:
+            List of (chat_id, cosine similarity), best first
+        """
+        query = self.embedder.embed(text)
+        matrix = self.matrix
+        if query is None or matrix is None:
+            return []
+        
+        size = min(self.size, matrix.shape[0])
+        scores = numpy.empty(size, dtype=numpy.float32)
+        for start in range(0, size, SEARCH_BLOCK_ROWS):
+            block = matrix[start:min(start + SEARCH_BLOCK_ROWS, size)]
+            scores[start:start + len(block)] = block.astype(numpy.float32) @ query
+        
+        if ids is not None:
+            keep = numpy.zeros(size, dtype=bool)
+            ids = numpy.asarray(ids, dtype=numpy.int64)
+            keep[ids[ids < size]] = True
+            scores[~keep] = 0
+        
+        # Chats without a vector score 0, as do unrelated ones
+        k = min(k, int(numpy.count_nonzero(scores > 0)))
+        if k == 0:
+            return []
+        top = numpy.argpartition(-scores, k - 1)[:k]
+        top = top[numpy.argsort(-scores[top])]
+        return [(int(i), float(scores[i]) / EMBED_SCALE) for i in top]
+
+
+class BackupScheduler:
+    """
+    Snapshots taken by the server: every interval in a background thread
+    (serve --backup-every) and on request (POST /api/backup), all with the
+    same directory, retention and compression.
+    
+    The thread takes a snapshot whenever the newest one is older than the
+    interval, so a restart doesn't reset the schedule and a manual
+    snapshot postpones the next scheduled one.
+    """
+    
+    def __init__(self, db, interval=None, directory=None, keep=BACKUP_KEEP, compress=False):
+        self.db = db
+        self.interval = interval        # Seconds between snapshots; None takes them on request only
+        self.directory = directory
+        self.keep = keep
+        self.compress = compress
+    
+    def take(self):
+        """Snapshot now; see ChatDatabase.backup()"""
+        return self.db.backup(self.directory, self.keep, self.compress)
+    
+    def start(self):
+        threading.Thread(target=self.run, name='chatcat-backup', daemon=True).start()
+    
+    def run(self):
+        while True:
+            snapshots = self.db.list_backups(self.directory)
+            due = 0
+            if snapshots:
+                created = time.strptime(snapshots[0]['created'], '%Y-%m-%d %H:%M:%S')
+                due = calendar.timegm(created) + self.interval
+            if time.time() < due:
+                time.sleep(min(due - time.time(), 60))
+                continue
+            try:
+                self.take()
+            except (OSError, sqlite3.Error, ValueError) as e:
+                print(f"✗ Scheduled backup failed: {e}")
+                time.sleep(BACKUP_RETRY)
+
+
+class IndexMaintenance:
+    """
+    Runs ChatDatabase.maintain() in a background thread once no connection
+    has written for MAINTAIN_IDLE seconds, so merging and checking never
+    compete with a burst of captures. Writes from other processes count
+    too: they are noticed through PRAGMA data_version.
+    """
+    
+    def __init__(self, db):
+        self.db = db
+    
+    def start(self):
+        threading.Thread(target=self.run, name='chatcat-maintenance', daemon=True).start()
+    
+    def run(self):
+        conn = sqlite3.connect(self.db.db_file)
+        version = None
+        written = True                  # Merge on the first idle period after a start
+        idle_since = time.monotonic()
+        while True:
+            time.sleep(MAINTAIN_POLL)
+            current = conn.execute('PRAGMA data_version').fetchone()[0]
+            if current != version:
+                if version is not None:
+                    written = True
+                version = current
+                idle_since = time.monotonic()
+                continue
+            if time.monotonic() - idle_since < MAINTAIN_IDLE:
+                continue
+            
+            try:
+                self.db.maintain(merge=written)
+            except (OSError, sqlite3.Error) as e:
+                print(f"✗ Index maintenance failed: {e}")
+            written = False
+            # Maintenance's own commits are not activity
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+
+
+class ChatConnection(sqlite3.Connection):
+    """Connection that reports commits which changed rows"""
+    on_commit = None
+    settled_changes = 0             # total_changes as of the last commit or rollback
+    
+    def commit(self):
+        super().commit()
+        # total_changes counts from when the connection was opened
+        if self.total_changes != self.settled_changes:
+            self.settled_changes = self.total_changes
+            if self.on_commit:
+                self.on_commit()
+    
+    def rollback(self):
+        super().rollback()
+        self.settled_changes = self.total_changes
 
 
 class ChatDatabase:
-    def __init__(self, db_file=DB_FILE):
+    def __init__(self, db_file=DB_FILE, compression=COMPRESSION):
         self.db_file = db_file
+        self.codec = BodyCodec(compression)
+        self.data_version = 0           # Bumped by every commit that changed rows
+        self.events = None              # EventBroker for live updates, set by run_server()
+        self.vectors = None             # VectorIndex for semantic search, set by run_server()
+        self.snapshot = None
+        self.snapshot_key = None
+        self.snapshot_lock = threading.Lock()
+        self.device_id = None           # Identifies this database to sync peers, set by init_database()
+        self.backup_lock = threading.Lock()
         self.init_database()
     
+    def _connect(self):
+        """Open a connection with the body decompression function registered"""
+        conn = sqlite3.connect(self.db_file, factory=ChatConnection, uri=True)
+        conn.create_function('chatcat_decompress', 1, self._decompress, deterministic=True)
+        conn.create_function('chatcat_code_tokens', 1, self.code_tokens, deterministic=True)
+        conn.on_commit = self._data_changed
+        return conn
+    
+    def _data_changed(self):
+        self.data_version += 1
+        if self.vectors is not None:
+            self.vectors.wake.set()
+    
+    def _decompress(self, value):
+        try:
+            return self.codec.decode(value)
+        except ValueError:
+            # A dictionary trained by another process since we last looked
+            conn = sqlite3.connect(self.db_file)
+            self.codec.load_dictionaries(conn.cursor())
+            conn.close()
+            return self.codec.decode(value)
+    
     def init_database(self):
         """Initialise the database with required tables"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # The server handles requests on several threads; in WAL mode a
+        # long read (an export, a backup) doesn't block captures
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
+        cursor.execute(CHATS_TABLE_SQL.format(if_not_exists='IF NOT EXISTS', name='chats'))
+        
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                platform TEXT NOT NULL,
-                conversation_id TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            CREATE TABLE IF NOT EXISTS chat_content (
+                chat_id INTEGER PRIMARY KEY,
                 user_message TEXT,
                 ai_response TEXT,
-                metadata TEXT,
-                notes TEXT DEFAULT '',
-                tags TEXT DEFAULT '',
-                UNIQUE(platform, conversation_id, timestamp)
+                metadata TEXT
             )
         ''')
         
+        # Shared per-platform dictionaries for compressed bodies
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS compression_dicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                platform TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.codec.load_dictionaries(cursor)
+        
+        # Databases created before the split keep bodies inline in chats
+        cursor.execute('PRAGMA table_info(chats)')
+        if 'user_message' in [row[1] for row in cursor.fetchall()]:
+            self.migrate_inline_bodies(cursor)
+        
+        # Captures were once de-duplicated by a table constraint on their
+        # timestamp, which turn-tracked rows can't share
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='chats'")
+        if 'UNIQUE(platform, conversation_id, timestamp)' in cursor.fetchone()[0]:
+            self.rebuild_chats_table(cursor, '''
+                SELECT id, platform, conversation_id, timestamp, notes, tags,
+                       user_length, ai_length, NULL, NULL
+                FROM chats
+            ''')
+        
+        # Columns added after the table was first created
+        self.ensure_columns(cursor, 'chats', {
+            'turn_index': 'INTEGER',
+            'user_hash': 'TEXT',
+        })
+        
+        # Partitions chats were moved to, with what each holds, so searches
+        # can skip those outside their date range without opening them
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS partitions (
+                name TEXT PRIMARY KEY,
+                period TEXT NOT NULL,
+                path TEXT NOT NULL,
+                period_start TEXT NOT NULL,
+                period_end TEXT NOT NULL,
+                chats INTEGER NOT NULL DEFAULT 0,
+                platforms TEXT NOT NULL DEFAULT '{}',
+                first_timestamp TEXT,
+                last_timestamp TEXT,
+                min_id INTEGER,
+                max_id INTEGER
+            )
+        ''')
+        
+        # Conversations with chats in each partition, so a capture that
+        # continues one finds its stored turns without opening every file
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='partition_conversations'")
+        map_partitions = cursor.fetchone() is None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS partition_conversations (
+                platform TEXT NOT NULL,
+                conversation_id TEXT NOT NULL,
+                partition TEXT NOT NULL,
+                PRIMARY KEY (platform, conversation_id, partition)
+            ) WITHOUT ROWID
+        ''')
+        
         # Tags management table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS tags (
@@ -65,119 +1069,914 @@ class ChatDatabase:
             ]
             cursor.executemany('INSERT INTO tags (name, color) VALUES (?, ?)', default_tags)
         
+        # Change log for sync: one entry per changed chat or tag, renumbered
+        # on every change so entries after a peer's cursor are exactly what
+        # it hasn't seen, with the device a pulled change came from (NULL
+        # for changes made here). A new log starts out listing everything.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changes'")
+        seed_changes = cursor.fetchone() is None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                origin TEXT,
+                UNIQUE (kind, key)
+            )
+        ''')
+        if seed_changes:
+            cursor.execute("INSERT INTO changes (kind, key) SELECT 'tag', name FROM tags ORDER BY id")
+            conn.commit()
+            for partition in reversed(self.get_partitions(cursor)):
+                self.attach_partition(cursor, partition['path'])
+                cursor.execute("INSERT INTO changes (kind, key) SELECT 'chat', id FROM part.chats ORDER BY id")
+                conn.commit()
+                cursor.execute('DETACH DATABASE part')
+            cursor.execute("INSERT INTO changes (kind, key) SELECT 'chat', id FROM chats ORDER BY id")
+        
+        # How far each peer's change log has been pulled
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_peers (
+                url TEXT PRIMARY KEY,
+                cursor INTEGER NOT NULL DEFAULT 0,
+                synced_at DATETIME
+            )
+        ''')
+        
+        # This database's id, sent along when pulling so the peer leaves out
+        # the changes it pulled from here
+        cursor.execute('CREATE TABLE IF NOT EXISTS sync_device (id TEXT NOT NULL)')
+        cursor.execute('''
+            INSERT INTO sync_device (id) SELECT lower(hex(randomblob(8)))
+            WHERE NOT EXISTS (SELECT 1 FROM sync_device)
+        ''')
+        cursor.execute('SELECT id FROM sync_device')
+        self.device_id = cursor.fetchone()[0]
+        
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_platform ON chats(platform)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON chats(timestamp)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation ON chats(platform, conversation_id)')
+        # Captures without an ordinal were once keyed on their timestamp,
+        # which dropped all but one of a conversation's exchanges stored in
+        # the same second. store_chat tells them apart by prompt and answer.
+        cursor.execute('DROP INDEX IF EXISTS idx_capture')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_hash ON chats(platform, conversation_id, user_hash)')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_turn ON chats(platform, conversation_id, turn_index)
+            WHERE turn_index IS NOT NULL
+        ''')
+        
+        # Whether bodies here may be compressed. Only then do the index's
+        # view and triggers need chatcat_decompress, which other SQLite
+        # clients don't have. Set once a codec is used; cleared again by
+        # decompressing every body (see recompress_bodies).
+        cursor.execute('CREATE TABLE IF NOT EXISTS body_encoding (compressed INTEGER NOT NULL)')
+        cursor.execute('SELECT compressed FROM body_encoding')
+        row = cursor.fetchone()
+        if row is None:
+            compressed = self.has_compressed_bodies(cursor)
+            cursor.execute('INSERT INTO body_encoding (compressed) VALUES (?)', (compressed,))
+        else:
+            compressed = bool(row[0])
+        self.compressed = compressed or self.codec.codec is not None
+        if self.compressed and not compressed:
+            cursor.execute('UPDATE body_encoding SET compressed = 1')
+        self.create_body_triggers(cursor, self.compressed)
         
-        # Check if FTS table exists and recreate if needed
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='chats_fts'")
-        fts_exists = cursor.fetchone() is not None
+        # Check if FTS table exists and recreate if its definition is stale
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='chats_fts'")
+        fts_row = cursor.fetchone()
         
-        if not fts_exists:
-            cursor.execute('''
-                CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts 
-                USING fts5(user_message, ai_response, notes, tags, content=chats, content_rowid=id)
-            ''')
+        fts_rebuilt = fts_row is None or fts_row[0] != FTS_TABLE_SQL
+        if fts_rebuilt:
+            if fts_row is not None:
+                print("▶ Full-text index layout changed, rebuilding...")
+            cursor.execute('DROP TABLE IF EXISTS chats_fts')
+            cursor.execute(FTS_TABLE_SQL)
             
             # Populate FTS from existing data
+            cursor.execute("INSERT INTO chats_fts(chats_fts) VALUES('rebuild')")
+        
+        # Spelling index for fuzzy search: every indexed word and its
+        # trigrams, seeded from the FTS vocabulary and extended on write
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts_vocab USING fts5vocab(chats_fts, 'row')")
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='fuzzy_terms'")
+        if cursor.fetchone() is None or fts_rebuilt:
+            cursor.execute('DROP TABLE IF EXISTS fuzzy_terms')
+            cursor.execute('DROP TABLE IF EXISTS fuzzy_trigrams')
             cursor.execute('''
-                INSERT INTO chats_fts(rowid, user_message, ai_response, notes, tags)
-                SELECT id, COALESCE(user_message, ''), COALESCE(ai_response, ''), 
-                       COALESCE(notes, ''), COALESCE(tags, '')
-                FROM chats
+                CREATE TABLE fuzzy_terms (
+                    id INTEGER PRIMARY KEY,
+                    term TEXT UNIQUE NOT NULL,
+                    length INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE fuzzy_trigrams (
+                    trigram TEXT NOT NULL,
+                    term_id INTEGER NOT NULL,
+                    PRIMARY KEY (trigram, term_id)
+                ) WITHOUT ROWID
             ''')
+            self.build_term_index(cursor)
         
-        # Drop existing triggers and recreate
-        cursor.execute('DROP TRIGGER IF EXISTS chats_ai')
-        cursor.execute('DROP TRIGGER IF EXISTS chats_ad')
-        cursor.execute('DROP TRIGGER IF EXISTS chats_au')
+        # Fenced code blocks copied out of answers, indexed by identifier
+        # words. The index is contentless; triggers feed it the tokens.
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='code_blocks'")
+        if cursor.fetchone() is None:
+            cursor.execute('DROP TABLE IF EXISTS code_fts')
+            cursor.execute('''
+                CREATE TABLE code_blocks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    start INTEGER NOT NULL,
+                    language TEXT,
+                    code TEXT NOT NULL,
+                    UNIQUE (chat_id, position)
+                )
+            ''')
+            cursor.execute("CREATE VIRTUAL TABLE code_fts USING fts5(tokens, content='', tokenize='unicode61')")
+            self.create_code_triggers(cursor)
+            self.index_all_code_blocks(cursor)
+        
+        # Near-duplicate signatures and their LSH buckets, recomputed when
+        # the signature layout changes
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='chat_minhash'")
+        minhash_row = cursor.fetchone()
         
+        if minhash_row is None or minhash_row[0] != MINHASH_TABLE_SQL:
+            if minhash_row is not None:
+                print("▶ Near-duplicate signature layout changed, recomputing...")
+            cursor.execute('DROP TABLE IF EXISTS chat_minhash')
+            cursor.execute('DROP TABLE IF EXISTS chat_lsh')
+            cursor.execute('DROP TABLE IF EXISTS chat_lsh_deleted')
+            cursor.execute(MINHASH_TABLE_SQL)
+            cursor.execute('''
+                CREATE TABLE chat_lsh (
+                    bucket INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, chat_id)
+                ) WITHOUT ROWID
+            ''')
+            self.index_all_similarity(cursor)
         cursor.execute('''
-            CREATE TRIGGER chats_ai AFTER INSERT ON chats BEGIN
-                INSERT INTO chats_fts(rowid, user_message, ai_response, notes, tags)
-                VALUES (new.id, COALESCE(new.user_message, ''), COALESCE(new.ai_response, ''), 
-                        COALESCE(new.notes, ''), COALESCE(new.tags, ''));
-            END
+            CREATE INDEX IF NOT EXISTS idx_minhash_group ON chat_minhash(dup_group)
+            WHERE dup_group IS NOT NULL
         ''')
         
+        # A deleted chat's bucket keys are hashes of its signature, which
+        # SQL can't compute, so the signature waits in chat_lsh_deleted
+        # until purge_lsh_buckets. Older files left the buckets behind.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='chat_lsh_deleted'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                CREATE TABLE chat_lsh_deleted (
+                    chat_id INTEGER PRIMARY KEY,
+                    signature BLOB NOT NULL
+                )
+            ''')
+            cursor.execute('DELETE FROM chat_lsh WHERE chat_id NOT IN (SELECT chat_id FROM chat_minhash)')
+        
+        # Drop existing triggers and recreate
+        for trigger in ('chats_ai', 'chats_ad', 'chats_minhash_ad',
+                        'code_blocks_ai', 'code_blocks_ad', 'chats_code_ad'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        
         cursor.execute('''
-            CREATE TRIGGER chats_ad AFTER DELETE ON chats BEGIN
-                INSERT INTO chats_fts(chats_fts, rowid, user_message, ai_response, notes, tags)
-                VALUES ('delete', old.id, COALESCE(old.user_message, ''), COALESCE(old.ai_response, ''),
-                        COALESCE(old.notes, ''), COALESCE(old.tags, ''));
+            CREATE TRIGGER chats_minhash_ad AFTER DELETE ON chats BEGIN
+                INSERT OR IGNORE INTO chat_lsh_deleted (chat_id, signature)
+                    SELECT chat_id, signature FROM chat_minhash WHERE chat_id = old.id;
+                DELETE FROM chat_minhash WHERE chat_id = old.id;
             END
         ''')
+        self.create_code_triggers(cursor)
+        self.purge_code_index(cursor)
+        self.purge_lsh_buckets(cursor)
         
+        # Leave more merging to idle maintenance than FTS5 would by default.
+        # The settings are stored in each index, so only changes are written.
+        for table in ('chats_fts', 'code_fts'):
+            for key, value in (('automerge', FTS_AUTOMERGE), ('crisismerge', FTS_CRISISMERGE)):
+                cursor.execute(f'SELECT v FROM {table}_config WHERE k = ?', (key,))
+                row = cursor.fetchone()
+                if row is None or row[0] != value:
+                    cursor.execute(f'INSERT INTO {table}({table}, rank) VALUES(?, ?)', (key, value))
+        
+        # When each maintenance task last ran, and how it went
         cursor.execute('''
-            CREATE TRIGGER chats_au AFTER UPDATE ON chats BEGIN
-                INSERT INTO chats_fts(chats_fts, rowid, user_message, ai_response, notes, tags)
-                VALUES ('delete', old.id, COALESCE(old.user_message, ''), COALESCE(old.ai_response, ''),
-                        COALESCE(old.notes, ''), COALESCE(old.tags, ''));
-                INSERT INTO chats_fts(rowid, user_message, ai_response, notes, tags)
-                VALUES (new.id, COALESCE(new.user_message, ''), COALESCE(new.ai_response, ''),
-                        COALESCE(new.notes, ''), COALESCE(new.tags, ''));
-            END
+            CREATE TABLE IF NOT EXISTS maintenance (
+                task TEXT PRIMARY KEY,
+                run_at DATETIME NOT NULL,
+                seconds REAL NOT NULL,
+                result TEXT NOT NULL
+            )
         ''')
         
         conn.commit()
+        if map_partitions:
+            self.map_partition_conversations(cursor)
         conn.close()
         print(f"✓ Database initialised: {self.db_file}")
     
-    def add_chat(self, platform, conversation_id, user_message, ai_response, metadata=None):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO chats 
-                (platform, conversation_id, user_message, ai_response, metadata, notes, tags)
-                VALUES (?, ?, ?, ?, ?, '', '')
-            ''', (platform, conversation_id, user_message, ai_response,
-                  json.dumps(metadata) if metadata else None))
-            
-            conn.commit()
-            row_id = cursor.lastrowid
-            conn.close()
-            return row_id
-        except Exception as e:
-            conn.close()
-            print(f"✗ Error adding chat: {e}")
-            raise e
+    def has_compressed_bodies(self, cursor):
+        """Whether any stored body is a compressed BLOB; reads every row"""
+        cursor.execute('''
+            SELECT EXISTS (SELECT 1 FROM chat_content
+                           WHERE typeof(user_message) = 'blob' OR typeof(ai_response) = 'blob')
+        ''')
+        return bool(cursor.fetchone()[0])
     
-    def count_term_occurrences(self, text, search_terms):
-        """Count how many times search terms appear in text"""
-        if not text or not search_terms:
-            return 0
+    def create_body_triggers(self, cursor, compressed, schema='main'):
+        """
+        (Re)create the view the full-text index reads bodies through and
+        the triggers keeping the index in step with chats and their bodies.
         
-        text_lower = text.lower()
-        count = 0
+        Bodies are passed through chatcat_decompress only when compressed,
+        so a database that never was can still be edited with the sqlite3
+        shell or any other SQLite client.
+        """
+        # An empty name leaves just the parentheses around the column
+        decode = 'chatcat_decompress' if compressed else ''
+        for trigger in ('chat_content_ai', 'chat_content_au', 'chats_bd', 'chats_au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {schema}.{trigger}')
         
-        for term in search_terms:
-            term_lower = term.lower()
-            pattern = r'\b' + re.escape(term_lower) + r'\b'
-            matches = re.findall(pattern, text_lower)
-            count += len(matches)
+        # FTS reads its external content through a view that joins the hot
+        # row with its (possibly compressed) bodies, so snippet()/highlight()
+        # and 'rebuild' still see plain text
+        cursor.execute(f'DROP VIEW IF EXISTS {schema}.chats_fts_source')
+        cursor.execute(f'''
+            CREATE VIEW {schema}.chats_fts_source AS
+            SELECT c.id AS id, {decode}(cc.user_message) AS user_message,
+                   {decode}(cc.ai_response) AS ai_response,
+                   c.notes AS notes, c.tags AS tags
+            FROM chats c JOIN chat_content cc ON cc.chat_id = c.id
+        ''')
         
-        return count
-    
-    def update_notes(self, chat_id, notes):
-        """Update notes for a chat"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        # Bodies are inserted after the hot row, so indexing happens here
+        cursor.execute(f'''
+            CREATE TRIGGER {schema}.chat_content_ai AFTER INSERT ON chat_content BEGIN
+                INSERT INTO chats_fts(rowid, user_message, ai_response, notes, tags)
+                SELECT new.chat_id, COALESCE({decode}(new.user_message), ''),
+                       COALESCE({decode}(new.ai_response), ''),
+                       COALESCE(c.notes, ''), COALESCE(c.tags, '')
+                FROM chats c WHERE c.id = new.chat_id;
+            END
+        ''')
         
-        try:
-            # Ensure notes is a string
-            notes = notes if notes is not None else ''
-            
-            cursor.execute('UPDATE chats SET notes = ? WHERE id = ?', (notes, int(chat_id)))
-            conn.commit()
-            
-            rows_affected = cursor.rowcount
-            conn.close()
+        # Re-encoding a body (compress/decompress) leaves the text, and so the
+        # index, unchanged
+        cursor.execute(f'''
+            CREATE TRIGGER {schema}.chat_content_au AFTER UPDATE ON chat_content
+            WHEN {decode}(old.user_message) IS NOT {decode}(new.user_message)
+              OR {decode}(old.ai_response) IS NOT {decode}(new.ai_response)
+            BEGIN
+                INSERT INTO chats_fts(chats_fts, rowid, user_message, ai_response, notes, tags)
+                SELECT 'delete', old.chat_id, COALESCE({decode}(old.user_message), ''),
+                       COALESCE({decode}(old.ai_response), ''),
+                       COALESCE(c.notes, ''), COALESCE(c.tags, '')
+                FROM chats c WHERE c.id = old.chat_id;
+                INSERT INTO chats_fts(rowid, user_message, ai_response, notes, tags)
+                SELECT new.chat_id, COALESCE({decode}(new.user_message), ''),
+                       COALESCE({decode}(new.ai_response), ''),
+                       COALESCE(c.notes, ''), COALESCE(c.tags, '')
+                FROM chats c WHERE c.id = new.chat_id;
+            END
+        ''')
+        
+        # Remove the index entry while the bodies are still readable, then
+        # drop the bodies along with the hot row
+        cursor.execute(f'''
+            CREATE TRIGGER {schema}.chats_bd BEFORE DELETE ON chats BEGIN
+                INSERT INTO chats_fts(chats_fts, rowid, user_message, ai_response, notes, tags)
+                SELECT 'delete', old.id, COALESCE({decode}(cc.user_message), ''),
+                       COALESCE({decode}(cc.ai_response), ''),
+                       COALESCE(old.notes, ''), COALESCE(old.tags, '')
+                FROM chat_content cc WHERE cc.chat_id = old.id;
+                DELETE FROM chat_content WHERE chat_id = old.id;
+            END
+        ''')
+        
+        cursor.execute(f'''
+            CREATE TRIGGER {schema}.chats_au AFTER UPDATE OF notes, tags ON chats BEGIN
+                INSERT INTO chats_fts(chats_fts, rowid, user_message, ai_response, notes, tags)
+                SELECT 'delete', old.id, COALESCE({decode}(cc.user_message), ''),
+                       COALESCE({decode}(cc.ai_response), ''),
+                       COALESCE(old.notes, ''), COALESCE(old.tags, '')
+                FROM chat_content cc WHERE cc.chat_id = old.id;
+                INSERT INTO chats_fts(rowid, user_message, ai_response, notes, tags)
+                SELECT new.id, COALESCE({decode}(cc.user_message), ''),
+                       COALESCE({decode}(cc.ai_response), ''),
+                       COALESCE(new.notes, ''), COALESCE(new.tags, '')
+                FROM chat_content cc WHERE cc.chat_id = new.id;
+            END
+        ''')
+    
+    def mark_compressed(self, cursor, schema):
+        """Switch an attached database's triggers over before compressed bodies are written to it"""
+        cursor.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'body_encoding'")
+        if cursor.fetchone() is None:
+            return          # Older files always decompress
+        cursor.execute(f'SELECT compressed FROM {schema}.body_encoding')
+        if not cursor.fetchone()[0]:
+            cursor.execute(f'UPDATE {schema}.body_encoding SET compressed = 1')
+            self.create_body_triggers(cursor, True, schema)
+    
+    def create_code_triggers(self, cursor):
+        """Keep code_fts in step with code_blocks, and drop a deleted chat's blocks"""
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS code_blocks_ai AFTER INSERT ON code_blocks BEGIN
+                INSERT INTO code_fts(rowid, tokens) VALUES (new.id, chatcat_code_tokens(new.code));
+            END
+        ''')
+        # Taking an entry out of the contentless index needs the tokens it
+        # was added with, which only chatcat_code_tokens can give, so a
+        # deleted block waits in code_fts_deleted until purge_code_index.
+        # Blocks never reuse an id, and searches join the blocks, so the
+        # entry matches nothing meanwhile.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS code_fts_deleted (
+                id INTEGER PRIMARY KEY,
+                code TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS code_blocks_ad AFTER DELETE ON code_blocks BEGIN
+                INSERT OR IGNORE INTO code_fts_deleted (id, code) VALUES (old.id, old.code);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS chats_code_ad AFTER DELETE ON chats BEGIN
+                DELETE FROM code_blocks WHERE chat_id = old.id;
+            END
+        ''')
+    
+    def purge_code_index(self, cursor, schema='main'):
+        """Take the code blocks deleted since the last purge out of code_fts"""
+        cursor.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'code_fts_deleted'")
+        if cursor.fetchone() is None:
+            return          # Older files delete from code_fts straight away
+        cursor.execute(f'''
+            INSERT INTO {schema}.code_fts(code_fts, rowid, tokens)
+            SELECT 'delete', id, chatcat_code_tokens(code) FROM {schema}.code_fts_deleted
+        ''')
+        cursor.execute(f'DELETE FROM {schema}.code_fts_deleted')
+    
+    def purge_lsh_buckets(self, cursor, schema='main'):
+        """Drop the LSH buckets of chats deleted since the last purge"""
+        cursor.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'chat_lsh_deleted'")
+        if cursor.fetchone() is None:
+            return
+        cursor.execute(f'SELECT chat_id, signature FROM {schema}.chat_lsh_deleted')
+        cursor.executemany(f'DELETE FROM {schema}.chat_lsh WHERE bucket = ? AND chat_id = ?',
+                           [(bucket, chat_id) for chat_id, signature in cursor.fetchall()
+                            for bucket in self.lsh_buckets(bytes(signature))])
+        cursor.execute(f'DELETE FROM {schema}.chat_lsh_deleted')
+    
+    def ensure_columns(self, cursor, table, columns):
+        """Add any missing columns (name -> SQL type) to an existing table"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+    
+    def rebuild_chats_table(self, cursor, select_sql):
+        """
+        Recreate chats with the current layout, keeping row IDs.
+        
+        Args:
+            select_sql: SELECT over the old table producing the columns of
+                CHATS_TABLE_SQL in order
+        """
+        # Triggers and the FTS view reference chats and are recreated later
+        for trigger in ('chats_bd', 'chats_au', 'chat_content_ai', 'chat_content_au',
+                        'chats_minhash_ad', 'chats_code_ad'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cursor.execute('DROP VIEW IF EXISTS chats_fts_source')
+        
+        cursor.execute('DROP TABLE IF EXISTS chats_rebuild')
+        cursor.execute(CHATS_TABLE_SQL.format(if_not_exists='', name='chats_rebuild'))
+        cursor.execute(f'INSERT INTO chats_rebuild {select_sql}')
+        cursor.execute('DROP TABLE chats')
+        cursor.execute('ALTER TABLE chats_rebuild RENAME TO chats')
+    
+    def migrate_inline_bodies(self, cursor):
+        """Move message bodies out of a pre-2.5 chats table into chat_content"""
+        print("▶ Migrating message bodies into chat_content...")
+        
+        # The old FTS table and triggers point at the inline columns
+        for trigger in ('chats_ai', 'chats_ad', 'chats_au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cursor.execute('DROP TABLE IF EXISTS chats_fts')
+        
+        cursor.execute('''
+            INSERT OR REPLACE INTO chat_content (chat_id, user_message, ai_response, metadata)
+            SELECT id, user_message, ai_response, metadata FROM chats
+        ''')
+        
+        self.rebuild_chats_table(cursor, '''
+            SELECT id, platform, conversation_id, timestamp, notes, tags,
+                   COALESCE(length(user_message), 0), COALESCE(length(ai_response), 0), NULL, NULL
+            FROM chats
+        ''')
+        
+        cursor.execute('SELECT COUNT(*) FROM chat_content')
+        print(f"✓ Migrated {cursor.fetchone()[0]} chats (run VACUUM to reclaim space)")
+    
+    @staticmethod
+    def normalise_text(text):
+        """Collapse whitespace so capture artefacts don't defeat prefix checks"""
+        return ' '.join((text or '').split())
+    
+    @classmethod
+    def hash_prompt(cls, user_message):
+        """Stable identity of an exchange's prompt within a conversation"""
+        return hashlib.sha1(cls.normalise_text(user_message).encode('utf-8')).hexdigest()[:16]
+    
+    @classmethod
+    def minhash_signature(cls, user_message, ai_response):
+        """
+        MinHash signature of an exchange, MINHASH_SLOTS bytes, or None if empty.
+        
+        The prompt identifies an exchange, so it alone is signed unless it is
+        too short to say much ('continue', 'why?') and the answer's start is
+        added. Each shingle's hash picks a slot and competes for its minimum;
+        empty slots borrow from the next filled one, and a slot keeps one
+        byte of its minimum, which is enough to estimate Jaccard similarity.
+        """
+        text = cls.normalise_text(user_message).lower()
+        if len(text) < MINHASH_SHORT_PROMPT:
+            answer = cls.normalise_text((ai_response or '')[:MINHASH_ANSWER_CHARS]).lower()
+            text = f'{text} {answer}'.strip()
+        if not text:
+            return None
+        
+        slots = [None] * MINHASH_SLOTS
+        for shingle in {text[i:i + SHINGLE_CHARS] for i in range(max(1, len(text) - SHINGLE_CHARS + 1))}:
+            h = (zlib.crc32(shingle.encode('utf-8')) * 0x9E3779B1) & 0xFFFFFFFF
+            slot = (h * MINHASH_SLOTS) >> 32
+            if slots[slot] is None or h < slots[slot]:
+                slots[slot] = h
+        
+        signature = bytearray(MINHASH_SLOTS)
+        for slot in range(MINHASH_SLOTS):
+            distance = 0
+            while slots[(slot + distance) % MINHASH_SLOTS] is None:
+                distance += 1
+            value = slots[(slot + distance) % MINHASH_SLOTS] ^ (distance * 0x85EBCA6B)
+            signature[slot] = ((value * 0xC2B2AE35) & 0xFFFFFFFF) >> 24
+        return bytes(signature)
+    
+    @staticmethod
+    def minhash_similarity(a, b):
+        """Estimated Jaccard similarity of two signatures, net of chance byte matches"""
+        matches = sum(1 for x, y in zip(a, b) if x == y) / MINHASH_SLOTS
+        return max(0.0, (matches - 1 / 256) / (1 - 1 / 256))
+    
+    @staticmethod
+    def lsh_buckets(signature):
+        """LSH bucket keys of a signature, one per band"""
+        rows = MINHASH_SLOTS // LSH_BANDS
+        return [band << 32 | zlib.crc32(signature[band * rows:(band + 1) * rows])
+                for band in range(LSH_BANDS)]
+    
+    def index_similarity(self, cursor, chat_id, user_message, ai_response, schema='main'):
+        """
+        Store an exchange's signature and LSH buckets.
+        
+        A chat whose nearest bucket-mate is a near-duplicate joins that
+        chat's group, and a chat that gains its first duplicate becomes the
+        group's id; chats without duplicates keep a NULL dup_group.
+        """
+        signature = self.minhash_signature(user_message, ai_response)
+        cursor.execute(f'SELECT signature FROM {schema}.chat_minhash WHERE chat_id = ?', (chat_id,))
+        old = cursor.fetchone()
+        if old and bytes(old[0]) == signature:
+            return
+        if old:
+            cursor.executemany(f'DELETE FROM {schema}.chat_lsh WHERE bucket = ? AND chat_id = ?',
+                               [(bucket, chat_id) for bucket in self.lsh_buckets(bytes(old[0]))])
+            cursor.execute(f'DELETE FROM {schema}.chat_minhash WHERE chat_id = ?', (chat_id,))
+        if signature is None:
+            return
+        
+        group = None
+        similar = self.find_similar(cursor, signature, chat_id, DUPLICATE_CANDIDATES, schema)
+        if similar and similar[0][1] >= DUPLICATE_SIMILARITY:
+            group = similar[0][2] or similar[0][0]
+            if similar[0][2] is None:
+                cursor.execute(f'UPDATE {schema}.chat_minhash SET dup_group = ? WHERE chat_id = ?', (group, group))
+        cursor.execute(f'INSERT INTO {schema}.chat_minhash (chat_id, signature, dup_group) VALUES (?, ?, ?)',
+                       (chat_id, signature, group))
+        cursor.executemany(f'INSERT OR IGNORE INTO {schema}.chat_lsh (bucket, chat_id) VALUES (?, ?)',
+                           [(bucket, chat_id) for bucket in self.lsh_buckets(signature)])
+    
+    def find_similar(self, cursor, signature, exclude_id=None, limit=RELATED_CANDIDATES, schema='main'):
+        """
+        Chats sharing an LSH bucket with a signature, most similar first.
+        
+        Only bucket-mates are compared, so a lookup costs the same however
+        many chats are stored; of those, the limit sharing the most bands
+        have their signatures compared.
+        
+        Returns:
+            List of (chat_id, estimated Jaccard similarity, dup_group)
+        """
+        buckets = self.lsh_buckets(signature)
+        placeholders = ','.join('?' * len(buckets))
+        
+        # A deleted chat's buckets stay until purge_lsh_buckets (ids are
+        # never reused); joining through chat_minhash skips them
+        cursor.execute(f'''
+            SELECT m.chat_id, m.signature, m.dup_group
+            FROM (SELECT chat_id, COUNT(*) AS bands FROM {schema}.chat_lsh
+                  WHERE bucket IN ({placeholders}) AND chat_id IS NOT ?
+                  GROUP BY chat_id ORDER BY bands DESC LIMIT ?) l
+            JOIN {schema}.chat_minhash m ON m.chat_id = l.chat_id
+        ''', buckets + [exclude_id, limit])
+        similar = [(chat_id, self.minhash_similarity(signature, bytes(other)), group)
+                   for chat_id, other, group in cursor.fetchall()]
+        similar.sort(key=lambda s: (-s[1], s[0]))
+        return similar
+    
+    def index_all_similarity(self, cursor, batch=EXPORT_BATCH):
+        """Sign every stored exchange, oldest first, so groups form as on ingest"""
+        cursor.execute('SELECT COUNT(*) FROM chat_content')
+        total = cursor.fetchone()[0]
+        if not total:
+            return
+        print(f"▶ Computing near-duplicate signatures for {total} chat(s)...")
+        
+        reader = cursor.connection.cursor()
+        reader.execute('''
+            SELECT chat_id, chatcat_decompress(user_message),
+                   substr(chatcat_decompress(ai_response), 1, ?)
+            FROM chat_content ORDER BY chat_id
+        ''', (MINHASH_ANSWER_CHARS,))
+        done = 0
+        while True:
+            rows = reader.fetchmany(batch)
+            if not rows:
+                break
+            for chat_id, user_message, ai_response in rows:
+                self.index_similarity(cursor, chat_id, user_message, ai_response)
+            done += len(rows)
+            print(f"  {done}/{total}", end='\r')
+        print(f"✓ Signed {total} chat(s)")
+    
+    def get_related(self, chat_id, limit=10):
+        """
+        Chats most similar to one, by MinHash over their LSH buckets. A
+        chat in a partition is compared with that partition's chats as
+        well as the main database's.
+        
+        Returns:
+            List of (row, similarity) with rows in advanced_search's format,
+            or None if the chat doesn't exist
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        schema = self.locate_chat(cursor, chat_id)
+        if schema is None:
+            conn.close()
+            return None
+        
+        cursor.execute(f'SELECT signature FROM {schema}.chat_minhash WHERE chat_id = ?', (chat_id,))
+        row = cursor.fetchone()
+        similar = []
+        rows = {}
+        for where in (('main', 'part') if schema == 'part' else ('main',)) if row else ():
+            found = [s for s in self.find_similar(cursor, bytes(row[0]), chat_id, schema=where)
+                     if s[1] >= RELATED_SIMILARITY][:limit]
+            if found:
+                rows.update((r[0], r) for r in self.result_rows(cursor, [s[0] for s in found], where))
+                similar += found
+        if schema == 'part':
+            cursor.execute('DETACH DATABASE part')
+        conn.close()
+        
+        similar.sort(key=lambda s: (-s[1], s[0]))
+        return [(rows[i], similarity) for i, similarity, _ in similar[:limit] if i in rows]
+    
+    def store_chat(self, cursor, platform, conversation_id, user_message, ai_response,
+                   metadata=None, turn_index=None):
+        """
+        Insert one exchange, or update the row it supersedes.
+        
+        A turn already stored for (platform, conversation_id, turn_index)
+        with the same prompt has its bodies replaced in place, so
+        regenerated answers update the existing row (and its index entry)
+        instead of adding one. A different prompt under that key, or a
+        placeholder conversation id, could be another chat entirely, so
+        the turn is then stored like a capture without an ordinal. Under a
+        placeholder id the ordinal still goes into the prompt's identity,
+        so turns repeating a prompt ("continue") stay apart.
+        
+        Captures without an ordinal are identified by their prompt: when the
+        latest row for the same prompt is a prefix of the new answer (a
+        capture taken mid-stream) it is extended in place, and a capture
+        that is itself a prefix of what is stored is dropped.
+        
+        The row may have been moved to a time partition, which is then
+        updated instead (see match_partitions); one in the archive is
+        left as it is, and the capture dropped.
+        
+        Returns:
+            Tuple of (row_id, changed, created), row_id None if nothing
+            was stored
+        """
+        user_hash = self.hash_prompt(user_message)
+        placeholder = conversation_id is None or str(conversation_id) in PLACEHOLDER_CONVERSATION_IDS
+        if placeholder:
+            if turn_index is not None:
+                user_hash = self.hash_prompt(f'{turn_index}:{user_message}')
+            turn_index = None
+        
+        match = (platform, conversation_id, user_message, ai_response, metadata, user_hash)
+        stored, turn_index = self.match_stored(cursor, 'main', True, turn_index, *match)
+        if stored is None and not placeholder:
+            stored, turn_index = self.match_partitions(cursor, turn_index, *match)
+        if stored is not None:
+            return stored
+        
+        cursor.execute('''
+            INSERT OR IGNORE INTO chats 
+            (platform, conversation_id, notes, tags, user_length, ai_length, turn_index, user_hash)
+            VALUES (?, ?, '', '', ?, ?, ?, ?)
+        ''', (platform, conversation_id, len(user_message or ''), len(ai_response or ''),
+              turn_index, user_hash))
+        
+        if not cursor.rowcount:
+            # Only a turn already under this ordinal is ignored; lastrowid
+            # would be the previous insert's id
+            cursor.execute('''
+                SELECT id FROM chats WHERE platform = ? AND conversation_id = ? AND turn_index = ?
+            ''', (platform, conversation_id, turn_index))
+            row = cursor.fetchone()
+            return (row[0] if row else None), False, False
+        
+        row_id = cursor.lastrowid
+        
+        cursor.execute('''
+            INSERT INTO chat_content (chat_id, user_message, ai_response, metadata)
+            VALUES (?, ?, ?, ?)
+        ''', (row_id, self.codec.encode(user_message, platform),
+              self.codec.encode(ai_response, platform),
+              json.dumps(metadata) if metadata else None))
+        self.index_similarity(cursor, row_id, user_message, ai_response)
+        self.index_terms(cursor, self.extract_terms(user_message, ai_response))
+        self.index_code_blocks(cursor, row_id, ai_response)
+        self.log_change(cursor, 'chat', row_id)
+        return row_id, True, True
+    
+    def match_stored(self, cursor, schema, writable, turn_index, platform, conversation_id,
+                     user_message, ai_response, metadata, user_hash):
+        """
+        Find the row a capture supersedes or repeats in one database, and
+        update it there when writable (see store_chat).
+        
+        Returns:
+            ((row_id, changed, created) or None, turn_index), the ordinal
+            dropped when the stored turn has another prompt
+        """
+        if turn_index is not None:
+            cursor.execute(f'''
+                SELECT c.id, cc.user_message, cc.ai_response
+                FROM {schema}.chats c LEFT JOIN {schema}.chat_content cc ON cc.chat_id = c.id
+                WHERE c.platform = ? AND c.conversation_id = ? AND c.turn_index = ?
+            ''', (platform, conversation_id, turn_index))
+            existing = cursor.fetchone()
+            
+            if existing and self.hash_prompt(self.codec.decode(existing[1])) != user_hash:
+                # Keep the stored turn, its notes and tags, as they are
+                turn_index = None
+            elif existing:
+                if not writable or (self.codec.decode(existing[1]) == user_message and
+                                    self.codec.decode(existing[2]) == ai_response):
+                    return (existing[0], False, False), turn_index
+                
+                self.replace_bodies(cursor, existing[0], platform, user_message, ai_response,
+                                    metadata, user_hash, schema)
+                return (existing[0], True, False), turn_index
+        
+        if turn_index is None:
+            cursor.execute(f'''
+                SELECT c.id, cc.ai_response
+                FROM {schema}.chats c LEFT JOIN {schema}.chat_content cc ON cc.chat_id = c.id
+                WHERE c.platform = ? AND c.conversation_id = ? AND c.user_hash = ?
+                  AND c.turn_index IS NULL
+                ORDER BY c.id DESC LIMIT 1
+            ''', (platform, conversation_id, user_hash))
+            existing = cursor.fetchone()
+            
+            if existing:
+                stored = self.normalise_text(self.codec.decode(existing[1]))
+                incoming = self.normalise_text(ai_response)
+                
+                if stored.startswith(incoming):
+                    return (existing[0], False, False), turn_index
+                if incoming.startswith(stored):
+                    if writable:
+                        self.replace_bodies(cursor, existing[0], platform, user_message, ai_response,
+                                            metadata, user_hash, schema)
+                    return (existing[0], writable, False), turn_index
+        return None, turn_index
+    
+    def match_partitions(self, cursor, turn_index, platform, conversation_id, *match):
+        """
+        match_stored in each partition holding chats of the conversation,
+        newest first, attaching the archive read-only.
+        
+        ATTACH can't run inside a transaction, so what the caller has
+        stored so far is committed first.
+        """
+        cursor.execute('''
+            SELECT p.path, p.period FROM partition_conversations pc JOIN partitions p ON p.name = pc.partition
+            WHERE pc.platform = ? AND pc.conversation_id = ? ORDER BY p.period_start DESC
+        ''', (platform, str(conversation_id)))
+        for path, period in cursor.fetchall():
+            writable = period != ARCHIVE_PERIOD
+            cursor.connection.commit()
+            self.attach_partition(cursor, path, writable)
+            try:
+                stored, turn_index = self.match_stored(cursor, 'part', writable, turn_index,
+                                                       platform, conversation_id, *match)
+                cursor.connection.commit()
+            finally:
+                cursor.execute('DETACH DATABASE part')
+            if stored is not None:
+                return stored, turn_index
+        return None, turn_index
+    
+    def replace_bodies(self, cursor, row_id, platform, user_message, ai_response, metadata, user_hash,
+                       schema='main'):
+        """
+        Overwrite a stored exchange in place; the FTS entry is updated once.
+        A chat in a partition keeps its capture time, which places it in
+        the partition's period.
+        """
+        touch = ', timestamp = CURRENT_TIMESTAMP' if schema == 'main' else ''
+        cursor.execute(f'''
+            UPDATE {schema}.chats SET user_length = ?, ai_length = ?, user_hash = ?{touch}
+            WHERE id = ?
+        ''', (len(user_message or ''), len(ai_response or ''), user_hash, row_id))
+        cursor.execute(f'''
+            UPDATE {schema}.chat_content SET user_message = ?, ai_response = ?, metadata = ?
+            WHERE chat_id = ?
+        ''', (self.codec.encode(user_message, platform),
+              self.codec.encode(ai_response, platform),
+              json.dumps(metadata) if metadata else None, row_id))
+        self.index_similarity(cursor, row_id, user_message, ai_response, schema)
+        self.index_terms(cursor, self.extract_terms(user_message, ai_response))
+        self.index_code_blocks(cursor, row_id, ai_response, schema)
+        self.log_change(cursor, 'chat', row_id)
+    
+    def log_change(self, cursor, kind, key, origin=None):
+        """Record that a chat (by id) or tag (by name) changed, superseding its earlier entry"""
+        cursor.execute('INSERT OR REPLACE INTO changes (kind, key, origin) VALUES (?, ?, ?)',
+                       (kind, str(key), origin))
+    
+    def add_chat(self, platform, conversation_id, user_message, ai_response, metadata=None,
+                 turn_index=None):
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        try:
+            stored = self.store_chat(cursor, platform, conversation_id, user_message,
+                                     ai_response, metadata, turn_index)
+            conn.commit()
+            conn.close()
+            self.publish_chats([stored])
+            return stored[0]
+        except Exception as e:
+            conn.close()
+            print(f"✗ Error adding chat: {e}")
+            raise e
+    
+    def add_turns(self, platform, conversation_id, turns, metadata=None):
+        """
+        Store several turns of one conversation in a single transaction.
+        
+        Args:
+            turns: List of dicts with 'index', 'user_message' and 'ai_response'
+            
+        Returns:
+            List of (turn_index, row_id, changed) tuples
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        try:
+            stored = [self.store_chat(cursor, platform, conversation_id,
+                                      turn['user_message'], turn['ai_response'],
+                                      metadata, turn['index'])
+                      for turn in turns]
+            conn.commit()
+            conn.close()
+            self.publish_chats(stored)
+            return [(turn['index'], row_id, changed)
+                    for turn, (row_id, changed, _) in zip(turns, stored)]
+        except Exception as e:
+            conn.close()
+            print(f"✗ Error adding turns: {e}")
+            raise e
+    
+    def add_records(self, exchanges):
+        """
+        Store exchanges from any number of conversations in one transaction.
+        
+        Args:
+            exchanges: Iterable of (platform, conversation_id, user_message,
+                ai_response, metadata, turn_index) tuples
+            
+        Returns:
+            List of (row_id, changed, created) tuples
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        try:
+            stored = [self.store_chat(cursor, *exchange) for exchange in exchanges]
+            conn.commit()
+            conn.close()
+            self.publish_chats(stored)
+            return stored
+        except Exception as e:
+            conn.close()
+            print(f"✗ Error adding records: {e}")
+            raise e
+    
+    def publish(self, kind, data):
+        if self.events is not None:
+            self.events.publish(kind, data)
+    
+    def publish_chats(self, stored):
+        """
+        Announce stored exchanges to live listeners, as search-result rows.
+        
+        Large batches are announced by count only; listeners reload instead
+        of receiving thousands of rows.
+        """
+        if self.events is None or not self.events.listeners:
+            return
+        
+        changed = {row_id: created for row_id, was_changed, created in stored if was_changed}
+        if not changed:
+            return
+        if len(changed) > EVENT_MAX_CHATS:
+            self.publish('reload', {'changed': len(changed)})
+            return
+        
+        chats = [dict(format_search_result(row, False), created=changed[row[0]])
+                 for row in self.get_result_rows(list(changed))]
+        self.publish('chats', {'chats': chats})
+    
+    def get_result_rows(self, ids):
+        """Rows for the given chat ids in advanced_search's row format, newest first"""
+        conn = self._connect()
+        rows = self.result_rows(conn.cursor(), ids)
+        conn.close()
+        return rows
+    
+    def result_rows(self, cursor, ids, schema='main'):
+        placeholders = ','.join('?' * len(ids))
+        cursor.execute(f'''
+            SELECT c.id, c.platform, c.conversation_id, c.timestamp,
+                   substr(chatcat_decompress(cc.user_message), 1, ?),
+                   substr(chatcat_decompress(cc.ai_response), 1, ?),
+                   COALESCE(c.notes, ''), COALESCE(c.tags, ''), 0,
+                   c.user_length, c.ai_length
+            FROM {schema}.chats c
+            LEFT JOIN {schema}.chat_content cc ON cc.chat_id = c.id
+            WHERE c.id IN ({placeholders})
+            ORDER BY c.id DESC
+        ''', [PREVIEW_CHARS, PREVIEW_CHARS] + ids)
+        return [list(row) + [{}] for row in cursor.fetchall()]
+    
+    def update_notes(self, chat_id, notes):
+        """Update notes for a chat"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        try:
+            # Ensure notes is a string
+            notes = notes if notes is not None else ''
+            
+            schema = self.locate_chat(cursor, int(chat_id), writable=True) or 'main'
+            cursor.execute(f'UPDATE {schema}.chats SET notes = ? WHERE id = ?', (notes, int(chat_id)))
+            self.index_terms(conn.cursor(), self.extract_terms(notes))
+            if cursor.rowcount:
+                self.log_change(conn.cursor(), 'chat', int(chat_id))
+            conn.commit()
+            
+            rows_affected = cursor.rowcount
+            conn.close()
             
             if rows_affected == 0:
                 raise Exception(f"No chat found with ID {chat_id}")
             
+            self.publish('notes', {'id': int(chat_id), 'notes': notes})
             print(f"✓ Updated notes for chat ID {chat_id}")
             return True
         except Exception as e:
@@ -188,14 +1987,18 @@ class ChatDatabase:
     
     def update_tags(self, chat_id, tags):
         """Update tags for a chat (comma-separated string)"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
             # Ensure tags is a string
             tags = tags if tags is not None else ''
             
-            cursor.execute('UPDATE chats SET tags = ? WHERE id = ?', (tags, int(chat_id)))
+            schema = self.locate_chat(cursor, int(chat_id), writable=True) or 'main'
+            cursor.execute(f'UPDATE {schema}.chats SET tags = ? WHERE id = ?', (tags, int(chat_id)))
+            self.index_terms(conn.cursor(), self.extract_terms(tags))
+            if cursor.rowcount:
+                self.log_change(conn.cursor(), 'chat', int(chat_id))
             conn.commit()
             
             rows_affected = cursor.rowcount
@@ -204,6 +2007,8 @@ class ChatDatabase:
             if rows_affected == 0:
                 raise Exception(f"No chat found with ID {chat_id}")
             
+            self.publish('tags', {'id': int(chat_id),
+                                  'tags': [t.strip() for t in tags.split(',') if t.strip()]})
             print(f"✓ Updated tags for chat ID {chat_id}: {tags}")
             return True
         except Exception as e:
@@ -214,7 +2019,7 @@ class ChatDatabase:
     
     def get_all_tags(self):
         """Get all available tags"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         cursor = conn.cursor()
         cursor.execute('SELECT id, name, color FROM tags ORDER BY name')
         tags = [{'id': row[0], 'name': row[1], 'color': row[2]} for row in cursor.fetchall()]
@@ -223,14 +2028,16 @@ class ChatDatabase:
     
     def add_tag(self, name, color):
         """Add a new tag"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
             cursor.execute('INSERT INTO tags (name, color) VALUES (?, ?)', (name, color))
-            conn.commit()
             tag_id = cursor.lastrowid
+            self.log_change(cursor, 'tag', name)
+            conn.commit()
             conn.close()
+            self.publish('tag', {'id': tag_id, 'name': name, 'color': color})
             print(f"✓ Created new tag: {name} ({color})")
             return tag_id
         except sqlite3.IntegrityError:
@@ -239,116 +2046,1951 @@ class ChatDatabase:
             return None
         except Exception as e:
             conn.close()
-            print(f"✗ Error creating tag: {e}")
-            raise e
+            print(f"✗ Error creating tag: {e}")
+            raise e
+    
+    def get_full_chat(self, chat_id):
+        """Get full chat details by ID, from whichever partition holds it"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        schema = self.locate_chat(cursor, chat_id) or 'main'
+        
+        cursor.execute(f'''
+            SELECT c.id, c.platform, c.conversation_id, c.timestamp,
+                   chatcat_decompress(cc.user_message), chatcat_decompress(cc.ai_response),
+                   cc.metadata, 
+                   COALESCE(c.notes, '') as notes, 
+                   COALESCE(c.tags, '') as tags
+            FROM {schema}.chats c
+            LEFT JOIN {schema}.chat_content cc ON cc.chat_id = c.id
+            WHERE c.id = ?
+        ''', (chat_id,))
+        
+        result = cursor.fetchone()
+        conn.close()
+        return result
+    
+    @staticmethod
+    def parse_highlighted(marked):
+        """
+        Strip highlight markers from FTS5 output.
+        
+        Returns:
+            (text, spans) where spans are [start, end) pairs in UTF-16 code
+            units, which is how JavaScript indexes strings
+        """
+        if not marked:
+            return marked or '', []
+        
+        text = []
+        spans = []
+        position = 0
+        start = None
+        for char in marked:
+            if char == HIGHLIGHT_OPEN:
+                start = position
+            elif char == HIGHLIGHT_CLOSE:
+                if start is not None and position > start:
+                    spans.append([start, position])
+                start = None
+            else:
+                text.append(char)
+                position += 2 if ord(char) > 0xFFFF else 1
+        return ''.join(text), spans
+    
+    def get_highlights(self, chat_id, query):
+        """
+        Match offsets for a chat's fields, computed by the FTS index itself so
+        they agree with the tokenizer that produced the match.
+        
+        Returns:
+            Dict of field name -> list of [start, end) UTF-16 offsets
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        schema = self.locate_chat(cursor, chat_id) or 'main'
+        
+        try:
+            cursor.execute(f'''
+                SELECT highlight(chats_fts, 0, ?, ?), highlight(chats_fts, 1, ?, ?),
+                       highlight(chats_fts, 2, ?, ?)
+                FROM {schema}.chats_fts WHERE chats_fts MATCH ? AND rowid = ?
+            ''', (HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE) * 3 + (query, int(chat_id)))
+            row = cursor.fetchone()
+        except sqlite3.OperationalError:
+            row = None  # Query is not valid FTS syntax
+        conn.close()
+        
+        if not row:
+            return {}
+        return {field: self.parse_highlighted(marked)[1]
+                for field, marked in zip(('user_message', 'ai_response', 'notes'), row)}
+    
+    @staticmethod
+    def build_prefix_query(text):
+        """
+        Turn partially typed input into a safe FTS5 prefix query.
+        
+        Every word becomes a quoted term, so FTS syntax characters in the
+        input can't cause errors, and the word still being typed (no
+        trailing space) matches as a prefix.
+        """
+        words = re.findall(r'\w+', text or '')
+        if not words:
+            return None
+        
+        terms = ['"' + word + '"' for word in words]
+        if not text[-1].isspace():
+            terms[-1] += '*'
+        return ' '.join(terms)
+    
+    @staticmethod
+    def query_terms(query):
+        """
+        The words an FTS5 query searches for, without its syntax: column
+        filters, NEAR groups and their distances, prefix stars, initial
+        token carets and the boolean operators are dropped.
+        """
+        if not query:
+            return []
+        query = re.sub(r'(?:\{[^}]*\}|\b(?:user_message|ai_response|notes|tags))\s*:', ' ', query)
+        query = re.sub(r',\s*\d+\s*\)', ')', query)
+        return [term for term in re.sub(r'["()*^+\-]', ' ', query).split()
+                if term not in ('AND', 'OR', 'NOT', 'NEAR')]
+    
+    @staticmethod
+    def build_any_terms_query(text):
+        """
+        Turn free text into an FTS5 query matching any of its words, the
+        keyword side of a hybrid search. Stopwords are left out unless
+        nothing else is left, so they don't match nearly every chat.
+        """
+        words = re.findall(r'\w+', text or '')
+        keywords = [word for word in words if word.lower() not in EMBED_STOPWORDS] or words
+        if not keywords:
+            return None
+        return ' OR '.join('"' + word + '"' for word in keywords)
+    
+    @staticmethod
+    def normalise_term(word):
+        """Fold a word the way the unicode61 tokenizer does: lower case, no diacritics"""
+        word = word.lower()
+        if not word.isascii():
+            word = ''.join(ch for ch in unicodedata.normalize('NFKD', word) if not unicodedata.combining(ch))
+        return word
+    
+    @classmethod
+    def extract_terms(cls, *texts):
+        """Distinct words of the texts worth a spelling-index entry"""
+        terms = set()
+        for text in texts:
+            for word in set(re.findall(r'[^\W_]+', text or '')):
+                if 3 <= len(word) <= FUZZY_MAX_CHARS and not word.isdigit():
+                    terms.add(cls.normalise_term(word))
+        return terms
+    
+    @staticmethod
+    def term_trigrams(term):
+        """Character trigrams of a term, padded so its first and last letters count"""
+        padded = f' {term} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    def index_terms(self, cursor, terms):
+        """Add the terms not yet in the spelling index, with their trigrams"""
+        terms = list(terms)
+        for start in range(0, len(terms), 500):
+            chunk = terms[start:start + 500]
+            cursor.execute(f'SELECT term FROM fuzzy_terms WHERE term IN ({",".join("?" * len(chunk))})', chunk)
+            known = {row[0] for row in cursor.fetchall()}
+            for term in chunk:
+                if term in known:
+                    continue
+                cursor.execute('INSERT INTO fuzzy_terms (term, length) VALUES (?, ?)', (term, len(term)))
+                term_id = cursor.lastrowid
+                cursor.executemany('INSERT INTO fuzzy_trigrams (trigram, term_id) VALUES (?, ?)',
+                                   [(trigram, term_id) for trigram in self.term_trigrams(term)])
+    
+    def build_term_index(self, cursor):
+        """Fill the spelling index from the full-text index's vocabulary"""
+        cursor.execute('SELECT term FROM chats_fts_vocab')
+        terms = [term for (term,) in cursor.fetchall()
+                 if 3 <= len(term) <= FUZZY_MAX_CHARS and not term.isdigit()]
+        if not terms:
+            return
+        print(f"▶ Building the spelling index from {len(terms)} indexed word(s)...")
+        self.index_terms(cursor, terms)
+        print("✓ Spelling index built")
+    
+    @staticmethod
+    def edit_distance(a, b, limit):
+        """
+        Edits (insert, delete, substitute, swap adjacent) turning a into b,
+        or limit + 1 once it is certain to exceed limit. Only the diagonal
+        band within limit of the corner-to-corner path is computed.
+        """
+        if abs(len(a) - len(b)) > limit:
+            return limit + 1
+        over = limit + 1
+        previous2, previous = None, [j if j <= limit else over for j in range(len(b) + 1)]
+        for i in range(1, len(a) + 1):
+            current = [i if i <= limit else over] + [over] * len(b)
+            low, high = max(1, i - limit), min(len(b), i + limit)
+            for j in range(low, high + 1):
+                distance = previous[j - 1] + (a[i - 1] != b[j - 1])
+                if previous[j] < distance:
+                    distance = previous[j] + 1
+                if current[j - 1] < distance:
+                    distance = current[j - 1] + 1
+                if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]
+                        and previous2[j - 2] < distance):
+                    distance = previous2[j - 2] + 1
+                current[j] = distance
+            if min(current[low - 1:high + 1]) > limit:
+                return over
+            previous2, previous = previous, current
+        return min(previous[-1], over)
+    
+    def close_terms(self, cursor, word):
+        """
+        Indexed spellings of a word within its edit budget, closest and then
+        most common first.
+        
+        Terms sharing too few trigrams to be close (each edit breaks at most
+        four) are skipped in SQL, and only the FUZZY_CANDIDATES sharing the
+        most are compared in Python.
+        
+        Returns:
+            List of terms, which includes the word itself if it is indexed
+        """
+        term = self.normalise_term(word)
+        edits = 2 if len(term) >= FUZZY_TWO_EDITS_CHARS else 1 if len(term) >= FUZZY_ONE_EDIT_CHARS else 0
+        if not edits:
+            return [term]
+        
+        trigrams = list(self.term_trigrams(term))
+        cursor.execute(f'''
+            SELECT t.term FROM fuzzy_trigrams g JOIN fuzzy_terms t ON t.id = g.term_id
+            WHERE g.trigram IN ({",".join("?" * len(trigrams))}) AND t.length BETWEEN ? AND ?
+            GROUP BY t.id HAVING COUNT(*) >= ?
+            ORDER BY COUNT(*) DESC LIMIT ?
+        ''', trigrams + [len(term) - edits, len(term) + edits, max(1, len(trigrams) - 4 * edits),
+                         FUZZY_CANDIDATES])
+        distances = {}
+        for (candidate,) in cursor.fetchall():
+            distance = self.edit_distance(term, candidate, edits)
+            if distance <= edits:
+                distances[candidate] = distance
+        if not distances:
+            return []
+        
+        # Words of since-deleted chats stay in the spelling index; the
+        # vocabulary says which are still matched and how widely. Words of
+        # moved chats are only in their partitions' vocabularies.
+        candidates = list(distances)
+        cursor.execute(f'SELECT term, doc FROM chats_fts_vocab WHERE term IN ({",".join("?" * len(candidates))})',
+                       candidates)
+        docs = dict(cursor.fetchall())
+        missing = [t for t in candidates if not docs.get(t)]
+        if missing:
+            docs.update(self.partition_term_docs(cursor, missing))
+        ranked = sorted((t for t in candidates if docs.get(t)), key=lambda t: (distances[t], -docs[t], t))
+        return ranked[:FUZZY_EXPANSIONS]
+    
+    def partition_term_docs(self, cursor, terms):
+        """Chats matching each term across every partition, from their vocabularies"""
+        docs = Counter()
+        for partition in self.get_partitions(cursor):
+            self.attach_partition(cursor, partition['path'])
+            try:
+                cursor.execute(f'SELECT term, doc FROM part.chats_fts_vocab WHERE term IN ({",".join("?" * len(terms))})',
+                               terms)
+                docs.update(dict(cursor.fetchall()))
+            finally:
+                cursor.execute('DETACH DATABASE part')
+        return docs
+    
+    def build_fuzzy_query(self, text):
+        """
+        Turn free text into an FTS5 query tolerating typos: every word must
+        match, as typed or as any close spelling found in the index.
+        """
+        words = re.findall(r'[^\W_]+', text or '')
+        if not words:
+            return None
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        groups = []
+        for word in words:
+            spellings = [word] + [t for t in self.close_terms(cursor, word) if t != self.normalise_term(word)]
+            quoted = ['"' + spelling + '"' for spelling in spellings]
+            groups.append('(' + ' OR '.join(quoted) + ')' if len(quoted) > 1 else quoted[0])
+        conn.close()
+        return ' AND '.join(groups)
+    
+    @staticmethod
+    def extract_code_blocks(text):
+        """
+        Fenced code blocks of an answer, unclosed ones (a capture cut off
+        mid-stream) aside.
+        
+        Returns:
+            List of (start, language, code), start being the code's
+            character offset in text
+        """
+        return [(match.start(3), match.group(2).lower() or None, match.group(3).rstrip('\n'))
+                for match in CODE_FENCE_RE.finditer(text or '') if match.group(3).strip()]
+    
+    @staticmethod
+    def identifier_words(identifier):
+        """Lower-cased words of an identifier, split at dots, underscores and case changes"""
+        return [word.lower() for word in CODE_WORD_RE.findall(identifier)]
+    
+    @classmethod
+    def code_tokens(cls, code):
+        """
+        The text indexed for a code block: each identifier as its words, led
+        by the words run together when there are several, so a query for
+        'get_user_name', 'getUserName' or 'user' all find getUserName.
+        """
+        tokens = []
+        for identifier in CODE_IDENTIFIER_RE.findall(code or ''):
+            words = cls.identifier_words(identifier)
+            if len(words) > 1:
+                tokens.append(''.join(words))
+            tokens.extend(words)
+        return ' '.join(tokens)
+    
+    @classmethod
+    def build_code_query(cls, text):
+        """
+        Turn free text into an FTS5 query over code_tokens(): every
+        identifier must appear, as its words in order or run together.
+        """
+        groups = []
+        for identifier in CODE_IDENTIFIER_RE.findall(text or ''):
+            words = cls.identifier_words(identifier)
+            if len(words) > 1:
+                groups.append(f'("{"".join(words)}" OR "{" ".join(words)}")')
+            elif words:
+                groups.append(f'"{words[0]}"')
+        return ' AND '.join(groups) or None
+    
+    def index_code_blocks(self, cursor, chat_id, ai_response, schema='main'):
+        """Replace a chat's extracted code blocks; triggers keep code_fts in step"""
+        blocks = self.extract_code_blocks(ai_response)
+        cursor.execute(f'SELECT start, language, code FROM {schema}.code_blocks WHERE chat_id = ? ORDER BY position',
+                       (chat_id,))
+        if cursor.fetchall() == blocks:
+            return
+        cursor.execute(f'DELETE FROM {schema}.code_blocks WHERE chat_id = ?', (chat_id,))
+        if cursor.rowcount:
+            self.purge_code_index(cursor, schema)
+        cursor.executemany(f'''
+            INSERT INTO {schema}.code_blocks (chat_id, position, start, language, code) VALUES (?, ?, ?, ?, ?)
+        ''', [(chat_id, position, start, language, code)
+              for position, (start, language, code) in enumerate(blocks)])
+    
+    def index_all_code_blocks(self, cursor, batch=EXPORT_BATCH):
+        """Extract the code blocks of every stored answer"""
+        cursor.execute('SELECT COUNT(*) FROM chat_content')
+        total = cursor.fetchone()[0]
+        if not total:
+            return
+        print(f"▶ Extracting code blocks from {total} chat(s)...")
+        
+        reader = cursor.connection.cursor()
+        reader.execute('SELECT chat_id, chatcat_decompress(ai_response) FROM chat_content ORDER BY chat_id')
+        done = 0
+        while True:
+            rows = reader.fetchmany(batch)
+            if not rows:
+                break
+            for chat_id, ai_response in rows:
+                self.index_code_blocks(cursor, chat_id, ai_response)
+            done += len(rows)
+            print(f"  {done}/{total}", end='\r')
+        cursor.execute('SELECT COUNT(*) FROM code_blocks')
+        print(f"✓ Extracted {cursor.fetchone()[0]} code block(s)")
+    
+    def build_search_sql(self, query=None, platforms=None, start_date=None,
+                         end_date=None, tags=None, order='relevance', semantic=None,
+                         collapse=False, schema='main'):
+        """
+        Build the SQL for the rows matching a search.
+        
+        With semantic text the nearest chats by embedding are matched,
+        ranked by similarity, or, together with a query, blended with its
+        bm25 ranking by reciprocal rank fusion. collapse keeps only the
+        best-ranked match of each near-duplicate group. schema names the
+        database searched, 'main' or an attached partition.
+        
+        Returns:
+            (matches_sql, where_clauses, order_sql, params). matches_sql
+            selects the matching chats rows plus a relevance column, aliased
+            c; the where clauses and order apply on top of it.
+        """
+        where_clauses = []
+        params = []
+        
+        if platforms and len(platforms) > 0:
+            placeholders = ','.join('?' * len(platforms))
+            where_clauses.append(f'c.platform IN ({placeholders})')
+            params.extend(platforms)
+        
+        if start_date:
+            where_clauses.append('c.timestamp >= ?')
+            params.append(start_date)
+        
+        if end_date:
+            where_clauses.append('c.timestamp <= ?')
+            params.append(end_date)
+        
+        if tags and len(tags) > 0:
+            tag_conditions = []
+            for tag in tags:
+                tag_conditions.append('c.tags LIKE ?')
+                params.append(f'%{tag}%')
+            where_clauses.append('(' + ' OR '.join(tag_conditions) + ')')
+        
+        # CROSS JOIN keeps the FTS side as the outer loop; left to itself the
+        # planner drives filtered searches from a chats index and re-runs
+        # MATCH for every candidate row
+        if semantic:
+            scores = self.semantic_scores(semantic, where_clauses, params, ranks=bool(query))
+            nearest = 'SELECT CAST(key AS INTEGER) AS id, value AS score FROM json_each(?)'
+            if query:
+                # Both sides contribute their best SEMANTIC_CANDIDATES
+                # passing the filters
+                keyword_where = ' AND '.join(where_clauses) if where_clauses else '1=1'
+                matches_sql = f'''
+                    SELECT c.*, h.relevance
+                    FROM (SELECT id, SUM(score) AS relevance FROM (
+                              SELECT id, 1.0 / ({RRF_K} + ROW_NUMBER() OVER (ORDER BY rank)) AS score
+                              FROM (SELECT f.rowid AS id, f.rank
+                                    FROM (SELECT rowid, bm25(chats_fts, 1.0, 1.0, 2.0, 3.0) AS rank
+                                          FROM {schema}.chats_fts WHERE chats_fts MATCH ?) f
+                                    CROSS JOIN {schema}.chats c ON c.id = f.rowid
+                                    WHERE {keyword_where}
+                                    ORDER BY f.rank LIMIT {SEMANTIC_CANDIDATES})
+                              UNION ALL {nearest})
+                          GROUP BY id) h
+                    CROSS JOIN {schema}.chats c ON c.id = h.id
+                '''
+                params = [query] + params + [scores] + params
+            else:
+                matches_sql = f'''
+                    SELECT c.*, v.score AS relevance
+                    FROM ({nearest}) v CROSS JOIN {schema}.chats c ON c.id = v.id
+                '''
+                params = [scores] + params
+            order_sql = 'relevance DESC, timestamp DESC'
+        elif query and order == 'recent':
+            matches_sql = f'''
+                SELECT c.*, 0 AS relevance
+                FROM (SELECT rowid FROM {schema}.chats_fts WHERE chats_fts MATCH ?) f
+                CROSS JOIN {schema}.chats c ON c.id = f.rowid
+            '''
+            order_sql = 'id DESC'
+            params = [query] + params
+        elif query:
+            matches_sql = f'''
+                SELECT c.*, -f.score AS relevance
+                FROM (SELECT rowid, bm25(chats_fts, 1.0, 1.0, 2.0, 3.0) AS score
+                      FROM {schema}.chats_fts WHERE chats_fts MATCH ?) f
+                CROSS JOIN {schema}.chats c ON c.id = f.rowid
+            '''
+            order_sql = 'relevance DESC, timestamp ASC'
+            params = [query] + params
+        else:
+            matches_sql = f'SELECT c.*, 0 AS relevance FROM {schema}.chats c'
+            order_sql = 'timestamp DESC'
+        
+        if collapse:
+            # Drop the matches outranked by another match of their duplicate
+            # group. Only grouped chats are ranked, and after the filters, so
+            # a filtered-out duplicate never hides one that passes.
+            where_sql = ' AND '.join(where_clauses) if where_clauses else '1=1'
+            where_clauses = where_clauses + [f'''c.id NOT IN (
+                SELECT id FROM (
+                    SELECT m.id, ROW_NUMBER() OVER (PARTITION BY s.dup_group ORDER BY {order_sql}) AS dup_rank
+                    FROM ({matches_sql} WHERE {where_sql}) m
+                    JOIN {schema}.chat_minhash s ON s.chat_id = m.id AND s.dup_group IS NOT NULL
+                ) WHERE dup_rank > 1
+            )''']
+            params = params + params
+        
+        return matches_sql, where_clauses, order_sql, params
+    
+    def semantic_scores(self, text, where_clauses, params, ranks=False):
+        """
+        Nearest chats to text among those passing the filters, as a JSON
+        object of id -> cosine similarity, or -> reciprocal rank when ranks.
+        """
+        if self.vectors is None:
+            raise ValueError("Semantic search is not enabled")
+        
+        ids = None
+        if where_clauses:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT c.id FROM chats c WHERE {" AND ".join(where_clauses)}', params)
+            ids = [row[0] for row in cursor.fetchall()]
+            conn.close()
+        
+        nearest = self.vectors.search(text, SEMANTIC_CANDIDATES, ids)
+        if ranks:
+            return json.dumps({chat_id: 1.0 / (RRF_K + rank) for rank, (chat_id, _) in enumerate(nearest, 1)})
+        return json.dumps({chat_id: score for chat_id, score in nearest})
+    
+    def advanced_search(self, query=None, platforms=None, start_date=None, 
+                       end_date=None, tags=None, limit=100, offset=0, order='relevance',
+                       semantic=None, collapse=False, facets=False):
+        """
+        Advanced search with bm25 relevance ranking.
+        
+        With order='recent' query matches are returned newest first instead.
+        FTS5 walks its rowid order directly then, so broad prefix queries
+        typed into the search box stay fast regardless of how many rows match.
+        
+        Ranking weights notes x2 and tags x3 over the message bodies and
+        runs entirely inside the FTS index, so only the returned page has
+        its bodies read (and decompressed) to build previews. semantic
+        text searches by meaning instead, and collapse hides near-duplicates
+        (see build_search_sql). Partitions overlapping the date range are
+        searched too (see search_partitions); semantic search covers the
+        main database only. With facets, the total is counted together
+        with the matches per platform, tag and month (see count_facets).
+        
+        Returns:
+            (rows, total, search_terms, facets) where each row is
+            (id, platform, conversation_id, timestamp, user_preview,
+             ai_preview, notes, tags, relevance, user_length, ai_length,
+             highlights). For queries the previews are the best matching
+            windows and highlights maps each field to match offsets.
+            facets is None unless asked for.
+        """
+        search_terms = self.query_terms(query)
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        partitions = [] if semantic else self.get_partitions(cursor, start_date, end_date)
+        if partitions:
+            paginated_results, total, counts = self.search_partitions(
+                cursor, partitions, query, platforms, start_date, end_date, tags, order,
+                collapse, limit, offset, facets)
+            conn.close()
+            return paginated_results, total, search_terms, counts and self.format_facets(counts)
+        
+        matches_sql, where_clauses, order_sql, params = self.build_search_sql(
+            query, platforms, start_date, end_date, tags, order, semantic, collapse)
+        where_sql = ' AND '.join(where_clauses) if where_clauses else '1=1'
+        
+        counts = None
+        if facets:
+            total, counts = self.count_facets(cursor, query, platforms, start_date, end_date, tags,
+                                              order, semantic, collapse)
+        elif query and not semantic and not where_clauses:
+            # The index mirrors chats, so it can count matches on its own
+            cursor.execute('SELECT COUNT(*) FROM chats_fts WHERE chats_fts MATCH ?', (query,))
+            total = cursor.fetchone()[0]
+        else:
+            cursor.execute(f'SELECT COUNT(*) FROM ({matches_sql} WHERE {where_sql})', params)
+            total = cursor.fetchone()[0]
+        
+        # Page on the hot rows first; bodies are only touched for this page
+        cursor.execute(f'''
+            SELECT m.id, m.platform, m.conversation_id, m.timestamp,
+                   substr(chatcat_decompress(cc.user_message), 1, ?),
+                   substr(chatcat_decompress(cc.ai_response), 1, ?),
+                   COALESCE(m.notes, '') as notes, 
+                   COALESCE(m.tags, '') as tags,
+                   m.relevance, m.user_length, m.ai_length
+            FROM ({matches_sql} WHERE {where_sql}
+                  ORDER BY {order_sql} LIMIT ? OFFSET ?) m
+            LEFT JOIN chat_content cc ON cc.chat_id = m.id
+            ORDER BY {order_sql}
+        ''', [PREVIEW_CHARS, PREVIEW_CHARS] + params + [limit, offset])
+        paginated_results = [list(row) + [{}] for row in cursor.fetchall()]
+        
+        if query:
+            self.add_highlights(cursor, paginated_results, query)
+        
+        conn.close()
+        return paginated_results, total, search_terms, counts and self.format_facets(counts)
+    
+    def count_facets(self, cursor, query=None, platforms=None, start_date=None, end_date=None,
+                     tags=None, order='relevance', semantic=None, collapse=False, schema='main'):
+        """
+        Count a search's matches in total and per platform, tag and month,
+        in one statement grouping the matching rows.
+        
+        The platform and tag filters each keep chats having any of their
+        values, so those facets are counted with their own filter left
+        out: the count next to a platform is what ticking it would add.
+        Semantic and collapsed searches choose their matches under every
+        filter, so there each facet counts the matches themselves. Tags
+        are the defined ones, matched the way the tag filter matches them.
+        
+        Returns:
+            (total, {'platforms': Counter, 'tags': Counter, 'months': Counter})
+        """
+        separate = not (semantic or collapse)
+        # Counting needs no ranking, so keyword matches skip bm25
+        matches_sql, where_clauses, _, params = self.build_search_sql(
+            query, None if separate else platforms, start_date, end_date, None if separate else tags,
+            order if collapse else 'recent', semantic, collapse, schema)
+        where_sql = ' AND '.join(where_clauses) if where_clauses else '1=1'
+        
+        platform_sql, platform_params = '1=1', []
+        if separate and platforms:
+            platform_sql = f"m.platform IN ({','.join('?' * len(platforms))})"
+            platform_params = list(platforms)
+        tag_sql, tag_params = '1=1', []
+        if separate and tags:
+            tag_sql = '(' + ' OR '.join(['m.tags LIKE ?'] * len(tags)) + ')'
+            tag_params = [f'%{tag}%' for tag in tags]
+        
+        # m is used four times, so SQLite evaluates the search once into a
+        # temporary table and every count groups that. Tags are matched
+        # from the tagged chats outward: most chats have none, and the other
+        # way round LIKE runs over every chat once per tag
+        cursor.execute(f'''
+            WITH m AS (SELECT platform, tags, timestamp FROM ({matches_sql} WHERE {where_sql}))
+            SELECT 'total', NULL, COUNT(*) FROM m WHERE {platform_sql} AND {tag_sql}
+            UNION ALL
+            SELECT 'platforms', m.platform, COUNT(*) FROM m WHERE {tag_sql} GROUP BY m.platform
+            UNION ALL
+            SELECT 'months', substr(m.timestamp, 1, 7), COUNT(*) FROM m
+            WHERE {platform_sql} AND {tag_sql} GROUP BY substr(m.timestamp, 1, 7)
+            UNION ALL
+            SELECT 'tags', t.name, COUNT(*) FROM m CROSS JOIN main.tags t ON m.tags LIKE '%' || t.name || '%'
+            WHERE m.tags <> '' AND {platform_sql} GROUP BY t.name
+        ''', params + platform_params + tag_params + tag_params + platform_params + tag_params + platform_params)
+        
+        total = 0
+        counts = {'platforms': Counter(), 'tags': Counter(), 'months': Counter()}
+        for facet, value, count in cursor.fetchall():
+            if facet == 'total':
+                total = count
+            elif value is not None:
+                counts[facet][value] = count
+        return total, counts
+    
+    def format_facets(self, counts):
+        """Facet counts for a response: platforms and tags by count, months newest first"""
+        return {
+            'platforms': dict(counts['platforms'].most_common()),
+            'tags': dict(counts['tags'].most_common()),
+            'months': dict(sorted(counts['months'].items(), reverse=True))
+        }
+    
+    def add_highlights(self, cursor, rows, query, schema='main'):
+        """Replace the previews of advanced_search rows by their best matching windows"""
+        # Auxiliary functions need the MATCH cursor, so run one rowid
+        # lookup per row on the page
+        for row in rows:
+            cursor.execute(f'''
+                SELECT snippet(chats_fts, 0, ?, ?, '…', ?), snippet(chats_fts, 1, ?, ?, '…', ?),
+                       highlight(chats_fts, 2, ?, ?)
+                FROM {schema}.chats_fts WHERE chats_fts MATCH ? AND rowid = ?
+            ''', (HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, SNIPPET_TOKENS) * 2 +
+                (HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, query, row[0]))
+            marked = cursor.fetchone()
+            if not marked:
+                continue
+            for column, field, value in zip((4, 5, 6), ('user_message', 'ai_response', 'notes'), marked):
+                row[column], row[11][field] = self.parse_highlighted(value)
+    
+    def search_partitions(self, cursor, partitions, query, platforms, start_date, end_date,
+                          tags, order, collapse, limit, offset, facets=False):
+        """
+        Run a search over the main database and the given partitions and
+        merge the ranked results.
+        
+        Each database is attached in turn and gives its match count and its
+        best offset + limit matches (ids and sort keys only); only the rows
+        of the merged page then have their previews read. Listed newest
+        first, partitions that can't reach the page are not queried for
+        matches, and without filters their counts come from the registry.
+        bm25 scores are computed per database, so merged relevance ranking
+        is approximate across partitions. With facets, each database's
+        counts are added up and no count is taken from the registry.
+        
+        Returns:
+            (rows, total, counts) with rows as in advanced_search and counts
+            as in count_facets, or None without facets
+        """
+        wanted = offset + limit
+        unfiltered = not (query or platforms or start_date or end_date or tags or collapse or facets)
+        matches = []            # (sort key, id, relevance, partition index or None)
+        total = 0
+        counts = None
+        
+        for index, partition in [(None, None)] + list(enumerate(partitions)):
+            # Newest first without a query: a partition whose newest chat is
+            # older than the page's last row has nothing to add to it
+            skip_page = (partition is not None and not query and 0 < wanted <= len(matches) and
+                         partition['last_timestamp'] < matches[wanted - 1][0][1])
+            if skip_page and unfiltered:
+                total += partition['chats']
+                continue
+            
+            schema = 'main'
+            if partition is not None:
+                self.attach_partition(cursor, partition['path'])
+                schema = 'part'
+            try:
+                matches_sql, where_clauses, order_sql, params = self.build_search_sql(
+                    query, platforms, start_date, end_date, tags, order, None, collapse, schema)
+                where_sql = ' AND '.join(where_clauses) if where_clauses else '1=1'
+                if facets:
+                    count, found = self.count_facets(cursor, query, platforms, start_date, end_date,
+                                                     tags, order, None, collapse, schema)
+                    total += count
+                    counts = counts or found
+                    if found is not counts:
+                        for facet, values in found.items():
+                            counts[facet].update(values)
+                else:
+                    cursor.execute(f'SELECT COUNT(*) FROM ({matches_sql} WHERE {where_sql})', params)
+                    total += cursor.fetchone()[0]
+                if not skip_page:
+                    cursor.execute(f'''
+                        SELECT id, relevance, timestamp FROM ({matches_sql} WHERE {where_sql})
+                        ORDER BY {order_sql} LIMIT ?
+                    ''', params + [wanted])
+                    for chat_id, relevance, timestamp in cursor.fetchall():
+                        if query and order == 'recent':
+                            key = (-chat_id,)
+                        elif query:
+                            key = (-relevance, timestamp or '')
+                        else:
+                            key = (0, timestamp or '')
+                        matches.append((key, chat_id, relevance, index))
+                    if query:
+                        matches.sort()
+                    else:
+                        matches.sort(key=lambda match: match[0][1], reverse=True)
+            finally:
+                if partition is not None:
+                    cursor.execute('DETACH DATABASE part')
+        
+        page = matches[offset:wanted]
+        rows = {}
+        for index in {match[3] for match in page}:
+            ids = [match[1] for match in page if match[3] == index]
+            schema = 'main'
+            if index is not None:
+                self.attach_partition(cursor, partitions[index]['path'])
+                schema = 'part'
+            try:
+                found = self.result_rows(cursor, ids, schema)
+                if query:
+                    self.add_highlights(cursor, found, query, schema)
+                rows.update((row[0], row) for row in found)
+            finally:
+                if index is not None:
+                    cursor.execute('DETACH DATABASE part')
+        
+        results = []
+        for _, chat_id, relevance, _ in page:
+            if chat_id in rows:
+                rows[chat_id][8] = relevance
+                results.append(rows[chat_id])
+        return results, total, counts
+    
+    def search_code(self, query=None, platforms=None, start_date=None, end_date=None,
+                    tags=None, language=None, limit=50, offset=0):
+        """
+        Search extracted code blocks only, best bm25 match first (newest
+        first without a query). Bodies of the chats are never read.
+        Partitions overlapping the date range are searched too, and their
+        best offset + limit blocks merged with the main database's.
+        
+        Returns:
+            (blocks, total) where each block is a dict with the chat's id,
+            platform, conversation and timestamp, the block's position and
+            language, up to CODE_PREVIEW_CHARS of its code and the 1-based
+            numbers of the lines containing a query word
+        """
+        _, where_clauses, _, params = self.build_search_sql(None, platforms, start_date, end_date, tags)
+        if language:
+            where_clauses.append('b.language = ?')
+            params.append(language.lower())
+        where_sql = ' AND '.join(where_clauses) if where_clauses else '1=1'
+        
+        if query:
+            matches_sql = '''
+                SELECT b.*, -f.score AS relevance
+                FROM (SELECT rowid, bm25(code_fts) AS score FROM {schema}.code_fts WHERE code_fts MATCH ?) f
+                CROSS JOIN {schema}.code_blocks b ON b.id = f.rowid
+            '''
+            order_sql = 'relevance DESC, b.id DESC'
+            params = [query] + params
+        else:
+            matches_sql = 'SELECT b.*, 0 AS relevance FROM {schema}.code_blocks b'
+            order_sql = 'b.id DESC'
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        partitions = self.get_partitions(cursor, start_date, end_date)
+        total = 0
+        rows = []
+        for partition in [None] + partitions:
+            schema = 'main'
+            if partition is not None:
+                self.attach_partition(cursor, partition['path'])
+                schema = 'part'
+            try:
+                schema_sql = matches_sql.format(schema=schema)
+                cursor.execute(f'''
+                    SELECT COUNT(*) FROM ({schema_sql}) b CROSS JOIN {schema}.chats c ON c.id = b.chat_id
+                    WHERE {where_sql}
+                ''', params)
+                total += cursor.fetchone()[0]
+                
+                # Alone, the main database pages in SQL; merged, each database
+                # gives its best offset + limit blocks
+                cursor.execute(f'''
+                    SELECT b.id, c.id, c.platform, c.conversation_id, c.timestamp, b.position, b.language,
+                           substr(b.code, 1, ?), length(b.code), b.relevance
+                    FROM ({schema_sql}) b CROSS JOIN {schema}.chats c ON c.id = b.chat_id
+                    WHERE {where_sql}
+                    ORDER BY {order_sql} LIMIT ? OFFSET ?
+                ''', [CODE_PREVIEW_CHARS] + params + ([limit, offset] if not partitions else [offset + limit, 0]))
+                rows.extend(cursor.fetchall())
+            finally:
+                if partition is not None:
+                    cursor.execute('DETACH DATABASE part')
+        conn.close()
+        
+        if partitions:
+            rows.sort(key=lambda row: (-row[9], -row[0]))
+            rows = rows[offset:offset + limit]
+        
+        words = set(re.findall(r'\w+', query or '')) - {'AND', 'OR', 'NOT'}
+        blocks = []
+        for block_id, chat_id, platform, conversation_id, timestamp, position, block_language, code, length, relevance in rows:
+            lines = [number for number, line in enumerate(code.split('\n'), 1)
+                     if words & set(self.code_tokens(line).split())]
+            blocks.append({
+                'block_id': block_id,
+                'id': chat_id,
+                'platform': platform,
+                'conversation_id': conversation_id,
+                'timestamp': timestamp,
+                'position': position,
+                'language': block_language,
+                'code': code,
+                'length': length,
+                'lines': lines,
+                'relevance': round(relevance, 3)
+            })
+        return blocks, total
+    
+    def compact_duplicates(self, dry_run=False):
+        """
+        Merge rows that are partial captures of the same exchange.
+        
+        Rows sharing platform, conversation and prompt are compared by
+        answer: any row whose answer is a prefix of a longer one is folded
+        into it (tags unioned, notes appended) and deleted. Distinct answers
+        to the same prompt, such as regenerations, are kept. Rows with a
+        turn ordinal are distinct turns, even with the same prompt (say,
+        "continue"), and are left alone. A dry run writes nothing.
+        
+        Returns:
+            Number of rows removed (or that would be removed)
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        # Rows captured before prompt hashes existed
+        cursor.execute('''
+            SELECT c.id, chatcat_decompress(cc.user_message)
+            FROM chats c JOIN chat_content cc ON cc.chat_id = c.id
+            WHERE c.user_hash IS NULL
+        ''')
+        cursor.executemany('UPDATE chats SET user_hash = ? WHERE id = ?',
+                           [(self.hash_prompt(user), chat_id) for chat_id, user in cursor.fetchall()])
+        if not dry_run:
+            conn.commit()
+        
+        cursor.execute('''
+            SELECT platform, conversation_id, user_hash FROM chats
+            WHERE turn_index IS NULL
+            GROUP BY platform, conversation_id, user_hash
+            HAVING COUNT(*) > 1
+        ''')
+        groups = cursor.fetchall()
+        removed = 0
+        
+        for platform, conversation_id, user_hash in groups:
+            cursor.execute('''
+                SELECT c.id, chatcat_decompress(cc.ai_response), COALESCE(c.notes, ''), COALESCE(c.tags, '')
+                FROM chats c JOIN chat_content cc ON cc.chat_id = c.id
+                WHERE c.platform = ? AND c.conversation_id IS ? AND c.user_hash = ? AND c.turn_index IS NULL
+                ORDER BY c.ai_length DESC, c.id DESC
+            ''', (platform, conversation_id, user_hash))
+            
+            kept = []
+            for chat_id, ai_response, notes, tags in cursor.fetchall():
+                text = self.normalise_text(ai_response)
+                survivor = next((k for k in kept if k['text'].startswith(text)), None)
+                if survivor is None:
+                    kept.append({'id': chat_id, 'text': text, 'notes': notes, 'tags': tags, 'merged': []})
+                    continue
+                
+                survivor['merged'].append(chat_id)
+                merged_tags = [t for t in survivor['tags'].split(',') if t]
+                merged_tags += [t for t in tags.split(',') if t and t not in merged_tags]
+                survivor['tags'] = ','.join(merged_tags)
+                if notes and notes not in survivor['notes']:
+                    survivor['notes'] = (survivor['notes'] + '\n' + notes).strip()
+            
+            for survivor in kept:
+                if not survivor['merged']:
+                    continue
+                removed += len(survivor['merged'])
+                if dry_run:
+                    continue
+                cursor.execute('UPDATE chats SET notes = ?, tags = ? WHERE id = ?',
+                               (survivor['notes'], survivor['tags'], survivor['id']))
+                self.log_change(cursor, 'chat', survivor['id'])
+                cursor.executemany('DELETE FROM chats WHERE id = ?', [(i,) for i in survivor['merged']])
+            if not dry_run:
+                self.purge_code_index(cursor)
+                self.purge_lsh_buckets(cursor)
+                conn.commit()
+        
+        # Closing without a commit drops a dry run's prompt hashes
+        conn.close()
+        print(f"✓ {'Would remove' if dry_run else 'Removed'} {removed} partial duplicate(s) "
+              f"in {len(groups)} group(s)")
+        return removed
+    
+    def train_dictionaries(self, codec='zlib', sample_size=500, dict_size=32 * 1024):
+        """Train and store one shared compression dictionary per platform"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT DISTINCT platform FROM chats')
+        platforms = [row[0] for row in cursor.fetchall()]
+        
+        for platform in platforms:
+            cursor.execute('''
+                SELECT chatcat_decompress(cc.ai_response)
+                FROM chats c JOIN chat_content cc ON cc.chat_id = c.id
+                WHERE c.platform = ?
+                ORDER BY c.id DESC LIMIT ?
+            ''', (platform, sample_size))
+            samples = [row[0] for row in cursor.fetchall()]
+            
+            data = BodyCodec.train_dictionary(codec, samples, dict_size)
+            if not data:
+                print(f"  {platform}: not enough samples, skipped")
+                continue
+            
+            cursor.execute('INSERT INTO compression_dicts (platform, codec, data) VALUES (?, ?, ?)',
+                           (platform, codec, data))
+            print(f"✓ Trained {codec} dictionary for {platform} ({len(data):,} bytes, {len(samples)} samples)")
+        
+        conn.commit()
+        self.codec.load_dictionaries(cursor)
+        conn.close()
+    
+    def recompress_bodies(self, codec=None, batch_size=500):
+        """
+        Re-encode every stored body with the given codec (None decompresses).
+        
+        Works in short batches so a running server can keep capturing, and
+        leaves the full-text index untouched since the text is unchanged.
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        last_id = 0
+        changed = 0
+        
+        while True:
+            cursor.execute('''
+                SELECT cc.chat_id, c.platform, cc.user_message, cc.ai_response
+                FROM chat_content cc JOIN chats c ON c.id = cc.chat_id
+                WHERE cc.chat_id > ?
+                ORDER BY cc.chat_id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            updates = []
+            for chat_id, platform, user_message, ai_response in rows:
+                new_user = self.codec.encode_with(codec, self.codec.decode(user_message), platform)
+                new_ai = self.codec.encode_with(codec, self.codec.decode(ai_response), platform)
+                if new_user != user_message or new_ai != ai_response:
+                    updates.append((new_user, new_ai, chat_id))
+            
+            cursor.executemany('UPDATE chat_content SET user_message = ?, ai_response = ? WHERE chat_id = ?',
+                               updates)
+            conn.commit()
+            
+            changed += len(updates)
+            last_id = rows[-1][0]
+            print(f"  ...re-encoded {changed} bodies (up to ID {last_id})")
+        
+        # Fully decompressed: the index no longer needs chatcat_decompress
+        if codec is None and self.codec.codec is None and not self.has_compressed_bodies(cursor):
+            self.compressed = False
+            cursor.execute('UPDATE body_encoding SET compressed = 0')
+            self.create_body_triggers(cursor, False)
+            conn.commit()
+        
+        conn.close()
+        print(f"✓ Re-encoded {changed} bodies with {codec or 'no compression'}")
+        return changed
+    
+    def vacuum(self):
+        """Rebuild the database file to reclaim space freed by re-encoding"""
+        conn = self._connect()
+        conn.execute('VACUUM')
+        conn.close()
+    
+    def iter_export(self, query=None, platforms=None, start_date=None,
+                    end_date=None, tags=None, order='relevance', semantic=None, collapse=False,
+                    batch=EXPORT_BATCH):
+        """
+        Yield every chat matching a search, with full bodies, in search order.
+        
+        Only matching ids are ordered up front; bodies are read and
+        decompressed one batch at a time, so memory stays flat however many
+        rows match. Chats in partitions overlapping the date range follow
+        those of the main database, newest partition first, each in search
+        order.
+        
+        Yields:
+            (id, platform, conversation_id, timestamp, user_message,
+             ai_response, metadata, notes, tags) tuples
+        """
+        conn = self._connect()
+        try:
+            ids = conn.cursor()
+            bodies = conn.cursor()
+            partitions = [] if semantic else self.get_partitions(ids, start_date, end_date)
+            for partition in [None] + partitions:
+                schema = 'main'
+                if partition is not None:
+                    self.attach_partition(ids, partition['path'])
+                    schema = 'part'
+                
+                matches_sql, where_clauses, order_sql, params = self.build_search_sql(
+                    query, platforms, start_date, end_date, tags, order, semantic, collapse, schema)
+                where_sql = ' AND '.join(where_clauses) if where_clauses else '1=1'
+                ids.execute(f'SELECT id FROM ({matches_sql} WHERE {where_sql}) ORDER BY {order_sql}', params)
+                while True:
+                    chunk = [row[0] for row in ids.fetchmany(batch)]
+                    if not chunk:
+                        break
+                    placeholders = ','.join('?' * len(chunk))
+                    bodies.execute(f'''
+                        SELECT c.id, c.platform, c.conversation_id, c.timestamp,
+                               chatcat_decompress(cc.user_message), chatcat_decompress(cc.ai_response),
+                               cc.metadata, COALESCE(c.notes, ''), COALESCE(c.tags, '')
+                        FROM {schema}.chats c
+                        LEFT JOIN {schema}.chat_content cc ON cc.chat_id = c.id
+                        WHERE c.id IN ({placeholders})
+                    ''', chunk)
+                    by_id = {row[0]: row for row in bodies.fetchall()}
+                    for chat_id in chunk:
+                        if chat_id in by_id:
+                            yield by_id[chat_id]
+                
+                if partition is not None:
+                    ids.execute('DETACH DATABASE part')
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def partition_bounds(period, name):
+        """First day of a partition's period and of the one after, as 'YYYY-MM-DD'"""
+        year, part = name.split('-')
+        if period == 'quarter':
+            month, months = (int(part[1:]) - 1) * 3 + 1, 3
+        else:
+            month, months = int(part), 1
+        years, end_month = divmod(month - 1 + months, 12)
+        return f'{year}-{month:02d}-01', f'{int(year) + years}-{end_month + 1:02d}-01'
+    
+    def get_partitions(self, cursor, start_date=None, end_date=None):
+        """Registered partitions holding chats within a date range, newest first"""
+        sql = 'SELECT * FROM partitions WHERE chats > 0'
+        params = []
+        if start_date:
+            sql += ' AND last_timestamp >= ?'
+            params.append(start_date)
+        if end_date:
+            sql += ' AND first_timestamp <= ?'
+            params.append(end_date)
+        cursor.execute(sql + ' ORDER BY period_start DESC', params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    def attach_partition(self, cursor, path, writable=False):
+        """Attach a partition file, relative to the main database, as schema 'part'"""
+        path = os.path.join(os.path.dirname(os.path.abspath(self.db_file)), path)
+        cursor.execute('ATTACH DATABASE ? AS part',
+                       (f"file:{quote(path)}?mode={'rw' if writable else 'ro'}",))
+        if writable and self.compressed:
+            # Bodies written or copied there may be compressed
+            self.mark_compressed(cursor, 'part')
+    
+    def locate_chat(self, cursor, chat_id, writable=False):
+        """
+        Find the database holding a chat, attaching its partition if it
+        was moved to one.
+        
+        Returns:
+            'main', 'part' or None when no database has the chat
+        
+        Raises:
+            ValueError: writable was asked for a chat in the archive
+        """
+        cursor.execute('SELECT 1 FROM chats WHERE id = ?', (chat_id,))
+        if cursor.fetchone():
+            return 'main'
+        
+        cursor.execute('''
+            SELECT path, period FROM partitions WHERE ? BETWEEN min_id AND max_id ORDER BY period_start DESC
+        ''', (chat_id,))
+        for path, period in cursor.fetchall():
+            archived = period == ARCHIVE_PERIOD
+            self.attach_partition(cursor, path, writable and not archived)
+            cursor.execute('SELECT 1 FROM part.chats WHERE id = ?', (chat_id,))
+            if cursor.fetchone():
+                if writable and archived:
+                    cursor.execute('DETACH DATABASE part')
+                    raise ValueError(f"Chat {chat_id} is archived and read-only")
+                return 'part'
+            cursor.execute('DETACH DATABASE part')
+        return None
+    
+    def partition_chats(self, period='month', before=None, batch=EXPORT_BATCH):
+        """
+        Move chats older than before (by default, the start of the current
+        period) out of the main database into one file per period.
+        
+        A partition is a complete chatCAT database with its own full-text,
+        code and near-duplicate indexes. Chats keep their ids, and each
+        batch is copied and deleted in one transaction; a batch cut short
+        by a crash is copied again by the next run. The spelling index
+        stays in the main database and keeps every word.
+        """
+        key_sql = PARTITION_PERIODS[period]
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT DISTINCT period FROM partitions WHERE period NOT IN (?, ?)',
+                       (period, ARCHIVE_PERIOD))
+        other = cursor.fetchone()
+        if other:
+            conn.close()
+            raise ValueError(f"Existing partitions are by {other[0]}; use the same period")
+        
+        if before is None:
+            cursor.execute(f"SELECT {key_sql.format(column='CURRENT_TIMESTAMP')}")
+            before = self.partition_bounds(period, cursor.fetchone()[0])[0]
+        
+        cursor.execute(f'''
+            SELECT {key_sql.format(column='timestamp')} AS name, COUNT(*)
+            FROM chats WHERE timestamp < ? AND name IS NOT NULL
+            GROUP BY name ORDER BY name
+        ''', (before,))
+        pending = cursor.fetchall()
+        if not pending:
+            print(f"✓ No chats before {before} to partition")
+            conn.close()
+            return
+        
+        stem = os.path.splitext(os.path.basename(self.db_file))[0]
+        directory = os.path.dirname(os.path.abspath(self.db_file))
+        for name, count in pending:
+            path = f'{stem}.{name}.db'
+            start, end = self.partition_bounds(period, name)
+            print(f"▶ Moving {count} chat(s) from {name} to {path}...")
+            
+            ChatDatabase(os.path.join(directory, path))     # Creates the schema
+            cursor.execute('''
+                INSERT OR IGNORE INTO partitions (name, period, path, period_start, period_end)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (name, period, path, start, end))
+            conn.commit()
+            
+            self.attach_partition(cursor, path, writable=True)
+            try:
+                # Compressed bodies are copied as they are, with their dictionaries
+                cursor.execute('INSERT OR IGNORE INTO part.compression_dicts SELECT * FROM compression_dicts')
+                moved = 0
+                while True:
+                    cursor.execute('''
+                        SELECT id FROM chats WHERE timestamp >= ? AND timestamp < ? LIMIT ?
+                    ''', (start, min(end, before), batch))
+                    ids = [row[0] for row in cursor.fetchall()]
+                    if not ids:
+                        break
+                    self.move_chats(cursor, name, ids)
+                    conn.commit()
+                    moved += len(ids)
+                    print(f"  {moved}/{count}", end='\r')
+                
+                self.refresh_partition(cursor, name)
+                cursor.execute("INSERT INTO part.chats_fts(chats_fts) VALUES('optimize')")
+                cursor.execute("INSERT INTO part.code_fts(code_fts) VALUES('optimize')")
+                conn.commit()
+                # Partitions are mostly read, and read-only attaches of a
+                # rollback-journal file need no -wal/-shm beside it
+                cursor.execute('PRAGMA part.journal_mode=DELETE')
+            finally:
+                cursor.execute('DETACH DATABASE part')
+            print(f"✓ {name}: {moved} chat(s) moved")
+        
+        # Deleted rows stay in the full-text segments as tombstones until
+        # they are merged away; merge now so searches here don't skip them
+        cursor.execute("INSERT INTO chats_fts(chats_fts) VALUES('optimize')")
+        cursor.execute("INSERT INTO code_fts(code_fts) VALUES('optimize')")
+        conn.commit()
+        conn.close()
+    
+    def move_chats(self, cursor, name, ids, recode=None):
+        """
+        Copy chats with their bodies and indexes into the attached
+        partition (registered as name), then delete them here. Bodies are
+        copied as stored, or re-encoded with the codec recode names.
+        """
+        placeholders = ','.join('?' * len(ids))
+        columns = ('id, platform, conversation_id, timestamp, notes, tags, '
+                   'user_length, ai_length, turn_index, user_hash')
+        
+        # Copies left by an interrupted run; the triggers clear their indexes
+        cursor.execute(f'DELETE FROM part.chats WHERE id IN ({placeholders})', ids)
+        self.purge_code_index(cursor, 'part')
+        self.purge_lsh_buckets(cursor, 'part')
+        
+        cursor.execute(f'''
+            INSERT INTO part.chats ({columns}) SELECT {columns} FROM chats WHERE id IN ({placeholders})
+        ''', ids)
+        if recode is None:
+            cursor.execute(f'''
+                INSERT INTO part.chat_content (chat_id, user_message, ai_response, metadata)
+                SELECT chat_id, user_message, ai_response, metadata FROM chat_content
+                WHERE chat_id IN ({placeholders})
+            ''', ids)
+        else:
+            cursor.execute(f'''
+                SELECT cc.chat_id, c.platform, cc.user_message, cc.ai_response, cc.metadata
+                FROM chat_content cc JOIN chats c ON c.id = cc.chat_id
+                WHERE cc.chat_id IN ({placeholders})
+            ''', ids)
+            cursor.executemany('''
+                INSERT INTO part.chat_content (chat_id, user_message, ai_response, metadata)
+                VALUES (?, ?, ?, ?)
+            ''', [(chat_id,
+                   self.codec.encode_with(recode, self.codec.decode(user_message), platform),
+                   self.codec.encode_with(recode, self.codec.decode(ai_response), platform),
+                   metadata)
+                  for chat_id, platform, user_message, ai_response, metadata in cursor.fetchall()])
+        cursor.execute(f'''
+            INSERT INTO part.code_blocks SELECT * FROM code_blocks WHERE chat_id IN ({placeholders})
+        ''', ids)
+        cursor.execute(f'''
+            INSERT INTO part.chat_minhash SELECT * FROM chat_minhash WHERE chat_id IN ({placeholders})
+        ''', ids)
+        cursor.execute(f'SELECT chat_id, signature FROM chat_minhash WHERE chat_id IN ({placeholders})', ids)
+        cursor.executemany('INSERT OR IGNORE INTO part.chat_lsh (bucket, chat_id) VALUES (?, ?)',
+                           [(bucket, chat_id) for chat_id, signature in cursor.fetchall()
+                            for bucket in self.lsh_buckets(bytes(signature))])
+        
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO partition_conversations (platform, conversation_id, partition)
+            SELECT DISTINCT platform, conversation_id, ? FROM chats
+            WHERE id IN ({placeholders}) AND conversation_id IS NOT NULL
+        ''', [name] + ids)
+        
+        # The delete triggers drop bodies, index entries, signatures and code blocks
+        cursor.execute(f'DELETE FROM chats WHERE id IN ({placeholders})', ids)
+        self.purge_code_index(cursor)
+        self.purge_lsh_buckets(cursor)
+    
+    def map_partition_conversations(self, cursor):
+        """Fill partition_conversations from the partitions made before it existed"""
+        for partition in self.get_partitions(cursor):
+            self.attach_partition(cursor, partition['path'])
+            try:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO partition_conversations (platform, conversation_id, partition)
+                    SELECT DISTINCT platform, conversation_id, ? FROM part.chats WHERE conversation_id IS NOT NULL
+                ''', (partition['name'],))
+                cursor.connection.commit()
+            finally:
+                cursor.execute('DETACH DATABASE part')
+    
+    def refresh_partition(self, cursor, name):
+        """Record what the attached partition holds in the registry"""
+        cursor.execute('SELECT platform, COUNT(*) FROM part.chats GROUP BY platform')
+        platforms = dict(cursor.fetchall())
+        cursor.execute('SELECT MIN(timestamp), MAX(timestamp), MIN(id), MAX(id) FROM part.chats')
+        first, last, min_id, max_id = cursor.fetchone()
+        cursor.execute('''
+            UPDATE partitions SET chats = ?, platforms = ?, first_timestamp = ?, last_timestamp = ?,
+                                  min_id = ?, max_id = ?
+            WHERE name = ?
+        ''', (sum(platforms.values()), json.dumps(platforms), first, last, min_id, max_id, name))
+    
+    def extend_partition(self, cursor, name, ids):
+        """Add chats just moved into the attached partition to its registry entry, without a full recount"""
+        placeholders = ','.join('?' * len(ids))
+        cursor.execute(f'SELECT platform, COUNT(*) FROM part.chats WHERE id IN ({placeholders}) GROUP BY platform',
+                       ids)
+        added = Counter(dict(cursor.fetchall()))
+        cursor.execute(f'''
+            SELECT MIN(timestamp), MAX(timestamp), MIN(id), MAX(id) FROM part.chats WHERE id IN ({placeholders})
+        ''', ids)
+        first, last, min_id, max_id = cursor.fetchone()
+        cursor.execute('SELECT platforms FROM partitions WHERE name = ?', (name,))
+        platforms = Counter(json.loads(cursor.fetchone()[0]))
+        platforms.update(added)
+        cursor.execute('''
+            UPDATE partitions SET chats = chats + ?, platforms = ?,
+                                  first_timestamp = MIN(COALESCE(first_timestamp, ?), ?),
+                                  last_timestamp = MAX(COALESCE(last_timestamp, ?), ?),
+                                  min_id = MIN(COALESCE(min_id, ?), ?), max_id = MAX(COALESCE(max_id, ?), ?)
+            WHERE name = ?
+        ''', (sum(added.values()), json.dumps(dict(platforms)), first, first, last, last,
+              min_id, min_id, max_id, max_id, name))
+    
+    def archive_chats(self, older_than_days=ARCHIVE_AGE_DAYS, batch=ARCHIVE_BATCH, pause=ARCHIVE_PAUSE):
+        """
+        Move chats older than older_than_days out of the main database into
+        the cold archive, '<db>.archive.db'.
+        
+        The archive is a partition (see partition_chats) for chats that are
+        almost never opened: bodies are recompressed with the strongest
+        codec available, and after each run its indexes are merged into a
+        single segment and the file is vacuumed. Searches only ever attach
+        it read-only, and notes and tags of archived chats can't be edited.
+        
+        Captures carry on meanwhile: each batch is its own short
+        transaction followed by a pause, and the main index drops the
+        moved rows in small merge steps rather than one long optimize.
+        
+        Returns:
+            The number of chats moved
+        """
+        codec = 'zstd' if zstandard is not None else 'zlib'
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT datetime('now', ?)", (f'-{older_than_days} days',))
+        before = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM chats WHERE timestamp < ?', (before,))
+        count = cursor.fetchone()[0]
+        if not count:
+            print(f"✓ No chats before {before} to archive")
+            conn.close()
+            return 0
+        
+        path = f'{os.path.splitext(os.path.basename(self.db_file))[0]}.archive.db'
+        print(f"▶ Archiving {count} chat(s) from before {before} to {path} ({codec})...")
+        ChatDatabase(os.path.join(os.path.dirname(os.path.abspath(self.db_file)), path))
+        # Sorts after every time partition, as it holds the oldest chats
+        cursor.execute('''
+            INSERT OR IGNORE INTO partitions (name, period, path, period_start, period_end)
+            VALUES (?, ?, ?, '', ?)
+        ''', (ARCHIVE_PERIOD, ARCHIVE_PERIOD, path, before))
+        cursor.execute('UPDATE partitions SET period_end = MAX(period_end, ?) WHERE name = ?',
+                       (before, ARCHIVE_PERIOD))
+        conn.commit()
+        
+        self.attach_partition(cursor, path, writable=True)
+        moved = 0
+        try:
+            self.mark_compressed(cursor, 'part')
+            cursor.execute('INSERT OR IGNORE INTO part.compression_dicts SELECT * FROM compression_dicts')
+            conn.commit()
+            while True:
+                # Take the write lock before reading, or a capture committed
+                # in between would make the batch's first delete fail
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('SELECT id FROM chats WHERE timestamp < ? ORDER BY id LIMIT ?', (before, batch))
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    conn.commit()
+                    break
+                self.move_chats(cursor, ARCHIVE_PERIOD, ids, recode=codec)
+                self.extend_partition(cursor, ARCHIVE_PERIOD, ids)
+                conn.commit()
+                moved += len(ids)
+                print(f"  {moved}/{count}", end='\r')
+                time.sleep(pause)
+            
+            self.refresh_partition(cursor, ARCHIVE_PERIOD)
+            cursor.execute("INSERT INTO part.chats_fts(chats_fts) VALUES('optimize')")
+            cursor.execute("INSERT INTO part.code_fts(code_fts) VALUES('optimize')")
+            conn.commit()
+            cursor.execute('PRAGMA part.journal_mode=DELETE')
+            cursor.execute('VACUUM part')
+        finally:
+            cursor.execute('DETACH DATABASE part')
+        print(f"✓ Archived {moved} chat(s)")
+        
+        for table in ('chats_fts', 'code_fts'):
+            steps = self.merge_index(conn, table, pause)
+            print(f"✓ Merged {table} in {steps} step(s)")
+        conn.close()
+        return moved
+    
+    def merge_index(self, conn, table, pause=ARCHIVE_PAUSE, full=True):
+        """
+        Merge a full-text index of the main database into one segment, in
+        steps of ARCHIVE_MERGE_PAGES pages committed one at a time, which
+        also purges the entries of deleted rows.
+        
+        Only the first step asks for every segment to be merged (a
+        negative page count); repeating that while captures add segments
+        between steps corrupts the index in SQLite 3.40, so later steps
+        continue the merge with usermerge lowered to 2 segments. Without
+        full, only those later steps are taken: segments are merged while
+        two share a level, so the largest are rewritten only once another
+        of their size has built up.
+        
+        Returns:
+            The number of steps taken
+        """
+        conn.execute(f"INSERT INTO {table}({table}, rank) VALUES('usermerge', 2)")
+        conn.commit()
+        pages = -ARCHIVE_MERGE_PAGES if full else ARCHIVE_MERGE_PAGES
+        steps = 0
+        while True:
+            changes = conn.total_changes
+            conn.execute(f"INSERT INTO {table}({table}, rank) VALUES('merge', ?)", (pages,))
+            conn.commit()
+            steps += 1
+            pages = ARCHIVE_MERGE_PAGES
+            # A step with nothing left to merge writes at most one row
+            if conn.total_changes - changes < 2:
+                return steps
+            time.sleep(pause)
+    
+    def index_health(self, cursor):
+        """Segments, size and merge settings of each full-text index of the main database"""
+        indexes = {}
+        for table in ('chats_fts', 'code_fts'):
+            # Every segment lists its leaf pages in %_idx, starting with the first
+            cursor.execute(f'SELECT count(DISTINCT segid) FROM {table}_idx')
+            segments = cursor.fetchone()[0]
+            cursor.execute(f'SELECT COALESCE(sum(length(block)), 0) FROM {table}_data')
+            size = cursor.fetchone()[0]
+            index = {'segments': segments, 'bytes': size, 'automerge': 4, 'crisismerge': 16, 'usermerge': 4}
+            cursor.execute(f"SELECT k, v FROM {table}_config WHERE k IN ('automerge', 'crisismerge', 'usermerge')")
+            index.update(cursor.fetchall())
+            indexes[table] = index
+        return indexes
+    
+    def maintain(self, full=False, merge=True, pause=ARCHIVE_PAUSE):
+        """
+        Run the maintenance tasks that are due, recording each in the
+        maintenance table: merge the full-text indexes, ANALYZE every
+        MAINTAIN_ANALYZE_HOURS and check the database and its indexes
+        every MAINTAIN_CHECK_HOURS.
+        
+        Merges go in small committed steps (see merge_index()), so a
+        capture arriving meanwhile waits for one step at most. The
+        connection has no chatcat functions registered: none of the tasks
+        decompresses bodies, and its commits aren't counted as changes.
+        
+        Args:
+            full: Merge each index into one segment and run every task now
+                (the maintain command); otherwise only segments sharing a
+                level are merged
+            merge: Merge at all; idle maintenance skips it when nothing was
+                written since its last run
+        
+        Returns:
+            {task: result} for the tasks run
+        """
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        cursor = conn.cursor()
+        done = {}
+        
+        def due(task, hours):
+            cursor.execute("SELECT 1 FROM maintenance WHERE task = ? AND run_at > datetime('now', ?)",
+                           (task, f'-{hours} hours'))
+            return full or cursor.fetchone() is None
+        
+        def record(task, started, result):
+            cursor.execute('''
+                INSERT OR REPLACE INTO maintenance (task, run_at, seconds, result)
+                VALUES (?, CURRENT_TIMESTAMP, ?, ?)
+            ''', (task, round(time.perf_counter() - started, 3), result))
+            conn.commit()
+            done[task] = result
+        
+        try:
+            if merge or full:
+                before = self.index_health(cursor)
+                for table in ('chats_fts', 'code_fts'):
+                    started = time.perf_counter()
+                    steps = self.merge_index(conn, table, pause, full)
+                    if steps > 1:
+                        segments = self.index_health(cursor)[table]['segments']
+                        result = f"{before[table]['segments']} segment(s) merged into {segments}"
+                        record(f'merge {table}', started, result)
+                        print(f"✓ {table}: {result} in {steps} step(s)")
+            
+            if due('analyze', MAINTAIN_ANALYZE_HOURS):
+                started = time.perf_counter()
+                cursor.execute(f'PRAGMA analysis_limit={MAINTAIN_ANALYZE_ROWS}')
+                cursor.execute('ANALYZE')
+                record('analyze', started, 'ok')
+                print("✓ Query planner statistics refreshed")
+            
+            if due('check', MAINTAIN_CHECK_HOURS):
+                started = time.perf_counter()
+                problems = []
+                for name, sql in (('database', 'PRAGMA quick_check'),
+                                  # Rank 0 checks the index alone, without reading every body
+                                  ('chats_fts', "INSERT INTO chats_fts(chats_fts, rank) VALUES('integrity-check', 0)"),
+                                  ('code_fts', "INSERT INTO code_fts(code_fts, rank) VALUES('integrity-check', 0)")):
+                    try:
+                        problems.extend(f'{name}: {row[0]}' for row in cursor.execute(sql) if row[0] != 'ok')
+                    except sqlite3.DatabaseError as e:
+                        problems.append(f'{name}: {e}')
+                    conn.rollback()
+                result = '; '.join(problems[:10]) or 'ok'
+                record('check', started, result)
+                if problems:
+                    print(f"✗ Integrity check failed: {result}")
+                else:
+                    print("✓ Integrity check passed")
+        finally:
+            conn.close()
+        return done
     
-    def get_full_chat(self, chat_id):
-        """Get full chat details by ID"""
+    def get_health(self):
+        """Full-text index segments and size, file sizes and the last run of each maintenance task"""
         conn = sqlite3.connect(self.db_file)
         cursor = conn.cursor()
+        try:
+            indexes = self.index_health(cursor)
+            cursor.execute('SELECT task, run_at, seconds, result FROM maintenance ORDER BY task')
+            tasks = {task: {'run_at': run_at, 'seconds': seconds, 'result': result}
+                     for task, run_at, seconds, result in cursor.fetchall()}
+        finally:
+            conn.close()
         
-        cursor.execute('''
-            SELECT id, platform, conversation_id, timestamp,
-                   user_message, ai_response, metadata, 
-                   COALESCE(notes, '') as notes, 
-                   COALESCE(tags, '') as tags
-            FROM chats
-            WHERE id = ?
-        ''', (chat_id,))
+        wal = self.db_file + '-wal'
+        return {
+            'indexes': indexes,
+            'maintenance': tasks,
+            'database_bytes': os.path.getsize(self.db_file),
+            'wal_bytes': os.path.getsize(wal) if os.path.exists(wal) else 0
+        }
+    
+    def backup_directory(self, directory=None):
+        """Where snapshots go; relative paths are taken from the database's directory"""
+        return os.path.join(os.path.dirname(os.path.abspath(self.db_file)), directory or BACKUP_DIR)
+    
+    def backup(self, directory=None, keep=BACKUP_KEEP, compress=False,
+               step_pages=BACKUP_STEP_PAGES, pause=BACKUP_PAUSE):
+        """
+        Snapshot the database and its partitions while the server keeps
+        capturing (backup command, POST /api/backup and scheduled backups).
         
-        result = cursor.fetchone()
-        conn.close()
-        return result
+        Each file is copied with SQLite's online backup API, step_pages at
+        a time with a pause between steps. A read transaction is held on
+        the main database for the whole copy: a capture committed mid-copy
+        would otherwise restart it, and under steady captures it would
+        never finish. In WAL mode that read doesn't block captures, and the
+        copy is the database as it was when the backup began. Partitions
+        are rarely written, so their copies are left to restart instead of
+        holding a lock that would. The snapshot is written under a
+        '.partial' name and renamed once complete; names are the UTC time
+        to the second, with '-2', '-3'... added for later ones that second.
+        
+        Args:
+            directory: Directory holding snapshots (default: BACKUP_DIR)
+            keep: Newest snapshots kept afterwards, 0 for all
+            compress: gzip each copied file
+        
+        Returns:
+            The new snapshot as listed by list_backups()
+        
+        Raises:
+            ValueError: Another backup is running in this process
+        """
+        if not self.backup_lock.acquire(blocking=False):
+            raise ValueError('A backup is already running')
+        
+        start = time.perf_counter()
+        directory = self.backup_directory(directory)
+        stem = os.path.splitext(os.path.basename(self.db_file))[0]
+        stamp = f"{stem}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}"
+        sequence = 1
+        try:
+            os.makedirs(directory, exist_ok=True)
+            while True:
+                name = stamp if sequence == 1 else f'{stamp}-{sequence}'
+                partial = os.path.join(directory, name + '.partial')
+                if not os.path.exists(os.path.join(directory, name)):
+                    try:
+                        os.mkdir(partial)
+                        break
+                    except FileExistsError:
+                        pass
+                sequence += 1
+        except OSError:
+            self.backup_lock.release()
+            raise
+        
+        conn = sqlite3.connect(self.db_file, isolation_level=None)
+        try:
+            conn.execute('BEGIN')
+            paths = [row[0] for row in conn.execute('SELECT path FROM partitions ORDER BY period_start')]
+            print(f"▶ Backing up {len(paths) + 1} file(s) to {partial}...")
+            
+            size = 0
+            base = os.path.dirname(os.path.abspath(self.db_file))
+            for path in [os.path.basename(self.db_file)] + paths:
+                if path == os.path.basename(self.db_file):
+                    source = conn
+                else:
+                    source = sqlite3.connect(f"file:{quote(os.path.join(base, path))}?mode=ro", uri=True)
+                target = os.path.join(partial, path)
+                copy = sqlite3.connect(target)
+                try:
+                    source.backup(copy, pages=step_pages, progress=lambda *progress: time.sleep(pause))
+                finally:
+                    copy.close()
+                    if source is conn:
+                        conn.rollback()     # Ends the read, letting checkpoints past it
+                    else:
+                        source.close()
+                if compress:
+                    with open(target, 'rb') as f, gzip.open(target + '.gz', 'wb', compresslevel=6) as out:
+                        shutil.copyfileobj(f, out)
+                    os.remove(target)
+                    target += '.gz'
+                size += os.path.getsize(target)
+            
+            snapshot = os.path.join(directory, name)
+            os.rename(partial, snapshot)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        finally:
+            conn.close()
+            self.backup_lock.release()
+        
+        elapsed = time.perf_counter() - start
+        print(f"✓ Backed up {size / 2**20:.1f} MiB in {elapsed:.1f}s: {snapshot}")
+        
+        snapshots = self.list_backups(directory)
+        if keep > 0:
+            for old in snapshots[keep:]:
+                shutil.rmtree(os.path.join(directory, old['name']), ignore_errors=True)
+                print(f"✓ Removed old snapshot {old['name']}")
+        return next(entry for entry in snapshots if entry['name'] == name)
     
-    def advanced_search(self, query=None, platforms=None, start_date=None, 
-                       end_date=None, tags=None, limit=100, offset=0):
-        """Advanced search with relevance ranking"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+    def list_backups(self, directory=None):
+        """
+        Completed snapshots of this database, newest first.
         
-        where_clauses = []
-        params = []
+        Returns:
+            List of dicts with name, created (UTC), files and bytes
+        """
+        directory = self.backup_directory(directory)
+        stem = os.path.splitext(os.path.basename(self.db_file))[0]
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
         
-        search_terms = []
-        if query:
-            search_terms = [term.strip() for term in query.replace('"', '').split() if term.strip()]
+        snapshots = []
+        for name in names:
+            match = re.fullmatch(re.escape(stem) + r'-(\d{8}-\d{6})(?:-(\d+))?', name)
+            if not match:
+                continue
+            files = os.listdir(os.path.join(directory, name))
+            # Ordered by time, then by the suffix of later snapshots that second
+            snapshots.append(((match.group(1), int(match.group(2) or 1)), {
+                'name': name,
+                'created': datetime.strptime(match.group(1), '%Y%m%d-%H%M%S').strftime('%Y-%m-%d %H:%M:%S'),
+                'files': len(files),
+                'bytes': sum(os.path.getsize(os.path.join(directory, name, f)) for f in files)
+            }))
+        snapshots.sort(key=lambda snapshot: snapshot[0], reverse=True)
+        return [entry for _, entry in snapshots]
+    
+    def get_changes(self, since=0, limit=SYNC_BATCH, device=None):
+        """
+        The chats and tags changed after sequence number since, oldest
+        change first, each with its current state.
         
-        if query:
-            where_clauses.append('c.id IN (SELECT rowid FROM chats_fts WHERE chats_fts MATCH ?)')
-            params.append(query)
+        A chat edited many times is listed once, at its latest change, so
+        a device that was away for a week pulls each changed chat once.
+        Changes pulled from device are left out, as are chats that no
+        longer exist (merged by compact); chats in partitions are read
+        from them.
         
-        if platforms and len(platforms) > 0:
-            placeholders = ','.join('?' * len(platforms))
-            where_clauses.append(f'c.platform IN ({placeholders})')
-            params.extend(platforms)
+        Returns:
+            (changes, cursor, latest) where cursor is the sequence number
+            to pull from next and latest the newest one logged
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT seq, kind, key, origin FROM changes WHERE seq > ? ORDER BY seq LIMIT ?',
+                       (since, limit))
+        entries = cursor.fetchall()
+        logged = [(seq, kind, key) for seq, kind, key, origin in entries if device is None or origin != device]
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changes')
+        latest = cursor.fetchone()[0]
         
-        if start_date:
-            where_clauses.append('c.timestamp >= ?')
-            params.append(start_date)
+        ids = [int(key) for _, kind, key in logged if kind == 'chat']
+        chats = self.sync_rows(cursor, ids)
+        missing = set(ids) - set(chats)
+        for partition in self.get_partitions(cursor) if missing else []:
+            inside = [i for i in missing if partition['min_id'] <= i <= partition['max_id']]
+            if not inside:
+                continue
+            self.attach_partition(cursor, partition['path'])
+            try:
+                chats.update(self.sync_rows(cursor, inside, 'part'))
+            finally:
+                cursor.execute('DETACH DATABASE part')
+            missing -= set(chats)
         
-        if end_date:
-            where_clauses.append('c.timestamp <= ?')
-            params.append(end_date)
+        names = [key for _, kind, key in logged if kind == 'tag']
+        cursor.execute(f'SELECT name, color FROM tags WHERE name IN ({",".join("?" * len(names))})', names)
+        tags = dict(cursor.fetchall())
+        conn.close()
         
-        if tags and len(tags) > 0:
-            tag_conditions = []
-            for tag in tags:
-                tag_conditions.append('c.tags LIKE ?')
-                params.append(f'%{tag}%')
-            where_clauses.append('(' + ' OR '.join(tag_conditions) + ')')
+        changes = []
+        for seq, kind, key in logged:
+            if kind == 'chat' and int(key) in chats:
+                changes.append({'seq': seq, 'kind': 'chat', 'chat': chats[int(key)]})
+            elif kind == 'tag' and key in tags:
+                changes.append({'seq': seq, 'kind': 'tag', 'tag': {'name': key, 'color': tags[key]}})
+        return changes, entries[-1][0] if entries else since, latest
+    
+    def sync_rows(self, cursor, ids, schema='main'):
+        """Full state of chats as sent to peers, by id"""
+        placeholders = ','.join('?' * len(ids))
+        cursor.execute(f'''
+            SELECT c.id, c.platform, c.conversation_id, c.timestamp, c.turn_index,
+                   chatcat_decompress(cc.user_message), chatcat_decompress(cc.ai_response),
+                   cc.metadata, COALESCE(c.notes, ''), COALESCE(c.tags, '')
+            FROM {schema}.chats c JOIN {schema}.chat_content cc ON cc.chat_id = c.id
+            WHERE c.id IN ({placeholders})
+        ''', ids)
+        return {row[0]: {
+            'platform': row[1],
+            'conversation_id': row[2],
+            'timestamp': row[3],
+            'turn_index': row[4],
+            'user_message': row[5],
+            'ai_response': row[6],
+            'metadata': json.loads(row[7]) if row[7] else None,
+            'notes': row[8],
+            'tags': row[9]
+        } for row in cursor.fetchall()}
+    
+    def get_sync_cursor(self, peer):
+        """Sequence number of the peer's change log pulled so far"""
+        conn = self._connect()
+        row = conn.execute('SELECT cursor FROM sync_peers WHERE url = ?', (peer,)).fetchone()
+        conn.close()
+        return row[0] if row else 0
+    
+    def apply_changes(self, changes, peer, next_cursor, origin):
+        """
+        Apply a page of the changes pulled from peer, whose device id is
+        origin, and advance its cursor in the same transaction. Applying a
+        change twice has no effect, so a sync cut short is simply run again.
         
-        where_sql = ' AND '.join(where_clauses) if where_clauses else '1=1'
+        Returns:
+            The number of changes that altered something here
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            applied = 0
+            for change in changes:
+                if change['kind'] == 'chat':
+                    applied += self.apply_chat(conn, cursor, change['chat'], origin)
+                elif change['kind'] == 'tag':
+                    applied += self.apply_tag(cursor, change['tag'], origin)
+            cursor.execute('''
+                INSERT OR REPLACE INTO sync_peers (url, cursor, synced_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', (peer, next_cursor))
+            conn.commit()
+            return applied
+        finally:
+            conn.close()
+    
+    def apply_chat(self, conn, cursor, chat, origin=None):
+        """
+        Store a chat pulled from a peer, matched to a local one by platform,
+        conversation and turn ordinal (or capture time and prompt, for chats
+        captured without one).
         
-        sql = f'''
-            SELECT c.id, c.platform, c.conversation_id, c.timestamp,
-                   c.user_message, c.ai_response, 
-                   COALESCE(c.notes, '') as notes, 
-                   COALESCE(c.tags, '') as tags
-            FROM chats c
-            WHERE {where_sql}
-            ORDER BY c.timestamp DESC
-        '''
-        
-        cursor.execute(sql, params)
-        all_results = cursor.fetchall()
-        
-        if search_terms:
-            results_with_scores = []
-            for row in all_results:
-                user_msg = row[4] or ''
-                ai_resp = row[5] or ''
-                notes = row[6] or ''
-                tags_str = row[7] or ''
-                
-                user_count = self.count_term_occurrences(user_msg, search_terms)
-                ai_count = self.count_term_occurrences(ai_resp, search_terms)
-                notes_count = self.count_term_occurrences(notes, search_terms) * 2
-                tags_count = self.count_term_occurrences(tags_str, search_terms) * 3
-                
-                relevance_score = user_count + ai_count + notes_count + tags_count
-                results_with_scores.append((row, relevance_score))
+        Bodies are replaced only by a capture at least as recent as the one
+        stored; notes and tags always take the peer's. Chats in time
+        partitions only have their notes and tags updated, and archived
+        chats are left alone. Changes are logged with their origin, so they
+        travel on to other devices but not back to the one they came from,
+        and a chat already up to date logs nothing.
+        
+        Returns:
+            Whether anything changed
+        """
+        platform, conversation_id, turn_index = chat['platform'], chat['conversation_id'], chat['turn_index']
+        row_id = self.match_synced(cursor, chat)
+        if row_id is None:
+            for partition in self.get_partitions(cursor, chat['timestamp'], chat['timestamp']):
+                conn.commit()       # ATTACH can't run inside a transaction
+                archived = partition['period'] == ARCHIVE_PERIOD
+                self.attach_partition(cursor, partition['path'], writable=not archived)
+                try:
+                    found_id = self.match_synced(cursor, chat, 'part')
+                    cursor.execute('SELECT id, notes, tags FROM part.chats WHERE id IS ?', (found_id,))
+                    found = cursor.fetchone()
+                    changed = (found is not None and not archived and
+                               (found[1] or '', found[2] or '') != (chat['notes'], chat['tags']))
+                    if changed:
+                        cursor.execute('UPDATE part.chats SET notes = ?, tags = ? WHERE id = ?',
+                                       (chat['notes'], chat['tags'], found[0]))
+                        self.index_terms(cursor, self.extract_terms(chat['notes'], chat['tags']))
+                        self.log_change(cursor, 'chat', found[0], origin)
+                    conn.commit()
+                finally:
+                    cursor.execute('DETACH DATABASE part')
+                if found is not None:
+                    return changed
             
-            results_with_scores.sort(key=lambda x: (-x[1], x[0][3]), reverse=False)
-            sorted_results = [item[0] for item in results_with_scores]
+            row_id, changed, created = self.store_chat(cursor, platform, conversation_id, chat['user_message'],
+                                                       chat['ai_response'], chat['metadata'], turn_index)
+            if changed:
+                # Keep the peer's capture time, which also identifies the chat
+                cursor.execute('UPDATE chats SET timestamp = ? WHERE id = ?', (chat['timestamp'], row_id))
         else:
-            sorted_results = all_results
+            changed = False
+            cursor.execute('''
+                SELECT c.timestamp, chatcat_decompress(cc.user_message), chatcat_decompress(cc.ai_response)
+                FROM chats c LEFT JOIN chat_content cc ON cc.chat_id = c.id WHERE c.id = ?
+            ''', (row_id,))
+            timestamp, user_message, ai_response = cursor.fetchone()
+            if ((user_message, ai_response) != (chat['user_message'], chat['ai_response']) and
+                    chat['timestamp'] >= timestamp):
+                self.replace_bodies(cursor, row_id, platform, chat['user_message'], chat['ai_response'],
+                                    chat['metadata'], self.hash_prompt(chat['user_message']))
+                cursor.execute('UPDATE chats SET timestamp = ? WHERE id = ?', (chat['timestamp'], row_id))
+                changed = True
         
-        total = len(sorted_results)
-        paginated_results = sorted_results[offset:offset + limit]
+        cursor.execute("SELECT COALESCE(notes, ''), COALESCE(tags, '') FROM chats WHERE id = ?", (row_id,))
+        if cursor.fetchone() != (chat['notes'], chat['tags']):
+            cursor.execute('UPDATE chats SET notes = ?, tags = ? WHERE id = ?', (chat['notes'], chat['tags'], row_id))
+            self.index_terms(cursor, self.extract_terms(chat['notes'], chat['tags']))
+            changed = True
+        if changed:
+            self.log_change(cursor, 'chat', row_id, origin)
+        return changed
+    
+    def match_synced(self, cursor, chat, schema='main'):
+        """Id of the local copy of a peer's chat in one database, or None"""
+        if chat['turn_index'] is not None:
+            cursor.execute(f'''
+                SELECT id FROM {schema}.chats WHERE platform = ? AND conversation_id = ? AND turn_index = ?
+            ''', (chat['platform'], chat['conversation_id'], chat['turn_index']))
+            row = cursor.fetchone()
+            return row[0] if row else None
         
-        conn.close()
-        return paginated_results, total, search_terms
+        # Captures without an ordinal can share a second; the prompt tells them apart
+        cursor.execute(f'''
+            SELECT c.id, cc.user_message FROM {schema}.chats c JOIN {schema}.chat_content cc ON cc.chat_id = c.id
+            WHERE c.platform = ? AND c.conversation_id = ? AND c.timestamp = ? AND c.turn_index IS NULL
+        ''', (chat['platform'], chat['conversation_id'], chat['timestamp']))
+        for row_id, user_message in cursor.fetchall():
+            if self.codec.decode(user_message) == chat['user_message']:
+                return row_id
+        return None
+    
+    def apply_tag(self, cursor, tag, origin=None):
+        """Create or recolour a tag pulled from a peer; returns whether anything changed"""
+        cursor.execute('SELECT color FROM tags WHERE name = ?', (tag['name'],))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute('INSERT INTO tags (name, color) VALUES (?, ?)', (tag['name'], tag['color']))
+        elif row[0] != tag['color']:
+            cursor.execute('UPDATE tags SET color = ? WHERE name = ?', (tag['color'], tag['name']))
+        else:
+            return False
+        self.log_change(cursor, 'tag', tag['name'], origin)
+        return True
+    
+    def file_signature(self):
+        """Modification state of the database files, to notice other processes' writes"""
+        signature = []
+        for path in (self.db_file, self.db_file + '-wal'):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+    
+    def get_bootstrap(self, limit=BOOTSTRAP_PAGE):
+        """
+        Everything the dashboard needs for its first paint: tags,
+        platforms, stats and the most recent page of chats.
+        
+        Built once and reused until a commit (here or, judging by the
+        database files, in another process) changes the data, so page
+        loads don't repeat the aggregate queries.
+        """
+        key = (self.data_version, self.file_signature(), limit)
+        with self.snapshot_lock:
+            if self.snapshot is not None and self.snapshot_key == key:
+                return self.snapshot
+            
+            stats = self.get_stats()
+            rows, total, _, _ = self.advanced_search(limit=limit)
+            self.snapshot = {
+                'tags': self.get_all_tags(),
+                'platforms': sorted(stats['by_platform']),
+                'stats': stats,
+                'semantic': self.vectors is not None,
+                'recent': {
+                    'total': total,
+                    'limit': limit,
+                    'results': [format_search_result(row, False) for row in rows]
+                }
+            }
+            # Keyed by the state seen before building: a write that lands
+            # meanwhile makes the next call rebuild
+            self.snapshot_key = key
+            return self.snapshot
     
     def get_platforms(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         cursor = conn.cursor()
-        cursor.execute('SELECT DISTINCT platform FROM chats ORDER BY platform')
-        platforms = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT DISTINCT platform FROM chats')
+        platforms = {row[0] for row in cursor.fetchall()}
+        for partition in self.get_partitions(cursor):
+            platforms.update(json.loads(partition['platforms']))
         conn.close()
-        return platforms
+        return sorted(platforms)
     
     def get_stats(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('SELECT COUNT(*) FROM chats')
@@ -365,22 +4007,177 @@ class ChatDatabase:
         cursor.execute('SELECT MIN(timestamp), MAX(timestamp) FROM chats')
         min_date, max_date = cursor.fetchone()
         
+        # Partitions are counted from the registry, without opening them
+        by_platform = Counter(dict(by_platform))
+        for partition in self.get_partitions(cursor):
+            total += partition['chats']
+            by_platform.update(json.loads(partition['platforms']))
+            min_date = min(min_date or partition['first_timestamp'], partition['first_timestamp'])
+            max_date = max(max_date or partition['last_timestamp'], partition['last_timestamp'])
+        
         conn.close()
         return {
             'total_chats': total,
-            'by_platform': dict(by_platform),
+            'by_platform': dict(by_platform.most_common()),
             'date_range': {'min': min_date, 'max': max_date}
         }
 
 
+def format_search_result(r, ranked):
+    """Turn an advanced_search row into the dict sent to the dashboard"""
+    tags_str = r[7] or ''
+    tags_list = [t.strip() for t in tags_str.split(',') if t.strip()] if tags_str else []
+    
+    return {
+        'id': r[0],
+        'platform': r[1],
+        'conversation_id': r[2],
+        'timestamp': r[3],
+        'user_message': r[4] or '',
+        'ai_response': r[5] or '',
+        'user_length': r[9] or 0,
+        'ai_length': r[10] or 0,
+        'notes': r[6] or '',
+        'tags': tags_list,
+        'relevance': round(r[8], 3) if ranked else 0,
+        'highlights': r[11]
+    }
+
+
+def dump_json(data):
+    """Encode a response value as UTF-8 JSON bytes, with orjson when installed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode('utf-8')
+
+
+def iter_json_chunks(fields, key, items, chunk_bytes=STREAM_CHUNK_BYTES):
+    """
+    Encode {**fields, key: [*items]} as a series of byte chunks.
+    
+    Items are encoded one at a time as the iterable yields them, so neither
+    the whole list nor its whole encoding has to exist in memory at once.
+    """
+    head = dump_json(fields)
+    buffer = bytearray(head[:-1])
+    if fields:
+        buffer += b','
+    buffer += dump_json(key) + b':['
+    
+    for position, item in enumerate(items):
+        if position:
+            buffer += b','
+        buffer += dump_json(item)
+        if len(buffer) >= chunk_bytes:
+            yield bytes(buffer)
+            buffer.clear()
+    
+    buffer += b']}'
+    yield bytes(buffer)
+
+
+class RequestBodyError(Exception):
+    """A request body that can't be accepted; status is the HTTP response code"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LimitedReader(io.RawIOBase):
+    """Read at most length bytes from a stream, so a body never reads past Content-Length"""
+    
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        data = self.stream.read(min(len(buffer), self.remaining))
+        self.remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def check_fields(data, fields):
+    """
+    Check a decoded JSON object against {name: type} before it reaches the
+    database. bool is rejected where int is expected.
+    """
+    if not isinstance(data, dict):
+        raise RequestBodyError(400, 'Expected a JSON object')
+    for name, types in fields.items():
+        value = data.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, types) or (isinstance(value, bool) and types is int):
+            raise RequestBodyError(400, f'Field {name} has the wrong type')
+    return data
+
+
+class ChatCATServer(ThreadingHTTPServer):
+    """
+    Threaded server with a cap on concurrent connections.
+    
+    Persistent connections each hold a thread while open, so connections
+    beyond max_connections are answered with 503 instead of queueing
+    behind idle ones.
+    """
+    daemon_threads = True
+    
+    def __init__(self, server_address, handler_class, max_connections=MAX_CONNECTIONS):
+        super().__init__(server_address, handler_class)
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+    
+    def process_request(self, request, client_address):
+        if not self.connection_slots.acquire(blocking=False):
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n'
+                                b'Retry-After: 1\r\nConnection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        super().process_request(request, client_address)
+    
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connection_slots.release()
+    
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is routine
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
 class ChatCATHandler(BaseHTTPRequestHandler):
-    db = ChatDatabase()
+    db = None       # Set by run_server()
+    ingest = None   # IngestQueue for write-behind captures; None stores them before replying
+    backups = None  # BackupScheduler with the server's snapshot settings
+    max_body_bytes = MAX_BODY_BYTES
+    max_batch_bytes = MAX_BATCH_BYTES
+    
+    # Keep connections open between requests; every response carries a
+    # Content-Length or chunked body. timeout closes idle connections.
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out as separate writes; with Nagle on, a reused
+    # connection stalls on the peer's delayed ACK before the body is sent
+    disable_nagle_algorithm = True
     
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Content-Encoding')
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def do_GET(self):
@@ -392,6 +4189,8 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             self.serve_favicon()
         elif parsed_path.path == '/app.js':
             self.serve_javascript()
+        elif parsed_path.path == '/api/bootstrap':
+            self.serve_bootstrap()
         elif parsed_path.path == '/api/stats':
             self.serve_stats()
         elif parsed_path.path == '/api/platforms':
@@ -402,28 +4201,134 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             self.serve_advanced_search(parsed_path.query)
         elif parsed_path.path == '/api/chat':
             self.serve_full_chat(parsed_path.query)
+        elif parsed_path.path == '/api/related':
+            self.serve_related(parsed_path.query)
+        elif parsed_path.path == '/api/changes':
+            self.serve_changes(parsed_path.query)
+        elif parsed_path.path == '/api/export':
+            self.serve_export(parsed_path.query)
+        elif parsed_path.path == '/api/events':
+            self.serve_events()
+        elif parsed_path.path == '/api/ingest':
+            self.serve_ingest_stats()
+        elif parsed_path.path == '/api/backups':
+            self.serve_backups()
+        elif parsed_path.path == '/api/health':
+            self.serve_health()
         else:
             self.send_error(404)
     
     def do_POST(self):
-        if self.path == '/api/add':
-            self.handle_add_chat()
-        elif self.path == '/api/notes/update':
-            self.handle_update_notes()
-        elif self.path == '/api/tags/update':
-            self.handle_update_tags()
-        elif self.path == '/api/tags/add':
-            self.handle_add_tag()
-        else:
-            self.send_error(404)
+        try:
+            if self.path == '/api/add' and self.is_ndjson():
+                self.handle_add_batch()
+            elif self.path == '/api/add':
+                self.handle_add_chat(self.read_json_body(self.max_body_bytes, ADD_CHAT_FIELDS))
+            elif self.path == '/api/notes/update':
+                self.handle_update_notes(self.read_json_body(MAX_FORM_BYTES, NOTES_FIELDS))
+            elif self.path == '/api/tags/update':
+                self.handle_update_tags(self.read_json_body(MAX_FORM_BYTES, TAGS_FIELDS))
+            elif self.path == '/api/tags/add':
+                self.handle_add_tag(self.read_json_body(MAX_FORM_BYTES, NEW_TAG_FIELDS))
+            elif self.path == '/api/backup':
+                self.handle_backup()
+            else:
+                self.send_error(404)
+        except RequestBodyError as e:
+            print(f"✗ Rejected {self.path} body: {e}")
+            # Part of the body may be unread, so it can't carry another request
+            self.close_connection = True
+            self.send_json_response({'error': str(e)}, e.status)
     
-    def handle_update_notes(self):
-        """Handle notes update request"""
+    def is_ndjson(self):
+        content_type = self.headers.get('Content-Type', '')
+        return content_type.split(';')[0].strip() == 'application/x-ndjson'
+    
+    def open_body(self, limit):
+        """
+        Return a file-like view of the request body, gunzipped when sent
+        with Content-Encoding: gzip.
+        
+        Declared lengths over the limit are refused before anything is read.
+        The connection is closed after a refusal, since the unread body
+        would otherwise be parsed as the next request.
+        """
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.close_connection = True
+            raise RequestBodyError(411, 'Content-Length required')
+        try:
+            length = int(length)
+        except ValueError:
+            self.close_connection = True
+            raise RequestBodyError(400, 'Invalid Content-Length')
+        if length < 0 or length > limit:
+            self.close_connection = True
+            raise RequestBodyError(413, f'Request body exceeds {limit} bytes')
+        
+        body = io.BufferedReader(LimitedReader(self.rfile, length))
+        encoding = self.headers.get('Content-Encoding', 'identity').strip().lower()
+        if encoding == 'gzip':
+            return gzip.GzipFile(fileobj=body)
+        if encoding != 'identity':
+            self.close_connection = True
+            raise RequestBodyError(415, f'Unsupported Content-Encoding {encoding}')
+        return body
+    
+    def read_json_body(self, limit, fields):
+        """Read, size-check and decode a JSON request body"""
+        body = self.open_body(limit)
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
+            # Read one byte past the limit so oversized gzip output is caught
+            # without inflating all of it
+            raw = body.read(limit + 1)
+        except (OSError, EOFError, zlib.error):
+            raise RequestBodyError(400, 'Corrupt gzip body')
+        if len(raw) > limit:
+            self.close_connection = True
+            raise RequestBodyError(413, f'Request body exceeds {limit} bytes')
+        
+        try:
+            data = json.loads(raw.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            raise RequestBodyError(400, 'Invalid JSON')
+        return check_fields(data, fields)
+    
+    def iter_ndjson_body(self):
+        """
+        Yield the objects of an NDJSON body one line at a time.
+        
+        Only the current line is held in memory; each is capped at
+        max_body_bytes and the whole decoded body at max_batch_bytes.
+        """
+        body = self.open_body(self.max_batch_bytes)
+        total = 0
+        line_number = 0
+        while True:
+            try:
+                line = body.readline(self.max_body_bytes + 1)
+            except (OSError, EOFError, zlib.error):
+                raise RequestBodyError(400, 'Corrupt gzip body')
+            if not line:
+                return
+            
+            line_number += 1
+            total += len(line)
+            if len(line) > self.max_body_bytes or total > self.max_batch_bytes:
+                self.close_connection = True
+                raise RequestBodyError(413, f'Line {line_number} exceeds the request size limit')
+            if not line.strip():
+                continue
             
-            data = json.loads(post_data.decode('utf-8'))
+            try:
+                data = json.loads(line.decode('utf-8'))
+            except (UnicodeDecodeError, ValueError):
+                raise RequestBodyError(400, f'Invalid JSON on line {line_number}')
+            yield check_fields(data, ADD_CHAT_FIELDS)
+    
+    def handle_update_notes(self, data):
+        """Handle notes update request"""
+        try:
             chat_id = data.get('chat_id')
             notes = data.get('notes', '')
             
@@ -438,21 +4343,17 @@ class ChatCATHandler(BaseHTTPRequestHandler):
                 'message': 'Notes updated'
             })
             
-        except json.JSONDecodeError as e:
-            print(f"✗ JSON decode error: {e}")
-            self.send_json_response({'error': 'Invalid JSON'}, 400)
+        except ValueError as e:
+            # Archived chats are read-only
+            self.send_json_response({'error': str(e)}, 409)
         except Exception as e:
             print(f"✗ Notes update error: {e}")
             traceback.print_exc()
             self.send_json_response({'error': str(e)}, 500)
     
-    def handle_update_tags(self):
+    def handle_update_tags(self, data):
         """Handle tags update request"""
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            
-            data = json.loads(post_data.decode('utf-8'))
             chat_id = data.get('chat_id')
             tags = data.get('tags', [])
             
@@ -475,21 +4376,17 @@ class ChatCATHandler(BaseHTTPRequestHandler):
                 'tags': tags if isinstance(tags, list) else tags_str.split(',')
             })
             
-        except json.JSONDecodeError as e:
-            print(f"✗ JSON decode error: {e}")
-            self.send_json_response({'error': 'Invalid JSON'}, 400)
+        except ValueError as e:
+            # Archived chats are read-only
+            self.send_json_response({'error': str(e)}, 409)
         except Exception as e:
             print(f"✗ Tags update error: {e}")
             traceback.print_exc()
             self.send_json_response({'error': str(e)}, 500)
     
-    def handle_add_tag(self):
+    def handle_add_tag(self, data):
         """Handle adding a new tag"""
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            
-            data = json.loads(post_data.decode('utf-8'))
             name = data.get('name', '').strip().lower()
             color = data.get('color', '#00FF00')
             
@@ -508,31 +4405,36 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             else:
                 self.send_json_response({'error': 'Tag already exists', 'name': name}, 409)
             
-        except json.JSONDecodeError as e:
-            print(f"✗ JSON decode error: {e}")
-            self.send_json_response({'error': 'Invalid JSON'}, 400)
         except Exception as e:
             print(f"✗ Tag creation error: {e}")
             traceback.print_exc()
             self.send_json_response({'error': str(e)}, 500)
     
-    def handle_add_chat(self):
+    def handle_add_chat(self, data):
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            
-            data = json.loads(post_data.decode('utf-8'))
             platform = data.get('platform')
             conversation_id = data.get('conversation_id')
+            metadata = data.get('metadata')
+            
+            if data.get('turns') is not None:
+                self.handle_add_turns(platform, conversation_id, data['turns'], metadata)
+                return
+            
             user_message = data.get('user_message')
             ai_response = data.get('ai_response')
-            metadata = data.get('metadata')
+            turn_index = data.get('turn_index')
             
             if not all([platform, user_message, ai_response]):
                 self.send_json_response({'error': 'Missing required fields'}, 400)
                 return
             
-            row_id = self.db.add_chat(platform, conversation_id, user_message, ai_response, metadata)
+            if self.ingest is not None:
+                self.queue_exchanges([(platform, conversation_id, user_message, ai_response,
+                                       metadata, turn_index)], 'Chat queued')
+                return
+            
+            row_id = self.db.add_chat(platform, conversation_id, user_message, ai_response, metadata,
+                                      turn_index)
             
             self.send_json_response({
                 'status': 'success',
@@ -542,24 +4444,235 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             
             print(f"✓ Saved chat from {platform} (ID: {row_id})")
             
-        except json.JSONDecodeError:
-            self.send_json_response({'error': 'Invalid JSON'}, 400)
+        except RequestBodyError:
+            raise
         except Exception as e:
             print(f"✗ Add chat error: {e}")
             traceback.print_exc()
             self.send_json_response({'error': str(e)}, 500)
     
+    def handle_add_turns(self, platform, conversation_id, turns, metadata):
+        """Store a batch of conversation turns sent by the userscript"""
+        if not platform or not conversation_id or not isinstance(turns, list):
+            self.send_json_response({'error': 'Missing required fields'}, 400)
+            return
+        
+        valid = []
+        for turn in turns:
+            if not isinstance(turn, dict) or turn.get('index') is None:
+                self.send_json_response({'error': 'Each turn needs an index'}, 400)
+                return
+            check_fields(turn, TURN_FIELDS)
+            if turn.get('user_message') and turn.get('ai_response'):
+                valid.append({
+                    'index': turn['index'],
+                    'user_message': turn['user_message'],
+                    'ai_response': turn['ai_response']
+                })
+        
+        if self.ingest is not None:
+            self.queue_exchanges([(platform, conversation_id, turn['user_message'], turn['ai_response'],
+                                   metadata, turn['index']) for turn in valid], 'Turns queued')
+            return
+        
+        stored = self.db.add_turns(platform, conversation_id, valid, metadata)
+        changed = [{'index': index, 'id': row_id} for index, row_id, was_changed in stored if was_changed]
+        
+        self.send_json_response({
+            'status': 'success',
+            'turns': [{'index': index, 'id': row_id} for index, row_id, _ in stored],
+            'changed': len(changed),
+            'message': 'Turns saved'
+        })
+        
+        if changed:
+            print(f"✓ Saved {len(changed)} turn(s) from {platform} (IDs: {', '.join(str(c['id']) for c in changed)})")
+    
+    def queue_exchanges(self, exchanges, message):
+        """Hand a capture to the write-behind writer and answer 202 (503 when backed up)"""
+        if exchanges and not self.ingest.submit(exchanges):
+            print(f"✗ Ingest queue full, refused a capture of {len(exchanges)} exchange(s)")
+            self.send_json_response({'error': 'Ingest queue is full, retry shortly'}, 503,
+                                    {'Retry-After': '1'})
+            return
+        
+        self.send_json_response({
+            'status': 'accepted',
+            'queued': len(exchanges),
+            'message': message
+        }, 202)
+    
+    def handle_add_batch(self):
+        """
+        Store an NDJSON stream of /api/add records.
+        
+        Each line is a single exchange or a conversation with a turns list.
+        Records are stored INGEST_BATCH at a time as they are parsed; when a
+        line is rejected the records before it are kept and the response
+        says how far the batch got, so resending it is safe.
+        """
+        records = 0
+        stored = 0
+        changed = 0
+        skipped = 0
+        pending = []
+        
+        def flush():
+            nonlocal stored, changed
+            if pending:
+                results = self.db.add_records(pending)
+                stored += sum(1 for row_id, _, _ in results if row_id is not None)
+                changed += sum(1 for _, was_changed, _ in results if was_changed)
+                pending.clear()
+        
+        try:
+            for data in self.iter_ndjson_body():
+                records += 1
+                exchanges = self.exchanges_from(data, records)
+                skipped += not exchanges
+                pending.extend(exchanges)
+                if len(pending) >= INGEST_BATCH:
+                    flush()
+            flush()
+        except RequestBodyError as e:
+            flush()
+            print(f"✗ Rejected {self.path} batch: {e}")
+            self.close_connection = True
+            self.send_json_response({'error': str(e), 'stored': stored, 'changed': changed}, e.status)
+            return
+        except Exception as e:
+            print(f"✗ Batch add error: {e}")
+            traceback.print_exc()
+            self.send_json_response({'error': str(e), 'stored': stored}, 500)
+            return
+        
+        self.send_json_response({
+            'status': 'success',
+            'records': records,
+            'stored': stored,
+            'changed': changed,
+            'skipped': skipped,
+            'message': 'Batch saved'
+        })
+        print(f"✓ Saved batch of {records} record(s): {changed} exchange(s) new or changed")
+    
+    @staticmethod
+    def exchanges_from(data, line_number):
+        """
+        Expand one /api/add record into (platform, conversation_id,
+        user_message, ai_response, metadata, turn_index) tuples, leaving out
+        exchanges without both bodies.
+        """
+        platform = data.get('platform')
+        conversation_id = data.get('conversation_id')
+        metadata = data.get('metadata')
+        if not platform:
+            raise RequestBodyError(400, f'Missing platform on line {line_number}')
+        
+        if data.get('turns') is None:
+            turns = [{'index': data.get('turn_index'), 'user_message': data.get('user_message'),
+                      'ai_response': data.get('ai_response')}]
+        elif conversation_id is None:
+            raise RequestBodyError(400, f'Missing conversation_id on line {line_number}')
+        else:
+            turns = data['turns']
+            for turn in turns:
+                if not isinstance(turn, dict) or turn.get('index') is None:
+                    raise RequestBodyError(400, f'Each turn needs an index (line {line_number})')
+                check_fields(turn, TURN_FIELDS)
+        
+        return [(platform, conversation_id, turn['user_message'], turn['ai_response'],
+                 metadata, turn['index'])
+                for turn in turns if turn.get('user_message') and turn.get('ai_response')]
+    
+    def serve_bootstrap(self):
+        self.send_json_response(self.db.get_bootstrap())
+    
     def serve_stats(self):
-        stats = self.db.get_stats()
-        self.send_json_response(stats)
+        self.send_json_response(self.db.get_bootstrap()['stats'])
     
     def serve_platforms(self):
-        platforms = self.db.get_platforms()
-        self.send_json_response({'platforms': platforms})
+        self.send_json_response({'platforms': self.db.get_bootstrap()['platforms']})
     
     def serve_tags(self):
-        tags = self.db.get_all_tags()
-        self.send_json_response({'tags': tags})
+        self.send_json_response({'tags': self.db.get_bootstrap()['tags']})
+    
+    def serve_ingest_stats(self):
+        """Queue depth and commit batch sizes of the write-behind writer"""
+        if self.ingest is None:
+            self.send_json_response({'mode': 'sync'})
+            return
+        self.send_json_response(dict(self.ingest.get_stats(), mode='write-behind'))
+    
+    def serve_health(self):
+        """Full-text index segments and size, and when maintenance last ran"""
+        self.send_json_response(self.db.get_health())
+    
+    def serve_backups(self):
+        """List the completed snapshots, newest first"""
+        backups = self.backups or BackupScheduler(self.db)
+        self.send_json_response({
+            'directory': self.db.backup_directory(backups.directory),
+            'every_hours': backups.interval / 3600 if backups.interval else None,
+            'keep': backups.keep,
+            'running': self.db.backup_lock.locked(),
+            'snapshots': self.db.list_backups(backups.directory)
+        })
+    
+    def handle_backup(self):
+        """Take a snapshot now, answering once it is complete"""
+        try:
+            snapshot = (self.backups or BackupScheduler(self.db)).take()
+        except ValueError as e:
+            self.send_json_response({'error': str(e)}, 409)
+            return
+        except (OSError, sqlite3.Error) as e:
+            print(f"✗ Backup failed: {e}")
+            self.send_json_response({'error': str(e)}, 500)
+            return
+        self.send_json_response({'status': 'success', 'snapshot': snapshot})
+    
+    def serve_events(self):
+        """
+        Push chat, notes and tag changes to the dashboard as Server-Sent Events.
+        
+        The stream stays open until the client goes away; a comment line is
+        sent when idle so proxies and dead connections are noticed.
+        """
+        broker = self.db.events
+        if broker is None:
+            self.send_error(404)
+            return
+        
+        try:
+            last_id = int(self.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            last_id = broker.last_id
+        
+        self.start_stream('text/event-stream; charset=utf-8', headers={'Cache-Control': 'no-cache'})
+        with broker.condition:
+            broker.listeners += 1
+        try:
+            self.write_chunk(b'retry: 3000\n\n')
+            self.wfile.flush()
+            while True:
+                events = broker.wait(last_id, SSE_HEARTBEAT)
+                if events is None:
+                    # Missed events have left the history; start over
+                    last_id = broker.last_id
+                    events = [(last_id, 'reset', {})]
+                if not events:
+                    self.write_chunk(b': keepalive\n\n')
+                for event_id, kind, data in events:
+                    self.write_chunk(b'id: %d\nevent: %s\ndata: %s\n\n' %
+                                     (event_id, kind.encode('ascii'), dump_json(data)))
+                    last_id = event_id
+                self.wfile.flush()
+        except OSError:
+            self.close_connection = True
+        finally:
+            with broker.condition:
+                broker.listeners -= 1
     
     def serve_favicon(self):
         svg = '''<svg width="64" height="64" viewBox="0 0 64 64" xmlns="http://www.w3.org/2000/svg">
@@ -567,11 +4680,8 @@ class ChatCATHandler(BaseHTTPRequestHandler):
   <text x="32" y="42" font-family="'Courier New', monospace" font-size="28" font-weight="bold" fill="#00FF00" text-anchor="middle">CC</text>
 </svg>'''
         
-        self.send_response(200)
-        self.send_header('Content-type', 'image/svg+xml')
-        self.send_header('Cache-Control', 'public, max-age=31536000')
-        self.end_headers()
-        self.wfile.write(svg.encode('utf-8'))
+        self.send_body('image/svg+xml', svg.encode('utf-8'),
+                       {'Cache-Control': 'public, max-age=31536000'})
     
     def serve_full_chat(self, query_string):
         """Serve full chat details"""
@@ -582,6 +4692,7 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             self.send_json_response({'error': 'Chat ID required'}, 400)
             return
         
+        query = params.get('q', [None])[0]
         result = self.db.get_full_chat(chat_id)
         
         if not result:
@@ -600,72 +4711,206 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             'ai_response': result[5],
             'metadata': json.loads(result[6]) if result[6] else None,
             'notes': result[7] if len(result) > 7 else '',
-            'tags': tags_list
+            'tags': tags_list,
+            'highlights': self.db.get_highlights(chat_id, query) if query else {}
         }
         
         self.send_json_response(chat)
     
+    def serve_changes(self, query_string):
+        """Serve the change log after a cursor, for another device to sync from"""
+        params = parse_qs(query_string)
+        try:
+            since = int(params.get('since', [0])[0])
+            limit = min(int(params.get('limit', [SYNC_BATCH])[0]), SYNC_MAX_BATCH)
+            device = params.get('device', [None])[0]
+        except ValueError:
+            self.send_json_response({'error': 'Numeric since and limit required'}, 400)
+            return
+        
+        changes, cursor, latest = self.db.get_changes(since, limit, device)
+        self.send_json_stream({
+            'device': self.db.device_id,
+            'since': since,
+            'cursor': cursor,
+            'latest': latest,
+            'more': cursor < latest
+        }, 'changes', iter(changes))
+    
+    def serve_related(self, query_string):
+        """Serve the chats most similar to one, by near-duplicate signature"""
+        params = parse_qs(query_string)
+        try:
+            chat_id = int(params.get('id', [''])[0])
+            limit = int(params.get('limit', [10])[0])
+        except ValueError:
+            self.send_json_response({'error': 'Numeric chat ID required'}, 400)
+            return
+        
+        related = self.db.get_related(chat_id, limit)
+        if related is None:
+            self.send_json_response({'error': 'Chat not found'}, 404)
+            return
+        
+        self.send_json_response({
+            'id': chat_id,
+            'results': [dict(format_search_result(row, False), similarity=round(similarity, 3))
+                        for row, similarity in related]
+        })
+    
+    def parse_search_filters(self, params):
+        """Read the filter set shared by /api/search and /api/export"""
+        query = params.get('q', [''])[0] or None
+        mode = params.get('mode', [''])[0]
+        order = 'relevance'
+        semantic = None
+        
+        # Search-as-you-type sends raw input; turn it into a prefix query
+        # and list matches newest first
+        if mode == 'prefix':
+            query = self.db.build_prefix_query(query)
+            order = 'recent'
+        elif mode == 'fuzzy':
+            query = self.db.build_fuzzy_query(query)
+        elif mode in ('semantic', 'hybrid') and query:
+            semantic = query
+            query = self.db.build_any_terms_query(query) if mode == 'hybrid' else None
+        
+        return {
+            'query': query,
+            'platforms': params.get('platforms[]', []) or None,
+            'start_date': params.get('start_date', [None])[0],
+            'end_date': params.get('end_date', [None])[0],
+            'tags': params.get('tags[]', []) or None,
+            'order': order,
+            'semantic': semantic,
+            'collapse': params.get('collapse', [''])[0] in ('1', 'true')
+        }
+    
+    def semantic_unavailable(self, filters):
+        """Answer 400 for semantic and hybrid searches when the index is off"""
+        if filters['semantic'] and self.db.vectors is None:
+            self.send_json_response({'error': 'Semantic search is not enabled; start the server '
+                                              'with --semantic (needs numpy)'}, 400)
+            return True
+        return False
+    
+    def serve_export(self, query_string):
+        """Stream every chat matching the filters as a CSV or JSONL download"""
+        params = parse_qs(query_string)
+        export_format = params.get('format', ['csv'])[0]
+        if export_format not in ('csv', 'jsonl'):
+            self.send_json_response({'error': 'Format must be csv or jsonl'}, 400)
+            return
+        
+        filters = self.parse_search_filters(params)
+        if self.semantic_unavailable(filters):
+            return
+        
+        # The first row is fetched before the headers go out, so a bad query
+        # is a 400 rather than a download cut short
+        rows = self.db.iter_export(**filters)
+        try:
+            first = next(rows, None)
+        except sqlite3.Error as e:
+            rows.close()
+            self.send_json_response({'error': f'Invalid search: {e}'}, 400)
+            return
+        filename = f"chatcat_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+        content_type = 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson'
+        
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            writer.writerow(['id', 'platform', 'conversation_id', 'timestamp',
+                             'user_message', 'ai_response', 'notes', 'tags'])
+        
+        self.start_stream(content_type, filename)
+        try:
+            for row in chain([first] if first is not None else [], rows):
+                if export_format == 'csv':
+                    writer.writerow(row[:6] + row[7:])
+                else:
+                    buffer.write(json.dumps({
+                        'id': row[0],
+                        'platform': row[1],
+                        'conversation_id': row[2],
+                        'timestamp': row[3],
+                        'user_message': row[4],
+                        'ai_response': row[5],
+                        'metadata': json.loads(row[6]) if row[6] else None,
+                        'notes': row[7],
+                        'tags': [t.strip() for t in row[8].split(',') if t.strip()]
+                    }) + '\n')
+                
+                if buffer.tell() >= STREAM_CHUNK_BYTES:
+                    self.write_chunk(buffer.getvalue().encode('utf-8'))
+                    buffer.seek(0)
+                    buffer.truncate()
+            
+            self.write_chunk(buffer.getvalue().encode('utf-8'))
+            self.end_stream()
+        except OSError:
+            # Disconnected or stalled past the timeout; the body is cut short
+            print("✗ Export cancelled by client")
+            self.close_connection = True
+        finally:
+            rows.close()
+    
     def serve_advanced_search(self, query_string):
         """Serve advanced search results with relevance ranking"""
         params = parse_qs(query_string)
-        query = params.get('q', [''])[0] if params.get('q', [''])[0] else None
-        platforms = params.get('platforms[]', [])
-        tags = params.get('tags[]', [])
-        start_date = params.get('start_date', [None])[0]
-        end_date = params.get('end_date', [None])[0]
+        filters = self.parse_search_filters(params)
         limit = int(params.get('limit', [50])[0])
         offset = int(params.get('offset', [0])[0])
+        if params.get('mode', [''])[0] == 'code':
+            self.serve_code_search(params, filters, limit, offset)
+            return
+        if self.semantic_unavailable(filters):
+            return
         
-        results, total, search_terms = self.db.advanced_search(
-            query=query,
-            platforms=platforms if platforms else None,
-            start_date=start_date,
-            end_date=end_date,
-            tags=tags if tags else None,
-            limit=limit,
-            offset=offset
-        )
-        
-        formatted_results = []
-        for r in results:
-            user_msg = r[4] or ''
-            ai_resp = r[5] or ''
-            notes = r[6] or ''
-            tags_str = r[7] or ''
-            
-            relevance = 0
-            if search_terms:
-                relevance = self.db.count_term_occurrences(user_msg, search_terms) + \
-                           self.db.count_term_occurrences(ai_resp, search_terms) + \
-                           self.db.count_term_occurrences(notes, search_terms) * 2 + \
-                           self.db.count_term_occurrences(tags_str, search_terms) * 3
-            
-            tags_list = [t.strip() for t in tags_str.split(',') if t.strip()] if tags_str else []
-            
-            formatted_results.append({
-                'id': r[0],
-                'platform': r[1],
-                'conversation_id': r[2],
-                'timestamp': r[3],
-                'user_message': user_msg,
-                'ai_response': ai_resp,
-                'notes': notes,
-                'tags': tags_list,
-                'relevance': relevance
-            })
+        facets = params.get('facets', [''])[0] in ('1', 'true')
+        results, total, search_terms, counts = self.db.advanced_search(
+            limit=limit, offset=offset, facets=facets, **filters)
+        
+        header = {
+            'query': filters['query'],
+            'search_terms': search_terms,
+            'platforms': filters['platforms'] or [],
+            'start_date': filters['start_date'],
+            'end_date': filters['end_date'],
+            'count': len(results),
+            'total': total,
+            'offset': offset,
+            'limit': limit
+        }
+        if facets:
+            header['facets'] = counts
+        # Pages can carry long previews; each result is encoded and written
+        # as it is formatted instead of dumping the whole response at once
+        self.send_json_stream(header, 'results',
+                              (format_search_result(r, bool(search_terms or filters['semantic'])) for r in results))
+    
+    def serve_code_search(self, params, filters, limit, offset):
+        """Serve matching code blocks only, without the chats' bodies"""
+        query = self.db.build_code_query(filters['query'])
+        language = params.get('language', [None])[0]
+        blocks, total = self.db.search_code(query, filters['platforms'], filters['start_date'],
+                                            filters['end_date'], filters['tags'], language, limit, offset)
         
-        self.send_json_response({
+        self.send_json_stream({
+            'mode': 'code',
             'query': query,
-            'search_terms': search_terms,
-            'platforms': platforms,
-            'start_date': start_date,
-            'end_date': end_date,
-            'count': len(formatted_results),
+            'search_terms': sorted(set(re.findall(r'\w+', query or '')) - {'AND', 'OR', 'NOT'}),
+            'language': language,
+            'platforms': filters['platforms'] or [],
+            'start_date': filters['start_date'],
+            'end_date': filters['end_date'],
+            'count': len(blocks),
             'total': total,
             'offset': offset,
-            'limit': limit,
-            'results': formatted_results
-        })
+            'limit': limit
+        }, 'results', blocks)
     
     def serve_dashboard(self):
         """Serve the fully branded chatCAT dashboard"""
@@ -838,6 +5083,15 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             border-bottom-color: var(--accent-green);
         }
         
+        #search-mode {
+            float: right;
+            background: var(--bg-darker);
+            color: var(--text-secondary);
+            border: 1px solid var(--border-gray);
+            font-family: inherit;
+            font-size: 11px;
+        }
+        
         /* SEGMENTED CONTROL FOR DATES */
         .segmented-control {
             display: flex;
@@ -972,6 +5226,21 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             background: rgba(255,255,255,0.02);
         }
         
+        /* VIRTUALISED RESULT LIST */
+        .results-viewport {
+            height: 70vh;
+            overflow-y: auto;
+            position: relative;
+        }
+        
+        .chat-item.virtual-row {
+            position: absolute;
+            left: 0;
+            right: 0;
+            height: 120px;
+            overflow: hidden;
+        }
+        
         .chat-header {
             display: flex;
             justify-content: space-between;
@@ -1003,6 +5272,16 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             border-radius: 3px;
         }
         
+        .tag-filter {
+            cursor: pointer;
+            opacity: 0.45;
+            margin: 0 6px 6px 0;
+        }
+        
+        .tag-filter.selected {
+            opacity: 1;
+        }
+        
         .tag-badge {
             display: inline-block;
             padding: 2px 6px;
@@ -1123,10 +5402,30 @@ class ChatCATHandler(BaseHTTPRequestHandler):
         }
 
         /* Tags & Notes common styles */
-        .tags-section, .notes-section { margin-top: 30px; padding-top: 20px; border-top: 1px dashed var(--border-gray); }
+        .tags-section, .notes-section, .related-section { margin-top: 30px; padding-top: 20px; border-top: 1px dashed var(--border-gray); }
         .section-header { display: flex; justify-content: space-between; margin-bottom: 15px; }
         .section-header h3 { font-size: 14px; color: var(--text-primary); }
         
+        .code-preview {
+            margin: 0;
+            color: var(--text-secondary);
+            font-size: 12px;
+            line-height: 1.35;
+            white-space: pre;
+            overflow: hidden;
+        }
+        
+        .related-item {
+            padding: 6px 0;
+            font-size: 12px;
+            color: var(--text-secondary);
+            border-bottom: 1px solid var(--border-gray);
+            cursor: pointer;
+        }
+        .related-item:hover { color: var(--text-primary); }
+        .related-similarity { color: var(--accent-green); margin: 0 6px; font-size: 10px; }
+        .collapse-toggle { font-size: 11px; color: var(--text-secondary); margin-right: 10px; cursor: pointer; }
+        
         .tags-container { display: flex; flex-wrap: wrap; gap: 8px; margin-bottom: 15px; }
         .tag-chip {
             padding: 4px 10px;
@@ -1183,7 +5482,15 @@ class ChatCATHandler(BaseHTTPRequestHandler):
                 
                 <div class="filter-group">
                     <div style="margin-bottom: 25px;">
-                        <label class="filter-label">Search Query</label>
+                        <label class="filter-label">Search Query
+                            <select id="search-mode" title="Keyword matches words; fuzzy also matches misspellings; code lists matching code blocks; semantic finds related chats by meaning">
+                                <option value="keyword">Keyword</option>
+                                <option value="fuzzy">Fuzzy</option>
+                                <option value="code">Code</option>
+                                <option value="hybrid" class="semantic-mode" hidden>Hybrid</option>
+                                <option value="semantic" class="semantic-mode" hidden>Semantic</option>
+                            </select>
+                        </label>
                         <input type="text" id="search-query" placeholder="Type to search content, notes, or tags...">
                     </div>
                     
@@ -1215,13 +5522,20 @@ class ChatCATHandler(BaseHTTPRequestHandler):
                     <div class="platform-options" id="platform-options">
                         <div class="loading-message">LOADING...</div>
                     </div>
+                    
+                    <label class="filter-label" style="display: block; margin: 20px 0 10px;">Tags</label>
+                    <div id="tag-filters"></div>
                 </div>
             </div>
             
             <div class="action-bar">
                 <div id="active-filters-container"></div>
                 <div>
-                    <button class="btn-secondary" onclick="exportResults()">Export</button>
+                    <label class="collapse-toggle" title="Show one chat per group of near-identical prompts">
+                        <input type="checkbox" id="collapse-duplicates"> Hide near-duplicates
+                    </label>
+                    <button class="btn-secondary" onclick="exportResults('csv')">Export CSV</button>
+                    <button class="btn-secondary" onclick="exportResults('jsonl')">JSONL</button>
                     <button class="btn-secondary" onclick="clearFilters()">Clear</button>
                     <button class="btn-primary" onclick="performSearch()">Search</button>
                 </div>
@@ -1232,12 +5546,10 @@ class ChatCATHandler(BaseHTTPRequestHandler):
             <div class="results-header">
                 <h2>Results <span style="color: var(--text-secondary); font-size: 12px; margin-left: 10px;" id="result-count"></span></h2>
                 <div class="pagination" id="pagination">
-                    <button onclick="prevPage()">←</button>
                     <span class="page-info" id="page-info" style="font-size: 12px;"></span>
-                    <button onclick="nextPage()">→</button>
                 </div>
             </div>
-            <div id="results-container">
+            <div id="results-container" class="results-viewport">
                 <p class="empty-message" style="text-align: center; color: var(--text-muted); padding: 40px;">
                     Waiting for input...
                 </p>
@@ -1261,90 +5573,162 @@ class ChatCATHandler(BaseHTTPRequestHandler):
 </body>
 </html>'''
         
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        self.send_body('text/html', html.encode('utf-8'), {'Access-Control-Allow-Origin': '*'})
     
     def serve_javascript(self):
         """Serve external JavaScript file"""
         js_content = r'''// chatCAT Dashboard JavaScript v2.4
-let currentPage = 0;
 let pageSize = 50;
 let totalResults = 0;
 let availablePlatforms = [];
 let availableTags = [];
-let currentResults = [];
+let selectedTags = new Set();
 let currentSearchTerms = [];
+let currentQuery = '';
 let currentChatTags = [];
 let currentChatId = null;
 
+// Virtualised result list: fixed-height rows, only those in view are in the
+// DOM, and a bounded cache of fetched pages
+const ROW_HEIGHT = 120;
+const CODE_ROW_LINES = 4;
+const OVERSCAN_ROWS = 5;
+const PREFETCH_PAGES = 1;
+const MAX_CACHED_PAGES = 8;
+// Browsers cap element heights (near 17.9M px in Firefox, 33.5M in Chrome),
+// so past this the spacer stops growing and scroll positions are scaled
+// onto the full list
+const MAX_SPACER_HEIGHT = 10000000;
+let pageCache = new Map();
+let pendingPages = new Set();
+let searchGeneration = 0;
+let currentFilters = null;
+let renderScheduled = false;
+
+// Search-as-you-type: debounce keystrokes and cancel superseded requests
+const SEARCH_DEBOUNCE_MS = 150;
+let searchAbortController = null;
+let searchDebounceTimer = null;
+
+// Live updates: the server pushes changes over /api/events
+let liveEvents = null;
+let currentStats = null;
+let pendingNewResults = 0;
+
 function showError(container, message) {
     container.innerHTML = `<div class="error-message" style="color: #ff4444; padding: 10px;">✗ ${message}</div>`;
 }
 
 async function loadStats() {
-    const container = document.getElementById('stat-grid');
     try {
         const response = await fetch('/api/stats');
-        const data = await response.json();
-        
-        let html = `
+        renderStats(await response.json());
+    } catch (error) {
+        console.error(error);
+    }
+}
+
+function renderStats(data) {
+    const container = document.getElementById('stat-grid');
+    currentStats = data;
+    let html = `
+        <div class="stat-item">
+            <div class="stat-value">${data.total_chats.toLocaleString()}</div>
+            <div class="stat-label">Total Chats</div>
+        </div>
+    `;
+    
+    for (const [platform, count] of Object.entries(data.by_platform)) {
+        html += `
             <div class="stat-item">
-                <div class="stat-value">${data.total_chats.toLocaleString()}</div>
-                <div class="stat-label">Total Chats</div>
+                <div class="stat-value">${count.toLocaleString()}</div>
+                <div class="stat-label">${platform}</div>
             </div>
         `;
-        
-        for (const [platform, count] of Object.entries(data.by_platform)) {
-            html += `
-                <div class="stat-item">
-                    <div class="stat-value">${count.toLocaleString()}</div>
-                    <div class="stat-label">${platform}</div>
-                </div>
-            `;
-        }
-        
-        container.innerHTML = html;
-    } catch (error) {
-        console.error(error);
     }
+    
+    container.innerHTML = html;
 }
 
 async function loadPlatforms() {
-    const container = document.getElementById('platform-options');
     try {
         const response = await fetch('/api/platforms');
         const data = await response.json();
-        availablePlatforms = data.platforms;
-        
-        if (availablePlatforms.length === 0) {
-            container.innerHTML = '<span style="color:#777">No platforms</span>';
-            return;
-        }
-        
-        container.innerHTML = availablePlatforms.map(platform => `
-            <div class="platform-option">
-                <input type="checkbox" id="platform-${platform}" value="${platform}" checked>
-                <label for="platform-${platform}">${platform}</label>
-            </div>
-        `).join('');
+        renderPlatforms(data.platforms);
     } catch (error) {
         console.error(error);
     }
 }
 
+function renderPlatforms(platforms) {
+    const container = document.getElementById('platform-options');
+    availablePlatforms = platforms;
+    
+    if (availablePlatforms.length === 0) {
+        container.innerHTML = '<span style="color:#777">No platforms</span>';
+        return;
+    }
+    
+    container.innerHTML = availablePlatforms.map(platform => `
+        <div class="platform-option">
+            <input type="checkbox" id="platform-${platform}" value="${platform}" checked>
+            <label for="platform-${platform}">${platform}</label>
+        </div>
+    `).join('');
+}
+
 async function loadTags() {
     try {
         const response = await fetch('/api/tags');
         const data = await response.json();
         availableTags = data.tags;
+        renderTagFilters();
+    } catch (error) {
+        console.error(error);
+    }
+}
+
+// First paint: one request for tags, platforms, stats and the most recent
+// chats, shown as the unfiltered result list
+async function loadBootstrap() {
+    try {
+        const response = await fetch('/api/bootstrap');
+        const data = await response.json();
+        availableTags = data.tags;
+        renderTagFilters();
+        renderStats(data.stats);
+        renderPlatforms(data.platforms);
+        if (data.semantic) document.querySelectorAll('.semantic-mode').forEach(option => option.hidden = false);
+        
+        if (currentFilters) return;   // The user already started a search
+        searchGeneration++;
+        searchAbortController = new AbortController();
+        currentFilters = readFilters();
+        totalResults = data.recent.total;
+        pageCache.set(0, data.recent.results);
+        displayResults();
+        displayActiveFilters('', currentFilters.platforms, '', '', []);
     } catch (error) {
         console.error(error);
     }
 }
 
+// Tags to filter by, as chips: a chat must carry every selected one
+function renderTagFilters(facets) {
+    document.getElementById('tag-filters').innerHTML = availableTags.map((tag, index) => {
+        const count = facets ? ` (${(facets.tags[tag.name] || 0).toLocaleString()})` : '';
+        const selected = selectedTags.has(tag.name) ? ' selected' : '';
+        return `<span class="tag-badge tag-filter${selected}" style="color: ${tag.color}; border-color: ${tag.color};"
+                      onclick="toggleTagFilter(availableTags[${index}].name)">${escapeHtml(tag.name)}${count}</span>`;
+    }).join('');
+}
+
+function toggleTagFilter(name) {
+    if (!selectedTags.delete(name)) selectedTags.add(name);
+    renderTagFilters();
+    performSearch();
+}
+
 function selectAllPlatforms() {
     document.querySelectorAll('#platform-options input').forEach(cb => cb.checked = true);
 }
@@ -1378,24 +5762,34 @@ function setDateRange(range, btnElement) {
     document.getElementById('end-date').value = endDate;
 }
 
+// Show next to each platform how many matches it has under the other filters
+function renderFacetCounts(facets) {
+    for (const platform of availablePlatforms) {
+        const label = document.querySelector(`label[for="platform-${CSS.escape(platform)}"]`);
+        if (label) label.textContent = `${platform} (${(facets.platforms[platform] || 0).toLocaleString()})`;
+    }
+    renderTagFilters(facets);
+}
+
 function getSelectedPlatforms() {
     return Array.from(document.querySelectorAll('#platform-options input:checked')).map(cb => cb.value);
 }
 
-function highlightTerms(text, terms) {
+// Render text with the match offsets computed by the server's FTS index
+function renderHighlighted(text, spans) {
     if (!text) return '';
-    if (!terms || terms.length === 0) return escapeHtml(text);
+    if (!spans || spans.length === 0) return escapeHtml(text);
     
-    let result = escapeHtml(text);
-    const sortedTerms = [...terms].sort((a, b) => b.length - a.length);
-    
-    for (const term of sortedTerms) {
-        const escapedTerm = term.replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
-        const regex = new RegExp(`\\b(${escapedTerm})\\b`, 'gi');
-        result = result.replace(regex, '<span class="highlight">$1</span>');
+    const parts = [];
+    let position = 0;
+    for (const [start, end] of spans) {
+        if (start < position) continue;
+        parts.push(escapeHtml(text.slice(position, start)));
+        parts.push(`<span class="highlight">${escapeHtml(text.slice(start, end))}</span>`);
+        position = end;
     }
-    
-    return result;
+    parts.push(escapeHtml(text.slice(position)));
+    return parts.join('');
 }
 
 function getTagColor(tagName) {
@@ -1411,45 +5805,105 @@ function renderTagBadges(tags) {
     }).join('');
 }
 
-async function performSearch(page = 0) {
-    currentPage = page;
-    const container = document.getElementById('results-container');
+function readFilters(incremental = false) {
+    return {
+        query: document.getElementById('search-query').value,
+        platforms: getSelectedPlatforms(),
+        startDate: document.getElementById('start-date').value,
+        endDate: document.getElementById('end-date').value,
+        mode: document.getElementById('search-mode').value,
+        collapse: document.getElementById('collapse-duplicates').checked,
+        tags: [...selectedTags],
+        incremental: incremental
+    };
+}
+
+function filterParams(filters) {
+    let params = '';
+    if (filters.query) params += `&q=${encodeURIComponent(filters.query)}`;
+    // Fuzzy, semantic and hybrid searches take the raw text as typed; code
+    // search lists code blocks even without a query
+    if (filters.mode === 'code') params += '&mode=code';
+    else if (filters.query && filters.mode !== 'keyword') params += `&mode=${filters.mode}`;
+    else if (filters.incremental) params += '&mode=prefix';
+    if (filters.startDate) params += `&start_date=${filters.startDate}`;
+    if (filters.endDate) params += `&end_date=${filters.endDate}`;
+    if (filters.collapse) params += '&collapse=1';
+    filters.platforms.forEach(p => params += `&platforms[]=${encodeURIComponent(p)}`);
+    filters.tags.forEach(t => params += `&tags[]=${encodeURIComponent(t)}`);
+    return params;
+}
+
+// Fetch one page of the current search; stale responses are dropped
+async function fetchPage(page) {
+    if (pageCache.has(page) || pendingPages.has(page)) return;
+    
+    const generation = searchGeneration;
+    const filters = currentFilters;
+    pendingPages.add(page);
     
     try {
-        container.innerHTML = '<div class="loading-message">SEARCHING...</div>';
-        
-        const query = document.getElementById('search-query').value;
-        const platforms = getSelectedPlatforms();
-        const startDate = document.getElementById('start-date').value;
-        const endDate = document.getElementById('end-date').value;
-        
-        let url = `/api/search?limit=${pageSize}&offset=${page * pageSize}`;
-        if (query) url += `&q=${encodeURIComponent(query)}`;
-        if (startDate) url += `&start_date=${startDate}`;
-        if (endDate) url += `&end_date=${endDate}`;
-        platforms.forEach(p => url += `&platforms[]=${encodeURIComponent(p)}`);
-        
-        const response = await fetch(url);
+        let url = `/api/search?limit=${pageSize}&offset=${page * pageSize}${filterParams(filters)}`;
+        // The first page of a settled search brings the counts per platform
+        if (page === 0 && !filters.incremental && filters.mode !== 'code') url += '&facets=1';
+        const response = await fetch(url, { signal: searchAbortController.signal });
         const data = await response.json();
+        if (generation !== searchGeneration) return;
         
-        currentResults = data.results;
+        if (data.facets) renderFacetCounts(data.facets);
         totalResults = data.total;
         currentSearchTerms = data.search_terms || [];
+        currentQuery = data.query || '';
+        pageCache.set(page, data.results);
+        evictPages(page);
+        scheduleRender();
+    } catch (error) {
+        if (error.name !== 'AbortError') throw error;
+    } finally {
+        if (generation === searchGeneration) pendingPages.delete(page);
+    }
+}
+
+// Keep memory bounded: drop the cached pages furthest from the one in view
+function evictPages(centerPage) {
+    if (pageCache.size <= MAX_CACHED_PAGES) return;
+    const byDistance = [...pageCache.keys()].sort((a, b) => Math.abs(b - centerPage) - Math.abs(a - centerPage));
+    byDistance.slice(0, pageCache.size - MAX_CACHED_PAGES).forEach(p => pageCache.delete(p));
+}
+
+async function performSearch(incremental = false) {
+    const container = document.getElementById('results-container');
+    
+    clearTimeout(searchDebounceTimer);
+    if (searchAbortController) searchAbortController.abort();
+    searchAbortController = new AbortController();
+    
+    searchGeneration++;
+    const generation = searchGeneration;
+    pageCache.clear();
+    pendingPages.clear();
+    currentFilters = readFilters(incremental);
+    
+    try {
+        if (!incremental) container.innerHTML = '<div class="loading-message">SEARCHING...</div>';
+        await fetchPage(0);
+        if (generation !== searchGeneration) return;
         
-        displayResults(data.results);
-        displayActiveFilters(query, platforms, startDate, endDate);
-        updatePagination();
+        const { query, platforms, startDate, endDate, tags } = currentFilters;
+        displayResults();
+        displayActiveFilters(query, platforms, startDate, endDate, tags);
     } catch (error) {
         showError(container, error.message);
     }
 }
 
-function displayActiveFilters(query, platforms, startDate, endDate) {
+function displayActiveFilters(query, platforms, startDate, endDate, tags) {
     const container = document.getElementById('active-filters-container');
     const filters = [];
     
-    if (query) filters.push(`"${query}"`);
+    if (query) filters.push(`"${escapeHtml(query)}"`);
     if (platforms.length < availablePlatforms.length) filters.push(`${platforms.length} Platforms`);
+    if (tags.length) filters.push(`Tagged ${tags.map(escapeHtml).join(' + ')}`);
     if (startDate) filters.push(`Date Filter Active`);
     
     if (filters.length === 0) {
@@ -1464,21 +5918,101 @@ function displayActiveFilters(query, platforms, startDate, endDate) {
     `;
 }
 
-function displayResults(results) {
+// Set up the scroll viewport: a spacer sized for every result, with only
+// the rows in view rendered inside it
+function displayResults() {
+    const container = document.getElementById('results-container');
+    pendingNewResults = 0;
     document.getElementById('result-count').textContent = `(${totalResults})`;
     
-    if (results.length === 0) {
-        document.getElementById('results-container').innerHTML = 
+    if (totalResults === 0) {
+        container.innerHTML = 
             '<p class="empty-message" style="text-align: center; color: #777; padding: 40px;">No matches found.</p>';
+        updatePagination(0, 0);
         return;
     }
     
-    const html = results.map(chat => {
-        const userPreview = highlightTerms(chat.user_message.substring(0, 150), currentSearchTerms);
-        const aiPreview = highlightTerms(chat.ai_response.substring(0, 150), currentSearchTerms);
+    container.innerHTML = `<div id="results-spacer" style="position: relative; height: ${spacerHeight()}px;"></div>`;
+    container.scrollTop = 0;
+    renderVisibleRows();
+}
+
+function spacerHeight() {
+    return Math.min(totalResults * ROW_HEIGHT, MAX_SPACER_HEIGHT);
+}
+
+// Scrollable range of the spacer and of the full list it stands for; the
+// two differ only once the spacer is capped
+function scrollRanges(container) {
+    return [Math.max(spacerHeight() - container.clientHeight, 1),
+            Math.max(totalResults * ROW_HEIGHT - container.clientHeight, 1)];
+}
+
+// Offset into the full list for the container's scroll position
+function listScrollTop(container) {
+    const [range, listRange] = scrollRanges(container);
+    return range === listRange ? container.scrollTop : container.scrollTop * listRange / range;
+}
+
+function setListScrollTop(container, top) {
+    const spacer = document.getElementById('results-spacer');
+    if (spacer) spacer.style.height = `${spacerHeight()}px`;
+    const [range, listRange] = scrollRanges(container);
+    container.scrollTop = range === listRange ? top : top * range / listRange;
+}
+
+function scheduleRender() {
+    if (renderScheduled) return;
+    renderScheduled = true;
+    requestAnimationFrame(renderVisibleRows);
+}
+
+function renderVisibleRows() {
+    renderScheduled = false;
+    const container = document.getElementById('results-container');
+    const spacer = document.getElementById('results-spacer');
+    if (!spacer) return;
+    
+    spacer.style.height = `${spacerHeight()}px`;
+    // Rows sit at their place in the full list, shifted into the capped spacer
+    const top = listScrollTop(container);
+    const shift = container.scrollTop - top;
+    const firstVisible = Math.floor(top / ROW_HEIGHT);
+    const lastVisible = Math.min(totalResults - 1,
+        Math.ceil((top + container.clientHeight) / ROW_HEIGHT));
+    const first = Math.max(0, firstVisible - OVERSCAN_ROWS);
+    const last = Math.min(totalResults - 1, lastVisible + OVERSCAN_ROWS);
+    
+    const rows = [];
+    for (let i = first; i <= last; i++) {
+        const page = Math.floor(i / pageSize);
+        const results = pageCache.get(page);
+        const chat = results && results[i % pageSize];
         
-        return `
-        <div class="chat-item" onclick="openChatModal(${chat.id})">
+        if (!chat) {
+            fetchPage(page);
+            rows.push(`<div class="chat-item virtual-row" style="top: ${i * ROW_HEIGHT + shift}px;"><div class="loading-message">LOADING...</div></div>`);
+            continue;
+        }
+        rows.push(renderResultRow(chat, i * ROW_HEIGHT + shift));
+    }
+    
+    // Fetch ahead of the scroll position
+    const aheadPage = Math.floor(last / pageSize) + PREFETCH_PAGES;
+    if (aheadPage * pageSize < totalResults) fetchPage(aheadPage);
+    
+    spacer.innerHTML = rows.join('');
+    updatePagination(firstVisible, lastVisible);
+}
+
+function renderResultRow(chat, top) {
+    if (chat.code !== undefined) return renderCodeRow(chat, top);
+    const highlights = chat.highlights || {};
+    const userPreview = renderHighlighted(chat.user_message, highlights.user_message);
+    const aiPreview = renderHighlighted(chat.ai_response, highlights.ai_response);
+    
+    return `
+        <div class="chat-item virtual-row" style="top: ${top}px;" onclick="openChatModal(${chat.id})">
             <div class="chat-header">
                 <div>
                     <span class="platform-badge">${escapeHtml(chat.platform)}</span>
@@ -1488,17 +6022,37 @@ function displayResults(results) {
                 <span class="timestamp">${new Date(chat.timestamp).toLocaleDateString()}</span>
             </div>
             
-            <div class="preview-text"><strong>You:</strong> ${userPreview}...</div>
-            <div class="preview-text"><strong>AI:</strong> ${aiPreview}...</div>
+            <div class="preview-text"><strong>You:</strong> ${userPreview}</div>
+            <div class="preview-text"><strong>AI:</strong> ${aiPreview}</div>
             
             <div style="margin-top: 5px;">
              ${renderTagBadges(chat.tags)}
             </div>
         </div>
     `;
-    }).join('');
+}
+
+// A code block result: a few lines around the first match, matched lines lit
+function renderCodeRow(block, top) {
+    const lines = block.code.split('\n');
+    const matched = new Set(block.lines);
+    const first = Math.max(0, Math.min((block.lines[0] || 1) - 2, lines.length - CODE_ROW_LINES));
+    const excerpt = lines.slice(first, first + CODE_ROW_LINES).map((line, i) =>
+        matched.has(first + i + 1) ? `<span class="highlight">${escapeHtml(line) || ' '}</span>` : escapeHtml(line)).join('\n');
     
-    document.getElementById('results-container').innerHTML = html;
+    return `
+        <div class="chat-item virtual-row" style="top: ${top}px;" onclick="openChatModal(${block.id})">
+            <div class="chat-header">
+                <div class="chat-badges">
+                    <span class="platform-badge">${escapeHtml(block.platform)}</span>
+                    <span class="relevance-badge">${escapeHtml(block.language || 'code')}</span>
+                    <span class="timestamp">block ${block.position + 1} · ${block.length} chars</span>
+                </div>
+                <span class="timestamp">${new Date(block.timestamp).toLocaleDateString()}</span>
+            </div>
+            <pre class="code-preview">${excerpt}</pre>
+        </div>
+    `;
 }
 
 async function openChatModal(chatId) {
@@ -1510,13 +6064,15 @@ async function openChatModal(chatId) {
     currentChatId = chatId;
     
     try {
-        const response = await fetch(`/api/chat?id=${chatId}`);
+        let url = `/api/chat?id=${chatId}`;
+        if (currentQuery) url += `&q=${encodeURIComponent(currentQuery)}`;
+        const response = await fetch(url);
         const chat = await response.json();
         currentChatTags = (chat.tags || []).filter(t => t && t.trim());
         
-        const userFull = highlightTerms(chat.user_message, currentSearchTerms);
-        const aiFull = highlightTerms(chat.ai_response, currentSearchTerms);
-        const notesHighlighted = chat.notes ? highlightTerms(chat.notes, currentSearchTerms) : '';
+        const highlights = chat.highlights || {};
+        const userFull = renderHighlighted(chat.user_message, highlights.user_message);
+        const aiFull = renderHighlighted(chat.ai_response, highlights.ai_response);
         
         modalBody.innerHTML = `
             <div class="chat-full">
@@ -1552,14 +6108,42 @@ async function openChatModal(chatId) {
                         <button class="btn-primary" style="font-size:11px; padding: 6px 15px;" onclick="saveNotes()">Save Note</button>
                     </div>
                 </div>
+                
+                <div class="related-section">
+                    <div class="section-header"><h3>Related</h3></div>
+                    <div id="related-container"><div class="loading-message">LOADING...</div></div>
+                </div>
             </div>
         `;
+        loadRelated(chatId);
         
     } catch (error) {
         showError(modalBody, error.message);
     }
 }
 
+// Near-duplicates and rephrasings of the open chat
+async function loadRelated(chatId) {
+    const container = document.getElementById('related-container');
+    try {
+        const response = await fetch(`/api/related?id=${chatId}`);
+        const data = await response.json();
+        if (currentChatId !== chatId) return;   // Another chat was opened meanwhile
+        
+        container.innerHTML = data.results && data.results.length
+            ? data.results.map(chat => `
+                <div class="related-item" onclick="openChatModal(${chat.id})">
+                    <span class="platform-badge">${escapeHtml(chat.platform)}</span>
+                    <span class="related-similarity">${Math.round(chat.similarity * 100)}%</span>
+                    ${escapeHtml(chat.user_message.slice(0, 120))}
+                </div>
+            `).join('')
+            : '<div style="font-size:11px; color:#777">No similar chats</div>';
+    } catch (error) {
+        container.innerHTML = '';
+    }
+}
+
 function renderCurrentTagsSection() {
     if (currentChatTags.length === 0) return '<span style="font-size:11px; color:#777">No tags</span>';
     return currentChatTags.map(tag => {
@@ -1595,11 +6179,18 @@ function refreshTagsUI() {
 }
 
 async function saveTagsToServer() {
-    await fetch('/api/tags/update', {
+    const response = await fetch('/api/tags/update', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ chat_id: currentChatId, tags: currentChatTags })
     });
+    if (!response.ok) showEditError(response);
+}
+
+// Edits of archived chats are refused with 409
+async function showEditError(response) {
+    const data = await response.json().catch(() => ({}));
+    document.getElementById('notes-status').textContent = data.error || 'Not saved';
 }
 
 async function createAndAddTag() {
@@ -1614,6 +6205,7 @@ async function createAndAddTag() {
     });
     
     availableTags.push({id:0, name, color});
+    renderTagFilters();
     addTagToChat(name);
     document.getElementById('new-tag-name').value = '';
 }
@@ -1624,11 +6216,16 @@ async function saveNotes() {
     const originalText = btn.textContent;
     btn.textContent = 'Saving...';
     
-    await fetch('/api/notes/update', {
+    const response = await fetch('/api/notes/update', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ chat_id: currentChatId, notes: notes })
     });
+    if (!response.ok) {
+        btn.textContent = originalText;
+        showEditError(response);
+        return;
+    }
     
     btn.textContent = 'Saved!';
     setTimeout(() => btn.textContent = originalText, 1000);
@@ -1643,44 +6240,176 @@ window.onclick = function(event) {
     if (event.target == document.getElementById('chatModal')) closeModal();
 }
 
-function updatePagination() {
-    const totalPages = Math.ceil(totalResults / pageSize) || 1;
-    document.getElementById('page-info').textContent = `${currentPage + 1} / ${totalPages}`;
-}
-
-function prevPage() { if (currentPage > 0) performSearch(currentPage - 1); }
-function nextPage() {
-    const totalPages = Math.ceil(totalResults / pageSize);
-    if (currentPage < totalPages - 1) performSearch(currentPage + 1);
+function updatePagination(firstVisible, lastVisible) {
+    document.getElementById('page-info').textContent = totalResults
+        ? `${firstVisible + 1}-${lastVisible + 1} of ${totalResults.toLocaleString()}`
+        : '';
 }
 
 function clearFilters() {
+    clearTimeout(searchDebounceTimer);
+    if (searchAbortController) searchAbortController.abort();
+    searchGeneration++;
+    pageCache.clear();
+    pendingPages.clear();
+    currentFilters = null;
+    totalResults = 0;
     document.getElementById('search-query').value = '';
+    selectedTags.clear();
+    renderTagFilters();
     setDateRange('all', document.querySelector('.segmented-control button:last-child'));
     selectAllPlatforms();
     document.getElementById('results-container').innerHTML = 
         '<p class="empty-message" style="text-align: center; color: #777; padding: 40px;">Filters cleared.</p>';
     document.getElementById('result-count').textContent = '';
     document.getElementById('active-filters-container').innerHTML = '';
+    document.getElementById('page-info').textContent = '';
 }
 
-function exportResults() {
-    if (currentResults.length === 0) return alert('No results');
-    const csv = [
-        ['Platform', 'Timestamp', 'User Message', 'AI Response'],
-        ...currentResults.map(r => [
-            r.platform, r.timestamp, 
-            r.user_message.replace(/"/g, '""'), 
-            r.ai_response.replace(/"/g, '""')
-        ])
-    ].map(row => row.map(cell => `"${cell}"`).join(',')).join('\n');
-    
+// The server streams the whole result set, so the browser downloads it
+// straight to disk instead of building it in memory
+function exportResults(format = 'csv') {
+    const filters = currentFilters || readFilters();
     const a = document.createElement('a');
-    a.href = URL.createObjectURL(new Blob([csv], { type: 'text/csv' }));
-    a.download = 'chatcat_export.csv';
+    a.href = `/api/export?format=${format}${filterParams(filters)}`;
+    a.download = '';
     a.click();
 }
 
+function connectLiveEvents() {
+    liveEvents = new EventSource('/api/events');
+    liveEvents.addEventListener('chats', event => applyChatEvent(JSON.parse(event.data).chats));
+    liveEvents.addEventListener('notes', event => {
+        const { id, notes } = JSON.parse(event.data);
+        if (updateCachedChat(id, { notes })) scheduleRender();
+    });
+    liveEvents.addEventListener('tags', event => {
+        const { id, tags } = JSON.parse(event.data);
+        if (updateCachedChat(id, { tags })) scheduleRender();
+    });
+    liveEvents.addEventListener('tag', event => {
+        const tag = JSON.parse(event.data);
+        if (!availableTags.some(t => t.id === tag.id)) {
+            availableTags.push(tag);
+            renderTagFilters();
+        }
+    });
+    // Too many changes to send one by one, or events were missed
+    liveEvents.addEventListener('reload', reloadLiveData);
+    liveEvents.addEventListener('reset', reloadLiveData);
+}
+
+// Stored or updated chats arrive as result rows: patch the cached pages,
+// the stats and, for an unfiltered list, put new chats on top
+function applyChatEvent(chats) {
+    const created = chats.filter(chat => chat.created);
+    if (created.length && currentStats) {
+        currentStats.total_chats += created.length;
+        created.forEach(chat => {
+            currentStats.by_platform[chat.platform] = (currentStats.by_platform[chat.platform] || 0) + 1;
+        });
+        renderStats(currentStats);
+        addPlatformOptions(created.map(chat => chat.platform));
+    }
+    
+    const fresh = [];
+    for (const { created: isNew, ...chat } of chats) {
+        if (!updateCachedChat(chat.id, chat) && isNew) fresh.push(chat);
+    }
+    if (fresh.length && currentFilters) {
+        if (isUnfilteredView()) {
+            prependResults(fresh);
+        } else {
+            showNewResultsHint(fresh.length);
+        }
+    }
+    scheduleRender();
+}
+
+function updateCachedChat(id, changes) {
+    for (const results of pageCache.values()) {
+        const index = results.findIndex(chat => chat.id === id);
+        if (index !== -1) {
+            results[index] = Object.assign({}, results[index], changes);
+            return true;
+        }
+    }
+    return false;
+}
+
+function isUnfilteredView() {
+    return !currentFilters.query && currentFilters.mode !== 'code' &&
+        !currentFilters.startDate && !currentFilters.endDate &&
+        !currentFilters.collapse && !currentFilters.tags.length &&
+        currentFilters.platforms.length === availablePlatforms.length;
+}
+
+// Shift the cached rows down by the new ones; only the run of pages from
+// the top can be shifted, the rest is refetched when scrolled to
+function prependResults(chats) {
+    const rows = [...chats];
+    for (let page = 0; pageCache.has(page); page++) rows.push(...pageCache.get(page));
+    const container = document.getElementById('results-container');
+    const top = listScrollTop(container);
+    
+    searchGeneration++;
+    pageCache.clear();
+    pendingPages.clear();
+    totalResults += chats.length;
+    for (let start = 0; start < rows.length; start += pageSize) {
+        const results = rows.slice(start, start + pageSize);
+        if (results.length === pageSize || start + results.length === totalResults) {
+            pageCache.set(start / pageSize, results);
+        }
+    }
+    
+    // Keep the rows in view still when scrolled down
+    if (top > 0) setListScrollTop(container, top + chats.length * ROW_HEIGHT);
+    document.getElementById('result-count').textContent = `(${totalResults})`;
+    if (!document.getElementById('results-spacer')) displayResults();
+}
+
+function showNewResultsHint(count) {
+    pendingNewResults += count;
+    document.getElementById('result-count').innerHTML =
+        `(${totalResults}) <a href="#" onclick="performSearch(); return false;" style="color: var(--accent-green);">+${pendingNewResults} new</a>`;
+}
+
+function addPlatformOptions(platforms) {
+    const container = document.getElementById('platform-options');
+    for (const platform of new Set(platforms)) {
+        if (availablePlatforms.includes(platform)) continue;
+        if (availablePlatforms.length === 0) container.innerHTML = '';
+        availablePlatforms.push(platform);
+        container.insertAdjacentHTML('beforeend', `
+            <div class="platform-option">
+                <input type="checkbox" id="platform-${platform}" value="${platform}" checked>
+                <label for="platform-${platform}">${platform}</label>
+            </div>
+        `);
+        if (currentFilters && currentFilters.platforms.length === availablePlatforms.length - 1) {
+            currentFilters.platforms.push(platform);
+        }
+    }
+}
+
+// Refetch stats and the pages in view, keeping filters and scroll position
+async function reloadLiveData() {
+    try {
+        const response = await fetch('/api/stats');
+        const stats = await response.json();
+        renderStats(stats);
+        addPlatformOptions(Object.keys(stats.by_platform));
+    } catch (error) {
+        console.error(error);
+    }
+    if (!currentFilters) return;
+    searchGeneration++;
+    pageCache.clear();
+    pendingPages.clear();
+    scheduleRender();
+}
+
 function escapeHtml(text) {
     if (!text) return '';
     const div = document.createElement('div');
@@ -1688,33 +6417,157 @@ function escapeHtml(text) {
     return div.innerHTML;
 }
 
+function onSearchInput() {
+    clearTimeout(searchDebounceTimer);
+    searchDebounceTimer = setTimeout(() => performSearch(true), SEARCH_DEBOUNCE_MS);
+}
+
 window.addEventListener('DOMContentLoaded', async function() {
-    await loadTags();
-    loadStats();
-    loadPlatforms();
+    const searchInput = document.getElementById('search-query');
+    searchInput.addEventListener('input', onSearchInput);
+    searchInput.addEventListener('keydown', event => {
+        if (event.key === 'Enter') performSearch();
+    });
+    document.getElementById('search-mode').addEventListener('change', event => {
+        if (searchInput.value || event.target.value === 'code' || currentFilters.mode === 'code') performSearch();
+    });
+    document.getElementById('collapse-duplicates').addEventListener('change', () => performSearch());
+    document.getElementById('results-container').addEventListener('scroll', scheduleRender, { passive: true });
+    window.addEventListener('resize', scheduleRender);
+    await loadBootstrap();
+    connectLiveEvents();
 });
 '''
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/javascript; charset=utf-8')
-        self.send_header('Cache-Control', 'no-cache')
-        self.end_headers()
-        self.wfile.write(js_content.encode('utf-8'))
+        self.send_body('application/javascript; charset=utf-8', js_content.encode('utf-8'),
+                       {'Cache-Control': 'no-cache'})
     
-    def send_json_response(self, data, status=200):
+    def send_body(self, content_type, body, headers=None, status=200):
+        """Send a complete response; Content-Length lets the connection stay open"""
         self.send_response(status)
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_json_response(self, data, status=200, headers=None):
+        self.send_body('application/json', dump_json(data),
+                       dict(headers or {}, **{'Access-Control-Allow-Origin': '*'}), status)
+    
+    def send_json_stream(self, fields, key, items):
+        """Stream a JSON object whose key list is written item by item"""
+        self.start_stream('application/json')
+        for chunk in iter_json_chunks(fields, key, items):
+            self.write_chunk(chunk)
+        self.end_stream()
+    
+    def start_stream(self, content_type, filename=None, headers=None):
+        """
+        Send headers for a response whose length isn't known up front.
+        
+        HTTP/1.1 clients get a chunked body and keep their connection;
+        HTTP/1.0 clients get the raw body delimited by closing it.
+        """
+        self.chunked = self.request_version == 'HTTP/1.1'
+        
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
         self.send_header('Access-Control-Allow-Origin', '*')
+        if filename:
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+    
+    def write_chunk(self, data):
+        """Write part of a streamed response body"""
+        if not data:
+            return
+        if self.chunked:
+            self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+    
+    def end_stream(self):
+        """Finish a streamed response"""
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
     
     def log_message(self, format, *args):
         return
 
 
-def run_server(port=8765):
+def sync_from_peer(db, peer, batch=SYNC_BATCH):
+    """
+    Pull the changes another chatCAT server logged since the last sync
+    from it, one page at a time, and apply each page in one transaction.
+    
+    Returns:
+        (pulled, applied, bytes) counts for this run
+    """
+    peer = peer.rstrip('/')
+    since = db.get_sync_cursor(peer)
+    pulled = applied = received = 0
+    print(f"▶ Syncing from {peer} after change {since}...")
+    
+    while True:
+        url = f'{peer}/api/changes?since={since}&limit={batch}&device={db.device_id}'
+        with urlopen(url, timeout=60) as response:
+            body = response.read()
+        page = json.loads(body)
+        received += len(body)
+        if since > page['latest']:
+            # The peer's database was replaced; its numbering started over
+            print(f"✗ {peer} has no change {since}, pulling everything again")
+            since = 0
+            continue
+        
+        applied += db.apply_changes(page['changes'], peer, page['cursor'], page['device'])
+        pulled += len(page['changes'])
+        since = page['cursor']
+        print(f"  {pulled} pulled, {applied} applied", end='\r')
+        if not page['more']:
+            break
+    
+    print(f"✓ Synced from {peer}: {pulled} change(s) pulled, {applied} applied, "
+          f"{received / 1024:.0f} KiB received (cursor {since})")
+    return pulled, applied, received
+
+
+def run_server(port=8765, db_file=DB_FILE, compression=COMPRESSION,
+               max_body=MAX_BODY_BYTES, max_batch=MAX_BATCH_BYTES,
+               idle_timeout=KEEPALIVE_TIMEOUT, max_connections=MAX_CONNECTIONS, semantic=False,
+               ingest_depth=INGEST_QUEUE_DEPTH, ingest_journal=None,
+               backup_every=None, backup_dir=None, backup_keep=BACKUP_KEEP, backup_compress=False,
+               maintenance=True):
+    ChatCATHandler.db = ChatDatabase(db_file, compression)
+    ChatCATHandler.db.events = EventBroker()
+    if semantic:
+        if numpy is None:
+            print("✗ numpy is not installed, semantic search stays off")
+        else:
+            ChatCATHandler.db.vectors = VectorIndex(ChatCATHandler.db)
+            ChatCATHandler.db.vectors.start()
+    if ingest_depth > 0:
+        ChatCATHandler.ingest = IngestQueue(ChatCATHandler.db, ingest_depth, ingest_journal)
+    ChatCATHandler.backups = BackupScheduler(ChatCATHandler.db, backup_every and backup_every * 3600,
+                                             backup_dir, backup_keep, backup_compress)
+    if backup_every:
+        ChatCATHandler.backups.start()
+    if maintenance:
+        IndexMaintenance(ChatCATHandler.db).start()
+    ChatCATHandler.max_body_bytes = max_body
+    ChatCATHandler.max_batch_bytes = max_batch
+    ChatCATHandler.timeout = idle_timeout
+    ChatCATHandler.db.get_bootstrap()     # Warm the first-paint snapshot
     server_address = ('', port)
-    httpd = HTTPServer(server_address, ChatCATHandler)
+    httpd = ChatCATServer(server_address, ChatCATHandler, max_connections)
     
     print(f"""
 ═══════════════════════════════════════════════
@@ -1735,8 +6588,147 @@ def run_server(port=8765):
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
+        if ChatCATHandler.ingest is not None:
+            print("\n▶ Storing queued captures...")
+            ChatCATHandler.ingest.close()
         print("\n\n✓ chatCAT server stopped")
 
 
+def main():
+    parser = argparse.ArgumentParser(description='chatCAT - AI Chat Cataloguing System')
+    parser.add_argument('--db', default=DB_FILE, help='Database file (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command')
+    
+    serve = commands.add_parser('serve', help='Run the dashboard and capture server (default)')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--compress', choices=['zlib', 'zstd'], default=COMPRESSION,
+                       help='Compress newly captured message bodies')
+    serve.add_argument('--max-body-mb', type=float, default=MAX_BODY_BYTES / 2**20,
+                       help='Largest /api/add body or NDJSON line in MiB (default: %(default)s)')
+    serve.add_argument('--max-batch-mb', type=float, default=MAX_BATCH_BYTES / 2**20,
+                       help='Largest NDJSON batch in MiB (default: %(default)s)')
+    serve.add_argument('--idle-timeout', type=float, default=KEEPALIVE_TIMEOUT,
+                       help='Seconds an idle keep-alive connection stays open (default: %(default)s)')
+    serve.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS,
+                       help='Concurrent connections before new ones get 503 (default: %(default)s)')
+    serve.add_argument('--ingest-queue', type=int, default=INGEST_QUEUE_DEPTH,
+                       help='Captures queued for the background writer; 0 stores each capture '
+                            'before replying (default: %(default)s)')
+    serve.add_argument('--ingest-journal', metavar='FILE',
+                       help='Append queued captures to FILE (fsynced) and replay them after a crash')
+    serve.add_argument('--semantic', action='store_true',
+                       help='Keep a semantic index up to date and allow semantic/hybrid search (needs numpy)')
+    serve.add_argument('--backup-every', type=float, metavar='HOURS',
+                       help='Snapshot the database in the background every HOURS hours')
+    serve.add_argument('--backup-dir', help=f'Directory for snapshots (default: {BACKUP_DIR} beside the database)')
+    serve.add_argument('--backup-keep', type=int, default=BACKUP_KEEP,
+                       help='Newest snapshots kept, 0 for all (default: %(default)s)')
+    serve.add_argument('--backup-compress', action='store_true', help='gzip snapshot files')
+    serve.add_argument('--no-maintenance', action='store_true',
+                       help='Never merge, analyze or check the indexes while idle')
+    
+    compress = commands.add_parser('compress', help='Compress all stored message bodies')
+    compress.add_argument('--codec', choices=['zlib', 'zstd'], default='zlib')
+    compress.add_argument('--train-dicts', action='store_true',
+                          help='Train a shared dictionary per platform first')
+    compress.add_argument('--batch', type=int, default=500)
+    compress.add_argument('--vacuum', action='store_true', help='VACUUM afterwards to shrink the file')
+    
+    decompress = commands.add_parser('decompress', help='Store all message bodies as plain text again')
+    decompress.add_argument('--batch', type=int, default=500)
+    decompress.add_argument('--vacuum', action='store_true', help='VACUUM afterwards')
+    
+    compact = commands.add_parser('compact', help='Merge partial duplicate captures of the same exchange')
+    compact.add_argument('--dry-run', action='store_true', help='Only report what would be merged')
+    
+    commands.add_parser('embed', help='Bring the semantic index up to date (needs numpy)')
+    
+    partition = commands.add_parser('partition', help='Move chats of past months or quarters into a file each')
+    partition.add_argument('--period', choices=sorted(PARTITION_PERIODS), default='month')
+    partition.add_argument('--before', metavar='YYYY-MM-DD',
+                           help='Move chats older than this (default: the start of the current period)')
+    partition.add_argument('--batch', type=int, default=EXPORT_BATCH)
+    partition.add_argument('--vacuum', action='store_true', help='VACUUM afterwards to shrink the main file')
+    
+    archive = commands.add_parser('archive', help='Move old chats into a compressed, read-only archive file')
+    archive.add_argument('--older-than-days', type=int, default=ARCHIVE_AGE_DAYS,
+                         help='Archive chats older than this many days (default: %(default)s)')
+    archive.add_argument('--batch', type=int, default=ARCHIVE_BATCH)
+    archive.add_argument('--pause', type=float, default=ARCHIVE_PAUSE,
+                         help='Seconds to pause between batches so captures are not held up (default: %(default)s)')
+    
+    sync = commands.add_parser('sync', help='Pull chats, notes and tags changed on another chatCAT server')
+    sync.add_argument('peer', help='Address of the other server, e.g. http://desktop:8765')
+    sync.add_argument('--batch', type=int, default=SYNC_BATCH, help='Changes per page (default: %(default)s)')
+    
+    commands.add_parser('maintain', help='Merge the full-text indexes, refresh statistics and check the database now')
+    
+    backup = commands.add_parser('backup', help='Snapshot the database and its partitions, even while serving')
+    backup.add_argument('--dir', help=f'Directory for snapshots (default: {BACKUP_DIR} beside the database)')
+    backup.add_argument('--keep', type=int, default=BACKUP_KEEP,
+                        help='Newest snapshots kept, 0 for all (default: %(default)s)')
+    backup.add_argument('--compress', action='store_true', help='gzip the copied files')
+    backup.add_argument('--step-pages', type=int, default=BACKUP_STEP_PAGES,
+                        help='Pages copied per step (default: %(default)s)')
+    backup.add_argument('--pause', type=float, default=BACKUP_PAUSE,
+                        help='Seconds to pause between steps (default: %(default)s)')
+    
+    args = parser.parse_args()
+    if args.command is None:
+        # No command means serve, with serve's defaults
+        args = parser.parse_args(sys.argv[1:] + ['serve'])
+    
+    if args.command == 'serve':
+        run_server(args.port, args.db, args.compress,
+                   int(args.max_body_mb * 2**20), int(args.max_batch_mb * 2**20),
+                   args.idle_timeout, args.max_connections, args.semantic,
+                   args.ingest_queue, args.ingest_journal,
+                   args.backup_every, args.backup_dir, args.backup_keep, args.backup_compress,
+                   not args.no_maintenance)
+    elif args.command == 'compress':
+        db = ChatDatabase(args.db, args.codec)
+        if args.train_dicts:
+            db.train_dictionaries(db.codec.codec)
+        db.recompress_bodies(db.codec.codec, args.batch)
+        if args.vacuum:
+            db.vacuum()
+    elif args.command == 'compact':
+        ChatDatabase(args.db).compact_duplicates(args.dry_run)
+    elif args.command == 'embed':
+        if numpy is None:
+            sys.exit("✗ numpy is not installed; install it to use semantic search")
+        VectorIndex(ChatDatabase(args.db)).embed_all()
+    elif args.command == 'partition':
+        db = ChatDatabase(args.db)
+        try:
+            db.partition_chats(args.period, args.before, args.batch)
+        except ValueError as e:
+            sys.exit(f"✗ {e}")
+        if args.vacuum:
+            db.vacuum()
+    elif args.command == 'archive':
+        ChatDatabase(args.db).archive_chats(args.older_than_days, args.batch, args.pause)
+    elif args.command == 'sync':
+        try:
+            sync_from_peer(ChatDatabase(args.db), args.peer, args.batch)
+        except OSError as e:
+            sys.exit(f"✗ Could not sync from {args.peer}: {e}")
+    elif args.command == 'maintain':
+        try:
+            ChatDatabase(args.db).maintain(full=True)
+        except sqlite3.Error as e:
+            sys.exit(f"✗ Maintenance failed: {e}")
+    elif args.command == 'backup':
+        try:
+            ChatDatabase(args.db).backup(args.dir, args.keep, args.compress, args.step_pages, args.pause)
+        except (OSError, sqlite3.Error) as e:
+            sys.exit(f"✗ Backup failed: {e}")
+    elif args.command == 'decompress':
+        db = ChatDatabase(args.db)
+        db.recompress_bodies(None, args.batch)
+        if args.vacuum:
+            db.vacuum()
+
+
 if __name__ == '__main__':
-    run_server()
\ No newline at end of file
+    main()
\ No newline at end of file
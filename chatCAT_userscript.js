@@ -28,6 +28,26 @@
     const SERVER_URL = 'http://localhost:8765/api/add';
     const CHECK_INTERVAL = 3000;
     const INDICATOR_CHECK_INTERVAL = 2000;
+    const TURN_STORE_KEY = 'chatcat-sent-turns';
+    const MAX_TRACKED_CONVERSATIONS = 50;
+    const STABLE_DURATION = 5000;  // Last answer must be unchanged this long (ms)
+    const GZIP_MIN_BYTES = 4096;   // Gzip request bodies larger than this
+    
+    // Where each platform's URL (path and query) carries the conversation
+    // id. Pages without one, such as a new chat or an app's start page,
+    // would key unrelated chats' turns the same, so they are sent without
+    // ordinals, one exchange at a time.
+    const CONVERSATION_ID_PATTERNS = {
+        claude: /\/chat\/([0-9a-f-]{36})/,
+        chatgpt: /\/c\/([0-9a-f-]{36})/,
+        gemini: /\/app\/([0-9a-f]{8,})/,
+        grok: /\/chat\/([0-9a-f-]{36})/,
+        deepseek: /\/chat\/s\/([0-9a-f-]{36})/,
+        manus: /\/app\/([A-Za-z0-9]{8,})/,
+        chatllm: /[?&]convoId=([A-Za-z0-9]+)/,
+        perplexity: /\/search\/([^/?#]{8,})/,
+        poe: /\/chat\/([A-Za-z0-9]{4,})/
+    };
     
     // MS-DOS Color Scheme
     const COLORS = {
@@ -47,7 +67,10 @@
     let indicator = null;
     let titleElement = null;
     let countElement = null;
-    let lastCapturedMessage = '';
+    let sentTurns = loadSentTurns();   // "platform:conversation" -> { turnIndex: hash }
+    let pendingConversations = new Set();
+    let lastTurnObservation = {};      // "platform:conversation" -> { index, hash, since }
+    let lastUntrackedHash = {};        // platform -> hash of the last exchange sent without an id
     let captureCount = 0;
     let initAttempts = 0;
     const MAX_INIT_ATTEMPTS = 10;
@@ -144,6 +167,13 @@
         }
     }
 
+    // The conversation id in the current URL, or null when it has none
+    function getConversationId(platform) {
+        const pattern = CONVERSATION_ID_PATTERNS[platform];
+        const match = pattern && pattern.exec(window.location.pathname + window.location.search);
+        return match ? match[1] : null;
+    }
+
     // Detect current platform
     function detectPlatform() {
         const hostname = window.location.hostname;
@@ -159,6 +189,24 @@
         return 'unknown';
     }
 
+    // Text of a message with each code block kept as a fenced block, so
+    // the server can index code separately. textContent alone would run
+    // the code into the surrounding prose.
+    function messageText(el) {
+        const clone = el.cloneNode(true);
+        clone.querySelectorAll('pre').forEach(pre => {
+            const code = pre.querySelector('code') || pre;
+            const match = /(?:^|\s)(?:language|lang)-([\w+#.-]+)/.exec(code.className || '');
+            const text = code.textContent.replace(/\n$/, '');
+            // Outrun any backtick fence inside the code itself
+            const longest = Math.max(2, ...(text.match(/`+/g) || []).map(run => run.length));
+            const fence = '`'.repeat(longest + 1);
+            pre.replaceWith(document.createTextNode(
+                '\n' + fence + (match ? match[1] : '') + '\n' + text + '\n' + fence + '\n'));
+        });
+        return clone.textContent.trim();
+    }
+    
     // Platform-specific capture functions
     const captureFunctions = {
         claude: () => {
@@ -218,9 +266,9 @@
                         clone.querySelectorAll(sel).forEach(e => e.remove());
                     });
                     
-                    textContent = clone.textContent.trim();
+                    textContent = messageText(clone);
                 } else {
-                    textContent = el.textContent.trim();
+                    textContent = messageText(el);
                 }
                 
                 // Clean up UI text and common artifacts
@@ -249,7 +297,7 @@
             
             messageElements.forEach(el => {
                 const role = el.getAttribute('data-message-author-role');
-                let textContent = el.textContent.trim();
+                let textContent = messageText(el);
                 textContent = textContent.replace(/^Copy(code)?/gi, '').trim();
                 
                 if (textContent && role) {
@@ -285,7 +333,7 @@
             userSelectors.forEach(selector => {
                 try {
                     document.querySelectorAll(selector).forEach(el => {
-                        const text = el.textContent.trim();
+                        const text = messageText(el);
                         if (text && text.length > 3) {
                             allMessages.push({
                                 role: 'user',
@@ -300,7 +348,7 @@
             aiSelectors.forEach(selector => {
                 try {
                     document.querySelectorAll(selector).forEach(el => {
-                        let text = el.textContent.trim();
+                        let text = messageText(el);
                         // Remove "Show thinking" prefix if present
                         text = text.replace(/^Show thinking/i, '').trim();
                         if (text && text.length > 20) {
@@ -333,7 +381,7 @@
             
             // Grok uses message-bubble class, role determined by parent's items-end (user) vs items-start (AI)
             document.querySelectorAll('.message-bubble').forEach(el => {
-                const text = el.textContent.trim();
+                const text = messageText(el);
                 if (!text || text.length < 3) return;
                 
                 // Check parent for alignment class to determine role
@@ -365,7 +413,7 @@
             // DeepSeek uses ds-message class
             // User messages have additional class 'd29f3d7d', AI messages don't
             document.querySelectorAll('.ds-message, [class*="ds-message"]').forEach(el => {
-                const text = el.textContent.trim();
+                const text = messageText(el);
                 if (!text || text.length < 3) return;
                 
                 const className = el.className || '';
@@ -390,7 +438,7 @@
             
             allMsgs.forEach(el => {
                 const className = el.className.toLowerCase();
-                const text = el.textContent.trim();
+                const text = messageText(el);
                 
                 if (!text || text.length < 3) return;
                 
@@ -424,7 +472,7 @@
             
             // Find all message containers - look for the prose/markdown content
             document.querySelectorAll('.prose.markdown, [class*="prose"][class*="markdown"]').forEach(el => {
-                const text = el.textContent.trim();
+                const text = messageText(el);
                 if (!text || text.length < 5) return;
                 
                 // Check parent chain for alignment to determine role
@@ -470,7 +518,7 @@
             const answers = document.querySelectorAll('[class*="prose"], [class*="Answer"], .answer-text');
             
             queries.forEach(el => {
-                const text = el.textContent.trim();
+                const text = messageText(el);
                 if (text && text.length > 3) {
                     allMessages.push({
                         role: 'user',
@@ -481,7 +529,7 @@
             });
             
             answers.forEach(el => {
-                const text = el.textContent.trim();
+                const text = messageText(el);
                 if (text && text.length > 50) {
                     if (!el.closest('[class*="query"], [class*="Question"]')) {
                         allMessages.push({
@@ -509,7 +557,7 @@
                 const className = (typeof el.className === 'string') ? el.className : '';
                 if (!className) return;
                 
-                const text = el.textContent.trim();
+                const text = messageText(el);
                 if (!text || text.length < 3) return;
                 
                 // Skip if this is a container with nested messages
@@ -543,65 +591,229 @@
         }
     };
 
-    // Send chat to server using GM_xmlhttpRequest (bypasses CSP)
-    function sendToServer(platform, conversationId, userMessage, aiResponse) {
-        log('Sending to server: ' + platform);
+    // Elements that only exist while a platform is still streaming an answer
+    const streamingIndicators = {
+        claude: ['button[aria-label="Stop response"]', '[data-is-streaming="true"]'],
+        chatgpt: ['button[data-testid="stop-button"]', 'button[aria-label="Stop streaming"]'],
+        gemini: ['button[aria-label="Stop response"]', '.stop-icon'],
+        grok: ['button[aria-label="Stop model response"]'],
+        deepseek: ['[class*="stop-button"]'],
+        manus: ['button[aria-label*="Stop"]'],
+        chatllm: ['button[aria-label*="Stop"]'],
+        perplexity: ['button[aria-label="Stop"]', 'button[data-testid="stop-generating-response-button"]'],
+        poe: ['[class*="StopButton"]', 'button[class*="stopButton"]']
+    };
+
+    // Is the platform still generating a response?
+    function isStreaming(platform) {
+        const selectors = streamingIndicators[platform] || [];
+        return selectors.some(sel => {
+            try {
+                return document.querySelector(sel) !== null;
+            } catch (e) {
+                return false;
+            }
+        });
+    }
+
+    // The last turn is final once no stop button is shown and its text has
+    // not changed for STABLE_DURATION; earlier turns are final by definition
+    function isLastTurnFinal(key, turn, platform) {
+        const now = Date.now();
+        const seen = lastTurnObservation[key];
+
+        if (!seen || seen.index !== turn.index || seen.hash !== turn.hash) {
+            lastTurnObservation[key] = { index: turn.index, hash: turn.hash, since: now };
+            return false;
+        }
+
+        return !isStreaming(platform) && now - seen.since >= STABLE_DURATION;
+    }
+
+    // Load the turn hashes already sent, so a reload does not resend them
+    function loadSentTurns() {
+        try {
+            return JSON.parse(localStorage.getItem(TURN_STORE_KEY)) || {};
+        } catch (e) {
+            return {};
+        }
+    }
+
+    function saveSentTurns() {
+        // Keep only the most recently updated conversations
+        const keys = Object.keys(sentTurns);
+        if (keys.length > MAX_TRACKED_CONVERSATIONS) {
+            keys.sort((a, b) => (sentTurns[a].updated || 0) - (sentTurns[b].updated || 0));
+            keys.slice(0, keys.length - MAX_TRACKED_CONVERSATIONS).forEach(k => delete sentTurns[k]);
+        }
+        try {
+            localStorage.setItem(TURN_STORE_KEY, JSON.stringify(sentTurns));
+        } catch (e) {}
+    }
+
+    // FNV-1a hash - cheap change detection over the full turn text
+    function hashText(text) {
+        let hash = 0x811c9dc5;
+        for (let i = 0; i < text.length; i++) {
+            hash ^= text.charCodeAt(i);
+            hash = Math.imul(hash, 0x01000193);
+        }
+        return (hash >>> 0).toString(16) + ':' + text.length;
+    }
+
+    // Group extracted messages into turns: each user message plus the
+    // assistant output that follows it, numbered by position in the chat
+    function buildTurns(messages) {
+        const turns = [];
+        let current = null;
+
+        messages.forEach(m => {
+            if (m.role === 'user') {
+                current = { index: turns.length, user_message: m.content, ai_parts: [] };
+                turns.push(current);
+            } else if (current) {
+                current.ai_parts.push(m.content);
+            }
+        });
+
+        return turns
+            .filter(t => t.ai_parts.length > 0)
+            .map(t => {
+                const aiResponse = t.ai_parts.join('\n\n');
+                return {
+                    index: t.index,
+                    user_message: t.user_message,
+                    ai_response: aiResponse,
+                    hash: hashText(t.user_message + '\u0000' + aiResponse)
+                };
+            });
+    }
+
+    // Gzip large bodies where the browser supports CompressionStream;
+    // the server inflates them with a size cap
+    async function encodeBody(json) {
+        const headers = { 'Content-Type': 'application/json' };
+        if (json.length < GZIP_MIN_BYTES || typeof CompressionStream === 'undefined') {
+            return { headers: headers, data: json };
+        }
+        
+        const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+        headers['Content-Encoding'] = 'gzip';
+        return { headers: headers, data: await new Response(stream).blob() };
+    }
+
+    // Send new or changed turns to the server in one request; without a
+    // conversation id, the one exchange in turns goes without its ordinal
+    async function sendToServer(platform, conversationId, turns) {
+        const key = platform + ':' + (conversationId || '');
+        log('Sending ' + turns.length + ' turn(s) to server: ' + platform);
+        pendingConversations.add(key);
+        
+        const metadata = {
+            url: window.location.href,
+            timestamp: new Date().toISOString()
+        };
+        const payload = conversationId ? {
+            platform: platform,
+            conversation_id: conversationId,
+            turns: turns.map(t => ({
+                index: t.index,
+                user_message: t.user_message,
+                ai_response: t.ai_response
+            })),
+            metadata: metadata
+        } : {
+            platform: platform,
+            conversation_id: window.location.pathname.split('/').pop() || 'unknown',
+            user_message: turns[0].user_message,
+            ai_response: turns[0].ai_response,
+            metadata: metadata
+        };
+        
+        let body;
+        try {
+            body = await encodeBody(JSON.stringify(payload));
+        } catch (error) {
+            pendingConversations.delete(key);
+            log('Could not encode request: ' + error, 'error');
+            return;
+        }
         
         GM_xmlhttpRequest({
             method: 'POST',
             url: SERVER_URL,
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            data: JSON.stringify({
-                platform: platform,
-                conversation_id: conversationId,
-                user_message: userMessage,
-                ai_response: aiResponse,
-                metadata: {
-                    url: window.location.href,
-                    timestamp: new Date().toISOString()
-                }
-            }),
+            headers: body.headers,
+            data: body.data,
             onload: function(response) {
-                if (response.status === 200) {
-                    captureCount++;
+                pendingConversations.delete(key);
+                // 202: queued for the server's background writer
+                if (response.status === 200 || response.status === 202) {
+                    if (conversationId) {
+                        const sent = sentTurns[key] || (sentTurns[key] = { turns: {} });
+                        turns.forEach(t => { sent.turns[t.index] = t.hash; });
+                        sent.updated = Date.now();
+                        saveSentTurns();
+                    } else {
+                        lastUntrackedHash[platform] = turns[0].hash;
+                    }
+                    
+                    let changed = turns.length;
+                    try {
+                        const result = JSON.parse(response.responseText);
+                        if (response.status === 202) changed = result.queued;
+                        else if (result.changed !== undefined) changed = result.changed;
+                    } catch (e) {}
+                    
+                    captureCount += changed;
                     updateIndicatorText(captureCount);
-                    log('Chat captured successfully', 'success');
+                    log('Captured ' + changed + ' turn(s)', 'success');
+                } else if (response.status === 413) {
+                    log('Conversation exceeds the server size limit', 'error');
+                } else if (response.status === 503) {
+                    // Not marked as sent, so the next check resends it
+                    log('Server busy, will retry', 'warn');
                 } else {
                     log('Server error: ' + response.status, 'error');
                 }
             },
             onerror: function(error) {
+                pendingConversations.delete(key);
                 log('Connection error: ' + JSON.stringify(error), 'error');
             }
         });
     }
 
-    // Process captured messages
+    // Process captured messages: send every turn not yet sent in its
+    // current form (new turns, edits, regenerated answers)
     function processCapturedMessages(messages, platform) {
         if (messages.length < 2) return;
 
-        let userMsg = null;
-        let aiMsg = null;
+        const conversationId = getConversationId(platform);
+        const key = platform + ':' + (conversationId || '');
 
-        for (let i = messages.length - 1; i >= 0; i--) {
-            if (messages[i].role === 'assistant' && !aiMsg) {
-                aiMsg = messages[i].content;
-            } else if (messages[i].role === 'user' && aiMsg && !userMsg) {
-                userMsg = messages[i].content;
-                break;
+        // Wait for the previous delta of this conversation to land
+        if (pendingConversations.has(key)) return;
+
+        const sent = (conversationId && sentTurns[key] && sentTurns[key].turns) || {};
+        const turns = buildTurns(messages);
+        if (turns.length === 0) return;
+
+        // Hold back the newest answer while it is still streaming
+        const lastTurn = turns[turns.length - 1];
+        const lastFinal = isLastTurnFinal(key, lastTurn, platform);
+
+        if (!conversationId) {
+            // No id to key turns on: send the newest exchange once it settles
+            if (lastFinal && lastUntrackedHash[platform] !== lastTurn.hash) {
+                sendToServer(platform, null, [lastTurn]);
             }
+            return;
         }
 
-        if (userMsg && aiMsg) {
-            const messageKey = userMsg.substring(0, 100) + aiMsg.substring(0, 100);
-            
-            if (messageKey !== lastCapturedMessage) {
-                lastCapturedMessage = messageKey;
-                const conversationId = window.location.pathname.split('/').pop() || 'unknown';
-                sendToServer(platform, conversationId, userMsg, aiMsg);
-            }
+        const delta = turns.filter(t => sent[t.index] !== t.hash && (t !== lastTurn || lastFinal));
+
+        if (delta.length > 0) {
+            sendToServer(platform, conversationId, delta);
         }
     }
 
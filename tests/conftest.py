@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from chatCAT_server import ChatDatabase  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    return ChatDatabase(str(tmp_path / 'chats.db'))
+
+
+def count_rows(db, sql='SELECT COUNT(*) FROM chats', params=()):
+    conn = db._connect()
+    try:
+        return conn.execute(sql, params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def partitioned(db):
+    """A database whose March 2025 chats were moved to a monthly partition"""
+    db.add_records([
+        ('claude', 'old1', 'how do I parse json', 'Use ```python\njson.loads(text)\n```', None, 0),
+        ('claude', 'old2', 'sort a list', 'Call ```python\nsorted(items)\n```', None, 0),
+        ('claude', 'new1', 'parse yaml', 'Use ```python\nyaml.safe_load(text)\n```', None, 0),
+    ])
+    conn = db._connect()
+    conn.execute("UPDATE chats SET timestamp = '2025-03-10 12:00:00' WHERE conversation_id LIKE 'old%'")
+    conn.commit()
+    conn.close()
+    db.partition_chats()
+    return db
@@ -0,0 +1,145 @@
+from chatCAT_server import IngestQueue
+from conftest import count_rows
+
+
+def test_add_records_keeps_exchanges_stored_in_one_second(db):
+    results = db.add_records([
+        ('claude', 'conv1', 'first question', 'first answer', None, None),
+        ('claude', 'conv1', 'second question', 'second answer', None, None),
+        ('claude', 'conv1', 'third question', 'third answer', None, None),
+    ])
+    
+    assert count_rows(db) == 3
+    assert [created for _, _, created in results] == [True, True, True]
+    ids = [row_id for row_id, _, _ in results]
+    assert len(set(ids)) == 3
+    assert count_rows(db, f'SELECT COUNT(*) FROM chats WHERE id IN ({",".join("?" * 3)})', ids) == 3
+
+
+def test_add_records_repeated_capture_reports_the_stored_row(db):
+    (first_id, _, _), = db.add_records([('claude', 'conv1', 'question', 'answer', None, None)])
+    (row_id, changed, created), = db.add_records([('claude', 'conv1', 'question', 'answer', None, None)])
+    
+    assert (row_id, changed, created) == (first_id, False, False)
+    assert count_rows(db) == 1
+
+
+def test_add_turns_under_placeholder_id_keeps_every_turn(db):
+    turns = [
+        {'index': 0, 'user_message': 'write a story', 'ai_response': 'Once upon'},
+        {'index': 1, 'user_message': 'continue', 'ai_response': 'a time'},
+        {'index': 2, 'user_message': 'continue', 'ai_response': 'a time there was'},
+    ]
+    stored = db.add_turns('chatgpt', 'new', turns)
+    
+    assert [index for index, _, _ in stored] == [0, 1, 2]
+    assert all(changed for _, _, changed in stored)
+    ids = [row_id for _, row_id, _ in stored]
+    assert len(set(ids)) == 3
+    assert count_rows(db, f'SELECT COUNT(*) FROM chats WHERE id IN ({",".join("?" * 3)})', ids) == 3
+    assert count_rows(db) == 3
+    
+    # Sending the same turns again changes nothing and reports the same rows
+    assert db.add_turns('chatgpt', 'new', turns) == [(index, row_id, False) for index, row_id, _ in stored]
+    assert count_rows(db) == 3
+
+
+def test_add_turns_upserts_turns_of_a_real_conversation(db):
+    conversation = '0f8e6a52-3c1d-4d4e-9b1a-2f6e7d8c9b0a'
+    first = db.add_turns('claude', conversation, [{'index': 0, 'user_message': 'hi', 'ai_response': 'Hel'}])
+    again = db.add_turns('claude', conversation, [{'index': 0, 'user_message': 'hi', 'ai_response': 'Hello!'}])
+    
+    assert again == [(0, first[0][1], True)]
+    assert count_rows(db) == 1
+
+
+def test_add_records_extends_several_partial_captures_in_one_batch(db):
+    db.add_records([
+        ('claude', 'conv1', 'first question', 'The answer', None, None),
+        ('claude', 'conv1', 'second question', 'Another', None, None),
+    ])
+    results = db.add_records([
+        ('claude', 'conv1', 'first question', 'The answer, complete', None, None),
+        ('claude', 'conv1', 'second question', 'Another answer, complete', None, None),
+    ])
+    
+    assert [(changed, created) for _, changed, created in results] == [(True, False), (True, False)]
+    assert count_rows(db) == 2
+
+
+def test_ingest_replay_skips_damaged_journal_lines(db, tmp_path):
+    journal = tmp_path / 'ingest.journal'
+    journal.write_bytes(b'[["claude", "conv1", "question", "answer", null, null]]\n'
+                        b'not json\n'
+                        b'[["claude", "conv1", "second", "answer", null, null], ["too", "short"]]\n'
+                        b'[["claude", "conv1", "torn')
+    ingest = IngestQueue(db, journal=str(journal))
+    ingest.close()
+    
+    assert count_rows(db) == 2
+    assert journal.read_bytes() == b''
+
+
+def test_advanced_search_reports_terms_without_fts_syntax(db):
+    db.add_records([('claude', 'conv1', 'hello world', 'answer', None, None)])
+    
+    results, total, terms, _ = db.advanced_search(db.build_prefix_query('hello wor'))
+    
+    assert total == 1
+    assert terms == ['hello', 'wor']
+    assert db.advanced_search('NEAR("hello" "world", 3) OR notes:^hel*')[2] == ['hello', 'world', 'hel']
+
+
+def test_only_commits_that_changed_rows_bump_the_data_version(db):
+    conn = db._connect()
+    try:
+        conn.execute("INSERT INTO tags (name, color) VALUES ('test-one', '#fff')")
+        conn.commit()
+        version = db.data_version
+        
+        conn.execute('SELECT COUNT(*) FROM chats').fetchone()
+        conn.commit()
+        assert db.data_version == version
+        
+        conn.execute("INSERT INTO tags (name, color) VALUES ('test-two', '#000')")
+        conn.rollback()
+        conn.commit()
+        assert db.data_version == version
+        
+        conn.execute("UPDATE tags SET color = '#111' WHERE name = 'test-one'")
+        conn.commit()
+        assert db.data_version == version + 1
+    finally:
+        conn.close()
+
+
+def test_store_chat_extends_partials_and_drops_late_ones(db):
+    conn = db._connect()
+    try:
+        cursor = conn.cursor()
+        row_id, changed, created = db.store_chat(cursor, 'claude', 'conv1', 'question', 'The answer')
+        assert (changed, created) == (True, True)
+        
+        assert db.store_chat(cursor, 'claude', 'conv1', 'question', 'The answer is longer') == (row_id, True, False)
+        assert db.store_chat(cursor, 'claude', 'conv1', 'question', 'The answer') == (row_id, False, False)
+        conn.commit()
+    finally:
+        conn.close()
+    
+    assert count_rows(db) == 1
+    assert count_rows(db, 'SELECT ai_length FROM chats WHERE id = ?', (row_id,)) == len('The answer is longer')
+
+
+def test_store_chat_keeps_a_turn_whose_prompt_changed(db):
+    conn = db._connect()
+    try:
+        cursor = conn.cursor()
+        first, _, _ = db.store_chat(cursor, 'claude', 'conv1', 'question', 'answer', None, 0)
+        second, changed, created = db.store_chat(cursor, 'claude', 'conv1', 'other question', 'answer', None, 0)
+        conn.commit()
+    finally:
+        conn.close()
+    
+    assert second != first and (changed, created) == (True, True)
+    assert count_rows(db) == 2
+    assert count_rows(db, 'SELECT turn_index FROM chats WHERE id = ?', (first,)) == 0
@@ -0,0 +1,49 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from chatCAT_server import ChatCATHandler, ChatCATServer, EventBroker
+
+
+@pytest.fixture
+def server(db, monkeypatch):
+    db.events = EventBroker()
+    monkeypatch.setattr(ChatCATHandler, 'db', db, raising=False)
+    httpd = ChatCATServer(('127.0.0.1', 0), ChatCATHandler, 4)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def test_export_streams_matching_chats(db, server):
+    db.add_records([('claude', 'conv1', 'hello export', 'answer', None, None),
+                    ('claude', 'conv2', 'unrelated', 'answer', None, None)])
+    
+    status, body = fetch(f'{server}/api/export?format=jsonl&q=export')
+    
+    assert status == 200
+    rows = [json.loads(line) for line in body.decode().splitlines()]
+    assert [row['user_message'] for row in rows] == ['hello export']
+
+
+@pytest.mark.parametrize('query', ['%22unbalanced', 'NEAR(', 'a%20AND'])
+def test_export_rejects_malformed_query_before_streaming(db, server, query):
+    db.add_records([('claude', 'conv1', 'hello export', 'answer', None, None)])
+    
+    status, body = fetch(f'{server}/api/export?format=csv&mode=advanced&q={query}')
+    
+    assert status == 400
+    assert 'Invalid search' in json.loads(body)['error']
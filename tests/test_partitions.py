@@ -0,0 +1,80 @@
+import os
+import sqlite3
+
+import pytest
+
+from conftest import count_rows
+
+
+@pytest.fixture
+def connections(partitioned, monkeypatch):
+    """Every connection the database opens, newest last"""
+    opened = []
+    connect = partitioned._connect
+    
+    def tracked():
+        conn = connect()
+        opened.append(conn)
+        return conn
+    
+    monkeypatch.setattr(partitioned, '_connect', tracked)
+    return opened
+
+
+def drop_partition_table(db, table):
+    path = sqlite3.connect(db.db_file).execute('SELECT path FROM partitions').fetchone()[0]
+    part = sqlite3.connect(os.path.join(os.path.dirname(db.db_file), path))
+    part.execute(f'DROP TABLE {table}')
+    part.commit()
+    part.close()
+
+
+def attached(conn):
+    return [row[1] for row in conn.execute('PRAGMA database_list')]
+
+
+def test_partitioned_chats_leave_the_main_database(partitioned):
+    assert count_rows(partitioned) == 1
+    assert count_rows(partitioned, 'SELECT COUNT(*) FROM partitions') == 1
+
+
+def test_search_merges_main_and_partition_results(partitioned):
+    results, total, _, _ = partitioned.advanced_search('parse')
+    
+    assert total == 2
+    assert sorted(row[2] for row in results) == ['new1', 'old1']
+    
+    # Nothing is left attached between searches
+    assert partitioned.advanced_search('parse')[1] == 2
+    assert partitioned.advanced_search('sort', start_date='2025-03-01', end_date='2025-03-31')[1] == 1
+    assert [row[2] for row in partitioned.iter_export('parse')] == ['new1', 'old1']
+
+
+def test_search_detaches_partition_when_a_query_fails(partitioned, connections):
+    drop_partition_table(partitioned, 'chats_fts')
+    
+    with pytest.raises(sqlite3.OperationalError):
+        partitioned.advanced_search('parse')
+    
+    assert 'part' not in attached(connections[-1])
+
+
+def test_code_search_detaches_partition_when_a_query_fails(partitioned, connections):
+    drop_partition_table(partitioned, 'code_fts')
+    
+    with pytest.raises(sqlite3.OperationalError):
+        partitioned.search_code('parse')
+    
+    assert 'part' not in attached(connections[-1])
+
+
+def test_capture_of_a_partitioned_turn_updates_the_partition(partitioned):
+    (old_id, *_), = partitioned.advanced_search('json')[0]
+    
+    stored = partitioned.add_turns('claude', 'old1', [
+        {'index': 0, 'user_message': 'how do I parse json',
+         'ai_response': 'Use ```python\njson.loads(text)\n``` or json.load for files'}])
+    
+    assert stored == [(0, old_id, True)]
+    assert count_rows(partitioned) == 1
+    assert partitioned.advanced_search('files')[1] == 1